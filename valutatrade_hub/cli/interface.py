@@ -1,34 +1,133 @@
 import argparse
 import cmd
+import csv
+import logging
 import shlex
 import sys
+from datetime import datetime
 
+from ..core.alerts import alert_manager
 from ..core.currencies import get_all_currencies
 from ..core.exceptions import RegistrationError, ValutaTradeException
-from ..core.usecases import PortfolioManager, RateManager, UserManager
+from ..core.holdings import holdings_index
+from ..core.ledger import trade_ledger
+from ..core.orders import ORDER_SIDES, ORDER_TYPES, order_book
+from ..core.risk import CONFIDENCE_LEVELS, RiskEngine
+from ..core.usecases import PortfolioManager, RateManager, UserManager, user_locks
+from ..core.valuation import valuation_history
+from ..infra.database import db
+from ..infra.settings import settings
+from ..logging_config import setup_logging
+from ..parser_service.api_clients import get_all_providers
+from ..parser_service.backfill import Backfill
+from ..parser_service.streaming import (
+    RandomWalkFeed,
+    SocketTickSource,
+    StreamIngestor,
+    parse_address,
+)
 from ..parser_service.updater import RatesUpdater
+from ..tracing import span, tracer
+from .jobs import background_jobs
+from .profiling import CommandProfiler
+
+# Ход фоновых задач сообщается через журнал, а не в приглашение
+_job_logger = logging.getLogger("valutatrade_hub.jobs")
 
 
 class Session:
     current_user = None
+    # Карта идентичности: портфель текущего пользователя и метка версии
+    # portfolios.json, с которой он согласован
+    _portfolio = None
+    _portfolio_version = None
     
     @classmethod
     def login(cls, user):
         cls.current_user = user
+        cls.forget_portfolio()
     
     @classmethod
     def logout(cls):
         cls.current_user = None
+        cls.forget_portfolio()
+    
+    @classmethod
+    def get_portfolio(cls):
+        """Портфель текущего пользователя из кеша сессии.
+
+        Перечитывается, только если portfolios.json изменился извне.
+        """
+        version = db.get_version("portfolios.json")
+        if cls._portfolio is None or version != cls._portfolio_version:
+            cls._portfolio = PortfolioManager.get_user_portfolio(
+                cls.current_user.user_id)
+            cls._portfolio_version = version
+        return cls._portfolio
+    
+    @classmethod
+    def remember_write(cls, success: bool):
+        """Учёт результата операции над портфелем из кеша.
+
+        При успехе объект в памяти уже совпадает с записанным файлом,
+        достаточно запомнить новую метку. При ошибке объект мог быть
+        частично изменён, поэтому он сбрасывается.
+        """
+        if success:
+            cls._portfolio_version = db.last_write_version("portfolios.json")
+        else:
+            cls.forget_portfolio()
+    
+    @classmethod
+    def run_portfolio_operation(cls, operation, *args) -> str:
+        """Выполнить операцию над портфелем из кеша; возвращает сообщение.
+
+        Проверка версии кеша, операция и учёт записи идут под блокировкой
+        пользователя: иначе заявка, исполненная фоновым обновлением курсов,
+        могла бы записать портфель между ними, и устаревший объект из кеша
+        затёр бы её.
+        """
+        user_id = cls.current_user.user_id
+        with user_locks.lock_for(user_id):
+            try:
+                success, message = operation(user_id, *args,
+                                             portfolio=cls.get_portfolio())
+            except Exception:
+                cls.forget_portfolio()
+                raise
+            cls.remember_write(success)
+        return message
+    
+    @classmethod
+    def forget_portfolio(cls):
+        cls._portfolio = None
+        cls._portfolio_version = None
     
     @classmethod
     def is_logged_in(cls):
         return cls.current_user is not None
+    
+    @classmethod
+    def is_admin(cls):
+        return cls.is_logged_in() and \
+            cls.current_user.username in settings.admin_users()
 
 
 # ============================================================================
 # ФУНКЦИИ КОМАНД (только для интерактивной оболочки)
 # ============================================================================
 
+def _require_admin() -> bool:
+    """Сводки по чужим портфелям - только для администраторов"""
+    if not Session.is_logged_in():
+        print("Сначала выполните login")
+        return False
+    if not Session.is_admin():
+        print("Команда доступна только администраторам (настройка ADMIN_USERS)")
+        return False
+    return True
+
+
 def _register_command(args_list):
     """Команда регистрации"""
     parser = argparse.ArgumentParser(prog="register", add_help=False)
@@ -49,6 +148,43 @@ def _register_command(args_list):
         print(f"Ошибка: {str(e)}")
 
 
+def _import_users_command(args_list):
+    """Команда массовой регистрации пользователей из файла"""
+    parser = argparse.ArgumentParser(prog="import_users", add_help=False)
+    parser.add_argument("--file", required=True)
+    parser.add_argument("--format", choices=["csv", "jsonl"])
+    parser.add_argument("--workers", type=int)
+    
+    try:
+        args = parser.parse_args(args_list)
+        
+        fmt = args.format
+        if fmt is None:
+            fmt = "jsonl" if args.file.endswith((".jsonl", ".json")) else "csv"
+        
+        with open(args.file, 'r', encoding='utf-8', newline='') as f:
+            result = UserManager.register_users_bulk(f, fmt, args.workers)
+        
+        if result["created"]:
+            last_id = result["first_id"] + result["created"] - 1
+            print(f"Зарегистрировано пользователей: {result['created']} "
+                  f"(id {result['first_id']}-{last_id})")
+        else:
+            print("Новых пользователей нет")
+        
+        skipped = result["skipped"]
+        if skipped:
+            print(f"Пропущено записей: {len(skipped)}")
+            for line_no, reason in skipped[:10]:
+                print(f"  строка {line_no}: {reason}")
+            if len(skipped) > 10:
+                print(f"  ... и ещё {len(skipped) - 10}")
+    except SystemExit:
+        pass  # Игнорируем выход из парсера
+    except Exception as e:
+        print(f"Ошибка: {str(e)}")
+
+
 def _login_command(args_list):
     """Команда входа"""
     parser = argparse.ArgumentParser(prog="login", add_help=False)
@@ -81,7 +217,7 @@ def _show_portfolio_command(args_list):
         args = parser.parse_args(args_list)
         
         user = Session.current_user
-        portfolio = PortfolioManager.get_user_portfolio(user.user_id)
+        portfolio = Session.get_portfolio()
         
         if not portfolio or not portfolio.wallets:
             print("Ваш портфель пуст")
@@ -105,6 +241,182 @@ def _show_portfolio_command(args_list):
         print(f"Ошибка: {str(e)}")
 
 
+def _portfolio_history_command(args_list):
+    """Команда истории стоимости портфеля"""
+    if not Session.is_logged_in():
+        print("Сначала выполните login")
+        return
+    
+    parser = argparse.ArgumentParser(prog="history", add_help=False)
+    parser.add_argument("--from", dest="start",
+                        help="Начало периода (ISO, например 2026-01-15)")
+    parser.add_argument("--to", dest="end", help="Конец периода (ISO)")
+    
+    try:
+        args = parser.parse_args(args_list)
+        
+        start = datetime.fromisoformat(args.start).timestamp() \
+            if args.start else None
+        end = datetime.fromisoformat(args.end).timestamp() if args.end else None
+        
+        user = Session.current_user
+        points = valuation_history.get_range(user.user_id, start, end)
+        
+        if not points:
+            print("История стоимости портфеля пуста")
+            return
+        
+        print(f"\nСтоимость портфеля '{user.username}' в USD:")
+        print("-" * 40)
+        for timestamp, value in points:
+            moment = datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+            print(f"{moment}: {value:.2f}")
+    except SystemExit:
+        pass
+    except Exception as e:
+        print(f"Ошибка: {str(e)}")
+
+
+def _trades_command(args_list):
+    """Команда журнала сделок"""
+    if not Session.is_logged_in():
+        print("Сначала выполните login")
+        return
+    
+    parser = argparse.ArgumentParser(prog="trades", add_help=False)
+    parser.add_argument("--currency", help="Только сделки по указанной валюте")
+    
+    try:
+        args = parser.parse_args(args_list)
+        
+        currency = args.currency.upper() if args.currency else None
+        trades = trade_ledger.get_trades(Session.current_user.user_id, currency)
+        
+        if not trades:
+            print("Сделок нет")
+            return
+        
+        print("\nЖурнал сделок:")
+        print("-" * 60)
+        for trade in trades:
+            moment = datetime.fromtimestamp(trade["timestamp"])
+            print(f"#{trade['trade_id']} {moment:%Y-%m-%d %H:%M:%S} "
+                  f"{trade['side']} {trade['amount']:.4f} {trade['currency_code']} "
+                  f"по {trade['rate']:.6f} = {trade['total_usd']:.2f} USD")
+    except SystemExit:
+        pass
+    except Exception as e:
+        print(f"Ошибка: {str(e)}")
+
+
+def _pnl_command(args_list):
+    """Команда прибыли и убытков"""
+    if not Session.is_logged_in():
+        print("Сначала выполните login")
+        return
+    
+    try:
+        user = Session.current_user
+        portfolio = Session.get_portfolio()
+        
+        rates = db.read_json("rates.json")
+        pairs = rates.get("pairs", {}) if isinstance(rates, dict) else {}
+        
+        print(f"\nP&L пользователя '{user.username}' (USD):")
+        print("-" * 40)
+        
+        unrealized_total = 0.0
+        for code in (portfolio.wallets if portfolio else {}):
+            rate_info = pairs.get(f"{code}_USD")
+            if code == "USD" or not rate_info:
+                continue
+            unrealized = trade_ledger.unrealized_pnl(
+                user.user_id, code, rate_info["rate"])
+            realized = trade_ledger.realized_pnl(user.user_id, code)
+            unrealized_total += unrealized
+            print(f"{code}: реализованный {realized:.2f}, "
+                  f"нереализованный {unrealized:.2f}")
+        
+        print("-" * 40)
+        print(f"Реализованный: {trade_ledger.realized_pnl(user.user_id):.2f}")
+        print(f"Нереализованный: {unrealized_total:.2f}")
+    except Exception as e:
+        print(f"Ошибка: {str(e)}")
+
+
+def _print_risk(result):
+    for level in CONFIDENCE_LEVELS:
+        percent = round(level * 100)
+        print(f"VaR {percent}%: {result[f'var{percent}']:.2f}   "
+              f"ES {percent}%: {result[f'es{percent}']:.2f}")
+
+
+def _risk_command(args_list):
+    """Команда оценки риска портфеля"""
+    if not Session.is_logged_in():
+        print("Сначала выполните login")
+        return
+    
+    try:
+        user = Session.current_user
+        portfolio = Session.get_portfolio()
+        if not portfolio:
+            print("Портфель не найден")
+            return
+        
+        engine = RiskEngine.from_history()
+        result = engine.evaluate([portfolio.to_dict()])[0]
+        
+        print(f"\nРиск портфеля '{user.username}' на 1 день (USD):")
+        print(f"Историческое моделирование: {engine.scenario_count} сценариев")
+        print("-" * 40)
+        print(f"Стоимость: {result['value']:.2f}")
+        _print_risk(result)
+    except Exception as e:
+        print(f"Ошибка: {str(e)}")
+
+
+def _risk_report_command(args_list):
+    """Команда отчёта о риске по всем портфелям"""
+    if not _require_admin():
+        return
+    
+    parser = argparse.ArgumentParser(prog="risk_report", add_help=False)
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--workers", type=int)
+    
+    try:
+        args = parser.parse_args(args_list)
+        
+        engine = RiskEngine.from_history()
+        results = engine.evaluate(db.read_json("portfolios.json"),
+                                  workers=args.workers)
+        
+        fields = ["user_id", "value"] + [
+            f"{measure}{round(level * 100)}"
+            for level in CONFIDENCE_LEVELS for measure in ("var", "es")
+        ]
+        with open(args.output, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            for result in results:
+                writer.writerow({
+                    key: value if key == "user_id" else f"{value:.2f}"
+                    for key, value in result.items()
+                })
+        
+        print(f"Отчёт о риске: {len(results)} портфелей, "
+              f"{engine.scenario_count} сценариев -> {args.output}")
+        if results:
+            worst = max(results, key=lambda result: result["var99"])
+            print(f"Наибольший VaR 99%: {worst['var99']:.2f} "
+                  f"(пользователь {worst['user_id']})")
+    except SystemExit:
+        pass  # Игнорируем выход из парсера
+    except Exception as e:
+        print(f"Ошибка: {str(e)}")
+
+
 def _buy_command(args_list):
     """Команда покупки валюты"""
     if not Session.is_logged_in():
@@ -118,10 +430,8 @@ def _buy_command(args_list):
     try:
         args = parser.parse_args(args_list)
         
-        user = Session.current_user
-        success, message = PortfolioManager.buy_currency(
-            user.user_id, args.currency.upper(), args.amount)
-        print(message)
+        print(Session.run_portfolio_operation(
+            PortfolioManager.buy_currency, args.currency.upper(), args.amount))
     except SystemExit:
         pass
     except ValutaTradeException as e:
@@ -144,10 +454,8 @@ def _deposit_command(args_list):
     try:
         args = parser.parse_args(args_list)
         
-        user = Session.current_user
-        success, message = PortfolioManager.deposit_currency(
-            user.user_id, args.currency.upper(), args.amount)
-        print(message)
+        print(Session.run_portfolio_operation(
+            PortfolioManager.deposit_currency, args.currency.upper(), args.amount))
     except SystemExit:
         pass
     except Exception as e:
@@ -166,10 +474,179 @@ def _sell_command(args_list):
     try:
         args = parser.parse_args(args_list)
         
-        user = Session.current_user
-        success, message = PortfolioManager.sell_currency(
-            user.user_id, args.currency.upper(), args.amount)
-        print(message)
+        print(Session.run_portfolio_operation(
+            PortfolioManager.sell_currency, args.currency.upper(), args.amount))
+    except SystemExit:
+        pass
+    except Exception as e:
+        print(f"Ошибка: {str(e)}")
+
+
+def _place_order_command(args_list):
+    """Команда размещения отложенной заявки"""
+    if not Session.is_logged_in():
+        print("Сначала выполните login")
+        return
+    
+    parser = argparse.ArgumentParser(prog="order", add_help=False)
+    parser.add_argument("--side", choices=ORDER_SIDES, required=True)
+    parser.add_argument("--type", dest="order_type", choices=ORDER_TYPES,
+                        required=True)
+    parser.add_argument("--currency", required=True)
+    parser.add_argument("--amount", type=float, required=True)
+    parser.add_argument("--price", type=float, required=True,
+                        help="Цена срабатывания в USD")
+    
+    try:
+        args = parser.parse_args(args_list)
+        
+        order = order_book.place(
+            Session.current_user.user_id, args.side, args.order_type,
+            args.currency, args.amount, args.price)
+        print(f"Заявка #{order['order_id']} размещена: {order['side']} "
+              f"{order['type']} {order['amount']:.4f} {order['currency_code']} "
+              f"по {order['trigger_price']:.6f} USD")
+    except SystemExit:
+        pass
+    except Exception as e:
+        print(f"Ошибка: {str(e)}")
+
+
+def _list_orders_command(args_list):
+    """Команда списка открытых заявок"""
+    if not Session.is_logged_in():
+        print("Сначала выполните login")
+        return
+    
+    orders = order_book.get_orders(Session.current_user.user_id)
+    if not orders:
+        print("Открытых заявок нет")
+        return
+    
+    print("\nОткрытые заявки:")
+    print("-" * 50)
+    for order in orders:
+        print(f"#{order['order_id']}: {order['side']} {order['type']} "
+              f"{order['amount']:.4f} {order['currency_code']} "
+              f"по {order['trigger_price']:.6f} USD")
+
+
+def _cancel_order_command(args_list):
+    """Команда отмены заявки"""
+    if not Session.is_logged_in():
+        print("Сначала выполните login")
+        return
+    
+    parser = argparse.ArgumentParser(prog="cancel_order", add_help=False)
+    parser.add_argument("--id", dest="order_id", type=int, required=True)
+    
+    try:
+        args = parser.parse_args(args_list)
+        
+        if order_book.cancel(Session.current_user.user_id, args.order_id):
+            print(f"Заявка #{args.order_id} отменена")
+        else:
+            print(f"Заявка #{args.order_id} не найдена")
+    except SystemExit:
+        pass
+    except Exception as e:
+        print(f"Ошибка: {str(e)}")
+
+
+def _subscribe_alert_command(args_list):
+    """Команда подписки на оповещение о курсе"""
+    if not Session.is_logged_in():
+        print("Сначала выполните login")
+        return
+    
+    parser = argparse.ArgumentParser(prog="alert", add_help=False)
+    parser.add_argument("--currency", required=True)
+    condition = parser.add_mutually_exclusive_group(required=True)
+    condition.add_argument("--above", type=float, help="Курс выше (USD)")
+    condition.add_argument("--below", type=float, help="Курс ниже (USD)")
+    condition.add_argument("--move", type=float,
+                           help="Движение курса больше чем на N процентов")
+    
+    try:
+        args = parser.parse_args(args_list)
+        
+        currency = args.currency.upper()
+        if args.move is not None:
+            kind, value = "move", args.move
+        elif args.above is not None:
+            kind, value = "above", args.above
+        else:
+            kind, value = "below", args.below
+        
+        _, _, current_price = RateManager.get_rate(currency, "USD")
+        alert = alert_manager.subscribe(
+            Session.current_user.user_id, currency, kind, value, current_price)
+        print(f"Оповещение #{alert['alert_id']} создано")
+    except SystemExit:
+        pass
+    except Exception as e:
+        print(f"Ошибка: {str(e)}")
+
+
+def _list_alerts_command(args_list):
+    """Команда списка оповещений"""
+    if not Session.is_logged_in():
+        print("Сначала выполните login")
+        return
+    
+    parser = argparse.ArgumentParser(prog="alerts", add_help=False)
+    parser.add_argument("--fired", action="store_true",
+                        help="Показать сработавшие оповещения")
+    
+    try:
+        args = parser.parse_args(args_list)
+        user_id = Session.current_user.user_id
+        
+        if args.fired:
+            fired = alert_manager.read_outbox(user_id)
+            if not fired:
+                print("Сработавших оповещений нет")
+            for alert in fired:
+                moment = datetime.fromtimestamp(alert["fired_at"])
+                print(f"{moment:%Y-%m-%d %H:%M:%S} {alert['message']}")
+            return
+        
+        alerts = alert_manager.get_alerts(user_id)
+        if not alerts:
+            print("Активных оповещений нет")
+            return
+        
+        print("\nАктивные оповещения:")
+        print("-" * 50)
+        for alert in alerts:
+            if alert["kind"] == "move":
+                condition = f"движение > {alert['percent']}% " \
+                            f"от {alert['reference_price']:.6f}"
+            else:
+                condition = f"{alert['kind']} {alert['threshold']:.6f}"
+            print(f"#{alert['alert_id']}: {alert['pair']} {condition}")
+    except SystemExit:
+        pass
+    except Exception as e:
+        print(f"Ошибка: {str(e)}")
+
+
+def _cancel_alert_command(args_list):
+    """Команда отмены оповещения"""
+    if not Session.is_logged_in():
+        print("Сначала выполните login")
+        return
+    
+    parser = argparse.ArgumentParser(prog="cancel_alert", add_help=False)
+    parser.add_argument("--id", dest="alert_id", type=int, required=True)
+    
+    try:
+        args = parser.parse_args(args_list)
+        
+        if alert_manager.unsubscribe(Session.current_user.user_id, args.alert_id):
+            print(f"Оповещение #{args.alert_id} отменено")
+        else:
+            print(f"Оповещение #{args.alert_id} не найдено")
     except SystemExit:
         pass
     except Exception as e:
@@ -197,13 +674,26 @@ def _get_rate_command(args_list):
 def _update_rates_command(args_list):
     """Команда обновления курсов"""
     parser = argparse.ArgumentParser(prog="update", add_help=False)
-    parser.add_argument("--source", choices=["coingecko", "exchangerate"], 
+    parser.add_argument("--source", choices=get_all_providers(), 
                        help="Источник данных")
+    parser.add_argument("--background", action="store_true",
+                        help="Обновлять в фоне, не занимая приглашение")
     
     try:
         args = parser.parse_args(args_list)
         
         updater = RatesUpdater()
+        if args.background:
+            running = background_jobs.find_running("update")
+            if running is not None:
+                print(f"Обновление уже выполняется (задача #{running.job_id})")
+                return
+            job = background_jobs.start("update", lambda cancel: updater.run_update(
+                args.source, cancel=cancel, report=_job_logger.info))
+            print(f"Обновление курсов запущено в фоне (задача #{job.job_id}); "
+                  f"ход - в журнале {settings.LOG_FILE}, состояние - команда jobs")
+            return
+        
         success = updater.run_update(args.source)
         
         if success:
@@ -216,6 +706,130 @@ def _update_rates_command(args_list):
         print(f"Ошибка: {str(e)}")
 
 
+def _backfill_command(args_list):
+    """Команда догрузки истории курсов за прошлые даты"""
+    parser = argparse.ArgumentParser(prog="backfill", add_help=False)
+    parser.add_argument("--source", required=True, choices=get_all_providers(),
+                        help="Источник данных")
+    parser.add_argument("--from", dest="start", required=True,
+                        help="Начало периода (ISO, например 2026-01-15)")
+    parser.add_argument("--to", dest="end", required=True,
+                        help="Конец периода (ISO)")
+    parser.add_argument("--step", type=float, default=3600,
+                        help="Шаг между точками (секунды)")
+    parser.add_argument("--chunk", type=float, default=86400,
+                        help="Размер куска (секунды)")
+    parser.add_argument("--workers", type=int, help="Число потоков")
+    parser.add_argument("--restart", action="store_true",
+                        help="Начать заново, не продолжая с контрольной точки")
+    
+    try:
+        args = parser.parse_args(args_list)
+        
+        backfill = Backfill(
+            args.source,
+            datetime.fromisoformat(args.start).timestamp(),
+            datetime.fromisoformat(args.end).timestamp(),
+            step=args.step,
+            chunk=args.chunk,
+            workers=args.workers,
+        )
+        if args.restart:
+            backfill.reset()
+        
+        def progress(done, total, count):
+            print(f"\rКусок {done}/{total}: +{count} записей", end="", flush=True)
+        
+        result = backfill.run(progress)
+        print()
+        if result["resumed_from"]:
+            print(f"Продолжено с куска {result['resumed_from'] + 1}")
+        print(f"Догрузка завершена: кусков {result['chunks']}, "
+              f"добавлено записей {result['appended']}")
+    except SystemExit:
+        pass
+    except Exception as e:
+        print()
+        print(f"Ошибка: {str(e)}")
+        print("Повторный запуск продолжит догрузку с контрольной точки")
+
+
+def _stream_command(args_list):
+    """Команда фонового приёма тиков из потоковой ленты"""
+    parser = argparse.ArgumentParser(prog="stream", add_help=False)
+    parser.add_argument("--connect", metavar="HOST:PORT",
+                        help="Адрес ленты (без него - встроенная тестовая лента "
+                             "по синтетическим парам SYN*)")
+    parser.add_argument("--window", type=float,
+                        help="Окно свёртки тиков (секунды)")
+    parser.add_argument("--tick-rate", type=float, default=1000.0,
+                        help="Тиков в секунду встроенной ленты")
+    
+    try:
+        args = parser.parse_args(args_list)
+        
+        running = background_jobs.find_running("stream")
+        if running is not None:
+            print(f"Приём ленты уже идёт (задача #{running.job_id})")
+            return
+        if args.connect:
+            source = SocketTickSource(*parse_address(args.connect))
+        else:
+            source = RandomWalkFeed(tick_rate=args.tick_rate)
+        ingestor = StreamIngestor(source, args.window)
+        job = background_jobs.start("stream", lambda cancel: ingestor.run(cancel))
+        print(f"Приём ленты запущен в фоне (задача #{job.job_id}); "
+              f"остановка - cancel --id {job.job_id}")
+    except SystemExit:
+        pass
+    except Exception as e:
+        print(f"Ошибка: {str(e)}")
+
+
+def _jobs_command(args_list):
+    """Команда списка фоновых задач"""
+    jobs = background_jobs.list_jobs()
+    if not jobs:
+        print("Фоновых задач нет")
+        return
+    
+    print("\nФоновые задачи:")
+    print("-" * 50)
+    for job in jobs:
+        started = datetime.fromtimestamp(job.started_at).strftime("%H:%M:%S")
+        finished = job.finished_at if job.finished_at is not None \
+            else datetime.now().timestamp()
+        line = f"#{job.job_id} {job.name}: {job.status}, запущена {started}, " \
+            f"{finished - job.started_at:.1f} с"
+        if job.running and job.cancel_event.is_set():
+            line += " (отменяется)"
+        if job.error:
+            line += f" - {job.error}"
+        print(line)
+
+
+def _cancel_job_command(args_list):
+    """Команда отмены фоновой задачи"""
+    parser = argparse.ArgumentParser(prog="cancel", add_help=False)
+    parser.add_argument("--id", type=int,
+                        help="Номер задачи (без него - все выполняющиеся)")
+    
+    try:
+        args = parser.parse_args(args_list)
+        
+        cancelled = background_jobs.cancel(args.id)
+        if not cancelled:
+            print("Нет выполняющихся задач для отмены")
+            return
+        for job in cancelled:
+            print(f"Задача #{job.job_id} ({job.name}) будет отменена "
+                  "после текущего запроса")
+    except SystemExit:
+        pass
+    except Exception as e:
+        print(f"Ошибка: {str(e)}")
+
+
 def _show_rates_command(args_list):
     """Команда показа курсов"""
     parser = argparse.ArgumentParser(prog="show", add_help=False)
@@ -225,9 +839,8 @@ def _show_rates_command(args_list):
         args = parser.parse_args(args_list)
         
         import json
-        from pathlib import Path
         
-        rates_file = Path("data/rates.json")
+        rates_file = settings.data_dir() / "rates.json"
         
         if not rates_file.exists():
             print("Локальный кеш курсов пуст. " \
@@ -238,7 +851,11 @@ def _show_rates_command(args_list):
             data = json.load(f)
         
         pairs = data.get("pairs", {})
-        last_refresh = data.get("last_refresh", "неизвестно")
+        last_refresh = data.get("last_refresh")
+        if isinstance(last_refresh, (int, float)):
+            last_refresh = datetime.fromtimestamp(last_refresh).isoformat(sep=" ")
+        elif not last_refresh:
+            last_refresh = "неизвестно"
         
         print(f"\nКурсы из кеша (обновлено: {last_refresh}):")
         print("-" * 50)
@@ -264,6 +881,66 @@ def _list_currencies_command(args_list):
         print(f"{code}: {currency.get_display_info()}")
 
 
+def _holdings_command(args_list):
+    """Команда сводки по валютам: общий объём и число держателей"""
+    if not _require_admin():
+        return
+    
+    parser = argparse.ArgumentParser(prog="holdings", add_help=False)
+    parser.add_argument("--currency", help="Показать только указанную валюту")
+    
+    try:
+        args = parser.parse_args(args_list)
+        
+        summary = holdings_index.summary()
+        if args.currency:
+            code = args.currency.upper()
+            summary = {code: summary.get(code, (0.0, 0))}
+        if not summary:
+            print("Портфели пусты")
+            return
+        
+        print("\nСуммарные балансы пользователей:")
+        print("-" * 50)
+        for code, (total, holders) in summary.items():
+            print(f"{code}: {total:.8f} (держателей: {holders})")
+    except SystemExit:
+        pass
+    except Exception as e:
+        print(f"Ошибка: {str(e)}")
+
+
+def _top_holders_command(args_list):
+    """Команда крупнейших держателей валюты"""
+    if not _require_admin():
+        return
+    
+    parser = argparse.ArgumentParser(prog="top", add_help=False)
+    parser.add_argument("--currency", required=True, help="Код валюты")
+    parser.add_argument("--limit", type=int, default=10,
+                        help="Сколько держателей показать")
+    
+    try:
+        args = parser.parse_args(args_list)
+        
+        code = args.currency.upper()
+        holders = holdings_index.top(code, args.limit)
+        if not holders:
+            print(f"Держателей {code} нет")
+            return
+        
+        print(f"\nКрупнейшие держатели {code}:")
+        print("-" * 50)
+        for place, (user_id, balance) in enumerate(holders, 1):
+            user = db.find_record("users.json", "user_id", user_id)
+            name = user["username"] if user else f"user_id {user_id}"
+            print(f"{place:>4}. {name}: {balance:.8f}")
+    except SystemExit:
+        pass
+    except Exception as e:
+        print(f"Ошибка: {str(e)}")
+
+
 # ============================================================================
 # ИНТЕРАКТИВНАЯ ОБОЛОЧКА
 # ============================================================================
@@ -280,6 +957,22 @@ class ValutaTradeShell(cmd.Cmd):
 """
     prompt = "valutatrade> "
     
+    def __init__(self, *args, profile_dir=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.profiler = CommandProfiler()
+        if profile_dir:
+            self.profiler.enable(profile_dir)
+    
+    def onecmd(self, line):
+        """Выполнение команды (под профилировщиком и в корневом спане)"""
+        if not self.profiler.enabled and not tracer.enabled:
+            return super().onecmd(line)
+        command = self.parseline(line)[0]
+        with span(f"cli.{command}"):
+            if not self.profiler.enabled or command == "profile":
+                return super().onecmd(line)
+            return self.profiler.run(command, super().onecmd, line)
+    
     def emptyline(self):
         """При пустой строке ничего не делаем"""
         pass
@@ -294,6 +987,11 @@ class ValutaTradeShell(cmd.Cmd):
         _register_command(shlex.split(args))
         return False  # Важно: возвращаем False, чтобы не выходить из оболочки
     
+    def do_import_users(self, args):
+        """Массовая регистрация: import_users --file FILE [--format csv|jsonl]"""
+        _import_users_command(shlex.split(args))
+        return False
+    
     def do_login(self, args):
         """Вход в систему: login --username NAME --password PASS"""
         _login_command(shlex.split(args))
@@ -310,6 +1008,31 @@ class ValutaTradeShell(cmd.Cmd):
         _show_portfolio_command(shlex.split(args))
         return False
     
+    def do_history(self, args):
+        """История стоимости портфеля: history [--from DATE] [--to DATE]"""
+        _portfolio_history_command(shlex.split(args))
+        return False
+    
+    def do_trades(self, args):
+        """Журнал сделок: trades [--currency CODE]"""
+        _trades_command(shlex.split(args))
+        return False
+    
+    def do_pnl(self, args):
+        """Прибыль и убытки по сделкам (FIFO)"""
+        _pnl_command(shlex.split(args))
+        return False
+    
+    def do_risk(self, args):
+        """Риск портфеля: VaR и ES на 1 день"""
+        _risk_command(shlex.split(args))
+        return False
+    
+    def do_risk_report(self, args):
+        """Отчёт о риске всех портфелей: risk_report --output FILE [--workers N]"""
+        _risk_report_command(shlex.split(args))
+        return False
+    
     def do_buy(self, args):
         """Купить валюту: buy --currency CODE --amount AMOUNT"""
         _buy_command(shlex.split(args))
@@ -320,16 +1043,78 @@ class ValutaTradeShell(cmd.Cmd):
         _sell_command(shlex.split(args))
         return False
     
+    def do_order(self, args):
+        """Отложенная заявка: order --side buy|sell --type limit|stop
+        --currency CODE --amount AMOUNT --price PRICE"""
+        _place_order_command(shlex.split(args))
+        return False
+    
+    def do_orders(self, args):
+        """Показать открытые заявки"""
+        _list_orders_command(shlex.split(args))
+        return False
+    
+    def do_cancel_order(self, args):
+        """Отменить заявку: cancel_order --id ID"""
+        _cancel_order_command(shlex.split(args))
+        return False
+    
+    def do_alert(self, args):
+        """Оповещение о курсе: alert --currency CODE
+        (--above PRICE | --below PRICE | --move PERCENT)"""
+        _subscribe_alert_command(shlex.split(args))
+        return False
+    
+    def do_alerts(self, args):
+        """Показать оповещения: alerts [--fired]"""
+        _list_alerts_command(shlex.split(args))
+        return False
+    
+    def do_cancel_alert(self, args):
+        """Отменить оповещение: cancel_alert --id ID"""
+        _cancel_alert_command(shlex.split(args))
+        return False
+    
     def do_rate(self, args):
         """Получить курс: rate --from CURRENCY --to CURRENCY"""
         _get_rate_command(shlex.split(args))
         return False
     
     def do_update(self, args):
-        """Обновить курсы: update [--source coingecko|exchangerate]"""
+        """Обновить курсы: update [--source PROVIDER] [--background]"""
         _update_rates_command(shlex.split(args))
         return False
     
+    def do_holdings(self, args):
+        """Сводка по валютам: holdings [--currency CODE]"""
+        _holdings_command(shlex.split(args))
+        return False
+    
+    def do_top(self, args):
+        """Крупнейшие держатели: top --currency CODE [--limit N]"""
+        _top_holders_command(shlex.split(args))
+        return False
+    
+    def do_stream(self, args):
+        """Приём потоковой ленты: stream [--connect HOST:PORT] [--window SEC]"""
+        _stream_command(shlex.split(args))
+        return False
+    
+    def do_jobs(self, args):
+        """Показать фоновые задачи"""
+        _jobs_command(shlex.split(args))
+        return False
+    
+    def do_cancel(self, args):
+        """Отменить фоновую задачу: cancel [--id ID]"""
+        _cancel_job_command(shlex.split(args))
+        return False
+    
+    def do_backfill(self, args):
+        """Догрузить историю: backfill --source NAME --from DATE --to DATE"""
+        _backfill_command(shlex.split(args))
+        return False
+    
     def do_show(self, args):
         """Показать курсы: show [--currency CODE]"""
         _show_rates_command(shlex.split(args))
@@ -350,6 +1135,28 @@ class ValutaTradeShell(cmd.Cmd):
             print("Вы не вошли в систему")
         return False
     
+    def do_profile(self, args):
+        """Профилирование команд: profile on [--dir DIR] | off | status"""
+        parser = argparse.ArgumentParser(prog="profile", add_help=False)
+        parser.add_argument("mode", choices=["on", "off", "status"])
+        parser.add_argument("--dir", help="Каталог для результатов")
+        
+        try:
+            parsed = parser.parse_args(shlex.split(args))
+        except SystemExit:
+            return False
+        
+        if parsed.mode == "on":
+            self.profiler.enable(parsed.dir)
+            print(f"Профилирование включено: {self.profiler.directory}")
+        elif parsed.mode == "off":
+            self.profiler.disable()
+            print("Профилирование выключено")
+        else:
+            state = "включено" if self.profiler.enabled else "выключено"
+            print(f"Профилирование {state}: {self.profiler.directory}")
+        return False
+    
     def do_clear(self, args):
         """Очистить экран"""
         print("\033[H\033[J", end="")
@@ -371,6 +1178,8 @@ class ValutaTradeShell(cmd.Cmd):
         print("="*60)
         print("\n📝 Управление пользователями:")
         print("  register --username NAME --password PASS  - Регистрация")
+        print("  import_users --file FILE [--format csv|jsonl] [--workers N]")
+        print("                                          - Массовая регистрация")
         print("  login --username NAME --password PASS     - Вход")
         print("  logout                                   - Выход")
         print("  whoami                                   - Текущий пользователь")
@@ -380,14 +1189,40 @@ class ValutaTradeShell(cmd.Cmd):
         print("  buy --currency CODE --amount AMOUNT      - Купить валюту")
         print("  sell --currency CODE --amount AMOUNT     - Продать валюту")
         print("  portfolio [--base CURRENCY]             - Показать портфель")
+        print("  history [--from DATE] [--to DATE]       - Стоимость портфеля")
+        print("  trades [--currency CODE]                - Журнал сделок")
+        print("  pnl                                     - Прибыль и убытки")
+        print("  risk                                    - VaR и ES портфеля")
+        print("  risk_report --output FILE [--workers N] - Отчёт о риске (CSV, админ)")
+        print("  order --side buy|sell --type limit|stop --currency CODE")
+        print("        --amount AMOUNT --price PRICE     - Отложенная заявка")
+        print("  orders                                  - Открытые заявки")
+        print("  cancel_order --id ID                    - Отменить заявку")
         
         print("\n📊 Курсы валют:")
         print("  rate --from CODE --to CODE              - Получить курс")
         print("  show [--currency CODE]                  - Показать все курсы")
-        print("  update [--source coingecko|exchangerate] - Обновить курсы")
+        print("  update [--source PROVIDER] [--background]")
+        print("                                          - Обновить курсы")
+        print("  stream [--connect HOST:PORT] [--window SEC]")
+        print("                                          - Приём потоковой ленты")
+        print("  jobs                                    - Фоновые задачи")
+        print("  cancel [--id ID]                        - Отменить фоновую задачу")
+        print("  backfill --source NAME --from DATE --to DATE [--step SEC]")
+        print("           [--chunk SEC] [--workers N] [--restart]")
+        print("                                          - Догрузка истории")
         print("  list                                    - Список валют")
+        print("  alert --currency CODE --above|--below PRICE | --move PCT")
+        print("                                          - Оповещение о курсе")
+        print("  alerts [--fired]                        - Оповещения")
+        print("  cancel_alert --id ID                    - Отменить оповещение")
+        
+        print("\n🏦 Сводка по пользователям (для ADMIN_USERS):")
+        print("  holdings [--currency CODE]              - Суммарные балансы")
+        print("  top --currency CODE [--limit N]         - Крупнейшие держатели")
         
         print("\n⚙️  Системные:")
+        print("  profile on [--dir DIR]|off|status       - Профилирование команд")
         print("  clear                                   - Очистить экран")
         print("  help [КОМАНДА]                         - Справка")
         print("  exit, quit                             - Выход")
@@ -408,13 +1243,31 @@ class ValutaTradeShell(cmd.Cmd):
     
     def postloop(self):
         """Выполняется после выхода из цикла"""
+        background_jobs.shutdown()
         print("Спасибо за использование ValutaTrade Hub!")
 
 
 def main():
     """Главная функция - всегда запускает интерактивную оболочку"""
+    parser = argparse.ArgumentParser(prog="project")
+    parser.add_argument("--profile", nargs="?", const=True, metavar="DIR",
+                        help="Профилировать каждую команду (cProfile + tracemalloc)")
+    parser.add_argument("--trace", nargs="?", const=True, metavar="FILE",
+                        help="Записывать спаны трассировки (OTLP JSON lines)")
+    args = parser.parse_args()
+    
+    # Ход фоновых задач и предупреждения пишутся в журнал settings.LOG_FILE
+    setup_logging(console=False)
+    
+    if args.trace:
+        tracer.enable(None if args.trace is True else args.trace)
+    
+    profile_dir = args.profile
+    if profile_dir is True:
+        profile_dir = CommandProfiler().directory
+    
     try:
-        shell = ValutaTradeShell()
+        shell = ValutaTradeShell(profile_dir=profile_dir)
         shell.cmdloop()
     except KeyboardInterrupt:
         print("\n\nПрограмма прервана пользователем")
@@ -0,0 +1,100 @@
+import itertools
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    """Фоновая задача оболочки: поток, событие отмены и итог выполнения"""
+
+    def __init__(self, job_id: int, name: str):
+        self.job_id = job_id
+        self.name = name
+        self.cancel_event = threading.Event()
+        self.status = "running"
+        self.started_at = time.time()
+        self.finished_at = None
+        self.error = None
+        self.thread = None
+
+    @property
+    def running(self) -> bool:
+        return self.status == "running"
+
+    def cancel(self):
+        self.cancel_event.set()
+
+
+class BackgroundJobs:
+    """Задачи, выполняемые в потоках, пока приглашение оболочки свободно.
+
+    Функция задачи получает threading.Event отмены и должна проверять
+    его между шагами; прервать уже начатый сетевой запрос отмена не
+    может, она вступает в силу на ближайшей проверке. О ходе и итоге
+    задачи сообщается через логгер, а не print, чтобы вывод не
+    смешивался с вводом пользователя.
+    """
+
+    def __init__(self):
+        self._jobs: Dict[int, Job] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def start(self, name: str, target: Callable[[threading.Event], object]) -> Job:
+        with self._lock:
+            job = Job(next(self._ids), name)
+            self._jobs[job.job_id] = job
+
+        def run():
+            try:
+                result = target(job.cancel_event)
+                if job.cancel_event.is_set():
+                    job.status = "cancelled"
+                else:
+                    job.status = "done" if result is not False else "failed"
+            except Exception as e:
+                job.status = "failed"
+                job.error = str(e)
+                logger.error(f"Задача #{job.job_id} ({name}): {e}")
+            finally:
+                job.finished_at = time.time()
+                logger.info(f"Задача #{job.job_id} ({name}) завершена: {job.status}")
+
+        job.thread = threading.Thread(target=run, name=f"job-{job.job_id}",
+                                      daemon=True)
+        job.thread.start()
+        return job
+
+    def find_running(self, name: str) -> Optional[Job]:
+        with self._lock:
+            return next((job for job in self._jobs.values()
+                         if job.name == name and job.running), None)
+
+    def list_jobs(self) -> List[Job]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def cancel(self, job_id: int = None) -> List[Job]:
+        """Отменить задачу (или все выполняющиеся); возвращает отменённые"""
+        with self._lock:
+            if job_id is not None and job_id not in self._jobs:
+                raise ValueError(f"Задача #{job_id} не найдена")
+            jobs = [self._jobs[job_id]] if job_id is not None \
+                else list(self._jobs.values())
+        cancelled = [job for job in jobs if job.running]
+        for job in cancelled:
+            job.cancel()
+        return cancelled
+
+    def shutdown(self, timeout: float = 5.0):
+        """Отменить выполняющиеся задачи и дождаться их завершения"""
+        deadline = time.monotonic() + timeout
+        for job in self.cancel():
+            job.thread.join(max(0.0, deadline - time.monotonic()))
+
+
+# Глобальный экземпляр
+background_jobs = BackgroundJobs()
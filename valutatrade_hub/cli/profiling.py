@@ -0,0 +1,117 @@
+import cProfile
+import os
+import pstats
+import tracemalloc
+from collections import defaultdict
+from pathlib import Path
+
+from ..infra.settings import settings
+
+# Глубина стека, дальше которой свёрнутые стеки не разворачиваются
+_MAX_DEPTH = 64
+_TOP_ALLOCATIONS = 25
+
+
+def _label(func) -> str:
+    filename, line, name = func
+    if filename == "~":  # встроенные функции: "{method 'append' ...}"
+        return name.strip("{}").replace(";", ",")
+    return f"{name} ({os.path.basename(filename)}:{line})".replace(";", ",")
+
+
+def collapsed_stacks(stats: pstats.Stats) -> dict:
+    """Свёрнутые стеки (формат flamegraph.pl) из статистики cProfile.
+
+    cProfile хранит только рёбра вызывающий -> вызываемый, поэтому
+    собственное время функции делится между путями пропорционально
+    времени, проведённому в ней по каждому ребру. Значения - микросекунды.
+    """
+    raw = stats.stats
+    callees = defaultdict(dict)
+    for func, (_, _, _, _, callers) in raw.items():
+        for caller, edge in callers.items():
+            callees[caller][func] = edge
+
+    stacks = defaultdict(float)
+
+    def walk(func, path, on_path, share):
+        own_time = raw[func][2]
+        path = path + (_label(func),)
+        stacks[";".join(path)] += own_time * share * 1e6
+        if len(path) >= _MAX_DEPTH:
+            return
+        for callee, edge in callees.get(func, {}).items():
+            callee_total = raw[callee][3]
+            if callee in on_path or not callee_total:
+                continue  # рекурсия уже учтена во времени вызывающего
+            if share * edge[3] * 1e6 < 1:
+                continue  # меньше микросекунды: путь не разворачиваем
+            walk(callee, path, on_path | {callee}, share * edge[3] / callee_total)
+
+    for func, (_, _, _, _, callers) in raw.items():
+        if not callers:
+            walk(func, (), {func}, 1.0)
+
+    return {stack: int(value) for stack, value in stacks.items() if value >= 1}
+
+
+class CommandProfiler:
+    """Профилирование команд оболочки: cProfile + tracemalloc.
+
+    На каждую команду в каталог пишутся два файла:
+    NNNN-команда.folded - свёрнутые стеки для flamegraph,
+    NNNN-команда.alloc.txt - крупнейшие выделения памяти.
+    В выключенном состоянии run() просто вызывает функцию.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = Path(directory or settings.data_dir() / "profiles")
+        self.enabled = False
+        self._counter = 0
+
+    def enable(self, directory=None):
+        if directory:
+            self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def run(self, name: str, func, *args, **kwargs):
+        if not self.enabled:
+            return func(*args, **kwargs)
+
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(_MAX_DEPTH)
+        before = tracemalloc.take_snapshot()
+
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(func, *args, **kwargs)
+        finally:
+            after = tracemalloc.take_snapshot()
+            if started_tracing:
+                tracemalloc.stop()
+            self._write(name, profiler, before, after)
+
+    def _write(self, name, profiler, before, after):
+        self._counter += 1
+        base = f"{self._counter:04d}-{name or 'empty'}"
+
+        stacks = collapsed_stacks(pstats.Stats(profiler))
+        with open(self.directory / f"{base}.folded", 'w', encoding='utf-8') as f:
+            for stack, value in sorted(stacks.items()):
+                f.write(f"{stack} {value}\n")
+
+        ignore = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, cProfile.__file__),
+        ]
+        differences = after.filter_traces(ignore).compare_to(
+            before.filter_traces(ignore), "lineno")
+        with open(self.directory / f"{base}.alloc.txt", 'w', encoding='utf-8') as f:
+            f.write(f"Топ-{_TOP_ALLOCATIONS} выделений памяти: {name}\n")
+            for stat in differences[:_TOP_ALLOCATIONS]:
+                f.write(f"{stat}\n")
@@ -0,0 +1,226 @@
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from ..infra.database import atomic_write_json, file_version
+from ..infra.locks import file_lock
+from ..infra.settings import settings
+from .currencies import validate_currency_code
+
+logger = logging.getLogger(__name__)
+
+ALERT_KINDS = ("above", "below", "move")
+
+
+def _thresholds(alert: Dict) -> List[tuple]:
+    """Пороги оповещения: (цена, направление пересечения)"""
+    if alert["kind"] == "above":
+        return [(alert["threshold"], "up")]
+    if alert["kind"] == "below":
+        return [(alert["threshold"], "down")]
+    # move: движение на percent% от цены в момент подписки в любую сторону
+    reference, percent = alert["reference_price"], alert["percent"] / 100
+    return [(reference * (1 + percent), "up"), (reference * (1 - percent), "down")]
+
+
+class AlertManager:
+    """Подписки на оповещения о курсах.
+
+    Пороги каждой пары хранятся в отсортированном массиве, поэтому при
+    обновлении курса сработавшие подписки находятся бинарным поиском
+    между старой и новой ценой, без перебора всех подписок.
+    Сработавшие оповещения дописываются в alerts_outbox.jsonl.
+    Изменения alerts.json идут под flock alerts.lock, общим для
+    процессов.
+    """
+
+    def __init__(self, path=None, outbox_path=None):
+        data_dir = settings.data_dir()
+        self.path = Path(path or data_dir / "alerts.json")
+        self.outbox_path = Path(outbox_path or data_dir / "alerts_outbox.jsonl")
+        self._lock_path = self.path.with_suffix(".lock")
+        self._lock = threading.RLock()
+        self._alerts = None   # alert_id -> подписка, загружаются лениво
+        self._levels = {}     # пара -> отсортированный список (цена, id, направление)
+        self._next_id = 1
+        self._version = None
+
+    def _load(self):
+        version = file_version(self.path)
+        if self._alerts is not None and version == self._version:
+            return
+        self._alerts = {}
+        self._levels = {}
+        self._version = version
+        data = {}
+        if version is not None:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        self._next_id = data.get("next_id", 1)
+        for alert in data.get("alerts", []):
+            self._index(alert)
+
+    def _index(self, alert: Dict):
+        self._alerts[alert["alert_id"]] = alert
+        levels = self._levels.setdefault(alert["pair"], [])
+        for price, direction in _thresholds(alert):
+            insort(levels, (price, alert["alert_id"], direction))
+
+    def _unindex(self, alert: Dict):
+        del self._alerts[alert["alert_id"]]
+        levels = self._levels[alert["pair"]]
+        for price, direction in _thresholds(alert):
+            position = bisect_left(levels, (price, alert["alert_id"], direction))
+            del levels[position]
+
+    def _save(self):
+        atomic_write_json(self.path, {
+            "next_id": self._next_id,
+            "alerts": list(self._alerts.values()),
+        }, ensure_ascii=False)
+        self._version = file_version(self.path)
+
+    def subscribe(self, user_id: int, currency_code: str, kind: str,
+                  value: float, current_price: Optional[float] = None) -> Dict:
+        """Подписаться на курс currency_code к USD.
+
+        kind: above/below - порог цены в USD, move - процент движения
+        от текущей цены (current_price). Порог above/below, который
+        текущая цена уже пересекла, отклоняется: оповещение срабатывает
+        только при пересечении и иначе ждало бы обратного движения.
+        """
+        currency_code = currency_code.upper()
+        if kind not in ALERT_KINDS:
+            raise ValueError(f"Неизвестный тип оповещения: {kind}")
+        if not validate_currency_code(currency_code) or currency_code == "USD":
+            raise ValueError(f"Неизвестная валюта: {currency_code}")
+        if value <= 0:
+            raise ValueError("Значение порога должно быть положительным")
+
+        alert = {
+            "user_id": user_id,
+            "pair": f"{currency_code}_USD",
+            "kind": kind,
+            "created_at": time.time(),
+        }
+        if kind == "move":
+            if not current_price:
+                raise ValueError(f"Нет текущего курса для {currency_code}")
+            alert["percent"] = value
+            alert["reference_price"] = current_price
+        else:
+            if current_price and (current_price >= value if kind == "above"
+                                  else current_price <= value):
+                relation = "не ниже" if kind == "above" else "не выше"
+                raise ValueError(f"Курс {currency_code} уже {relation} {value} "
+                                 f"(сейчас {current_price})")
+            alert["threshold"] = value
+
+        with self._lock, file_lock(self._lock_path):
+            self._load()
+            alert["alert_id"] = self._next_id
+            self._next_id += 1
+            self._index(alert)
+            self._save()
+            return alert
+
+    def unsubscribe(self, user_id: int, alert_id: int) -> bool:
+        """Отменить свою подписку"""
+        with self._lock, file_lock(self._lock_path):
+            self._load()
+            alert = self._alerts.get(alert_id)
+            if not alert or alert["user_id"] != user_id:
+                return False
+            self._unindex(alert)
+            self._save()
+            return True
+
+    def get_alerts(self, user_id: Optional[int] = None) -> List[Dict]:
+        """Активные подписки (всех пользователей или одного)"""
+        with self._lock:
+            self._load()
+            return [
+                alert for alert in self._alerts.values()
+                if user_id is None or alert["user_id"] == user_id
+            ]
+
+    def on_rates(self, old_pairs: Dict, new_pairs: Dict) -> List[Dict]:
+        """Найти и доставить оповещения, пересечённые при смене курсов"""
+        with self._lock, file_lock(self._lock_path):
+            self._load()
+            fired = {}
+            for pair, levels in self._levels.items():
+                old_info, new_info = old_pairs.get(pair), new_pairs.get(pair)
+                if not old_info or not new_info or not levels:
+                    continue
+                old_price, new_price = old_info["rate"], new_info["rate"]
+
+                if new_price > old_price:
+                    # Пороги в (старая, новая] пересечены снизу вверх
+                    first = bisect_right(levels, (old_price, float("inf")))
+                    last = bisect_right(levels, (new_price, float("inf")))
+                    direction = "up"
+                elif new_price < old_price:
+                    # Пороги в [новая, старая) пересечены сверху вниз
+                    first = bisect_left(levels, (new_price,))
+                    last = bisect_left(levels, (old_price,))
+                    direction = "down"
+                else:
+                    continue
+
+                for _, alert_id, level_direction in levels[first:last]:
+                    if level_direction != direction or alert_id in fired:
+                        continue
+                    alert = self._alerts[alert_id]
+                    alert["price"] = new_price
+                    alert["previous_price"] = old_price
+                    fired[alert_id] = alert
+
+            if not fired:
+                return []
+            # Сначала доставка: лучше повторное оповещение, чем потерянное
+            self._deliver(list(fired.values()))
+            for alert in fired.values():
+                self._unindex(alert)
+            self._save()
+            return list(fired.values())
+
+    def _deliver(self, fired: List[Dict]):
+        """Дописать сработавшие оповещения в outbox"""
+        fired_at = time.time()
+        lines = []
+        for alert in fired:
+            alert["fired_at"] = fired_at
+            alert["message"] = (
+                f"{alert['pair']}: {alert['previous_price']:.6f} -> "
+                f"{alert['price']:.6f} (оповещение #{alert['alert_id']}, "
+                f"{alert['kind']})"
+            )
+            lines.append(json.dumps(alert, ensure_ascii=False) + "\n")
+            logger.info(f"Оповещение: {alert['message']}")
+
+        self.outbox_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.outbox_path, 'a', encoding='utf-8') as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def read_outbox(self, user_id: int, since: float = 0.0) -> List[Dict]:
+        """Доставленные оповещения пользователя"""
+        if not self.outbox_path.exists():
+            return []
+        with open(self.outbox_path, 'r', encoding='utf-8') as f:
+            alerts = [json.loads(line) for line in f if line.strip()]
+        return [
+            alert for alert in alerts
+            if alert["user_id"] == user_id and alert["fired_at"] > since
+        ]
+
+
+# Глобальный экземпляр
+alert_manager = AlertManager()
@@ -0,0 +1,124 @@
+import bisect
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from ..infra.database import db
+
+_PORTFOLIOS = "portfolios.json"
+
+
+def wallet_balances(portfolio_data: Optional[Dict]) -> Dict[str, float]:
+    """Балансы {код: баланс} записи portfolios.json"""
+    if not portfolio_data:
+        return {}
+    return {
+        code: wallet["balance"]
+        for code, wallet in portfolio_data.get("wallets", {}).items()
+    }
+
+
+class HoldingsIndex:
+    """Сводка по валютам: общий объём и держатели, упорядоченные по балансу.
+
+    Для каждой валюты хранятся сумма балансов (total за O(1)) и
+    отсортированный список (баланс, user_id) держателей с положительным
+    балансом: top-N берётся с конца списка за O(log n + N). Сделки
+    меняют сводку на разность балансов одного пользователя
+    (apply_delta), полный проход по портфелям нужен только при первом
+    обращении и после изменения portfolios.json в обход update_portfolio
+    (регистрация, другой процесс) - это видно по метке версии файла.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None     # версия portfolios.json, с которой согласована сводка
+        self._totals: Dict[str, float] = {}
+        self._balances: Dict[str, Dict[int, float]] = {}   # код -> {user_id: баланс}
+        self._ranked: Dict[str, List[Tuple[float, int]]] = {}
+
+    def _rebuild(self):
+        """Полный пересчёт по portfolios.json; вызывается под блокировкой"""
+        version = db.get_version(_PORTFOLIOS)
+        self._totals, self._balances, self._ranked = {}, {}, {}
+        for portfolio_data in db.read_json(_PORTFOLIOS):
+            user_id = portfolio_data["user_id"]
+            for code, balance in wallet_balances(portfolio_data).items():
+                self._totals[code] = self._totals.get(code, 0.0) + balance
+                if balance > 0:
+                    self._balances.setdefault(code, {})[user_id] = balance
+        for code, holders in self._balances.items():
+            self._ranked[code] = sorted(
+                (balance, user_id) for user_id, balance in holders.items())
+        self._version = version
+
+    def _ensure_current(self):
+        """Пересчитать сводку, если portfolios.json менялся без неё"""
+        if self._version is None or self._version != db.get_version(_PORTFOLIOS):
+            self._rebuild()
+
+    def _set_balance(self, code: str, user_id: int, balance: float):
+        holders = self._balances.setdefault(code, {})
+        ranked = self._ranked.setdefault(code, [])
+        old = holders.pop(user_id, None)
+        if old is not None:
+            del ranked[bisect.bisect_left(ranked, (old, user_id))]
+        if balance > 0:
+            holders[user_id] = balance
+            bisect.insort(ranked, (balance, user_id))
+
+    def apply_delta(self, user_id: int, old: Dict[str, float],
+                    new: Dict[str, float], base_version, new_version):
+        """Учесть изменение портфеля одного пользователя.
+
+        old - балансы из содержимого файла, к которому применялась запись
+        (версия base_version), new - записанные балансы (new_version).
+        Разность применяется, только если сводка согласована с base_version
+        или уже с new_version (другая запись той же пачки). Иначе файл
+        менялся в обход сводки, и она будет пересчитана при обращении.
+        """
+        with self._lock:
+            if self._version is None:
+                return  # сводку ещё никто не запрашивал
+            if self._version not in (base_version, new_version):
+                self._version = None
+                return
+            for code in old.keys() | new.keys():
+                delta = new.get(code, 0.0) - old.get(code, 0.0)
+                if not delta:
+                    continue
+                self._totals[code] = self._totals.get(code, 0.0) + delta
+                self._set_balance(code, user_id, new.get(code, 0.0))
+            self._version = new_version
+
+    def total(self, code: str) -> float:
+        """Суммарный баланс валюты у всех пользователей"""
+        with self._lock:
+            self._ensure_current()
+            return self._totals.get(code, 0.0)
+
+    def holder_count(self, code: str) -> int:
+        with self._lock:
+            self._ensure_current()
+            return len(self._balances.get(code, {}))
+
+    def summary(self) -> Dict[str, Tuple[float, int]]:
+        """{код: (общий баланс, число держателей)} по всем валютам"""
+        with self._lock:
+            self._ensure_current()
+            return {
+                code: (total, len(self._balances.get(code, {})))
+                for code, total in sorted(self._totals.items())
+            }
+
+    def top(self, code: str, limit: int = 10) -> List[Tuple[int, float]]:
+        """Крупнейшие держатели валюты: [(user_id, баланс)] по убыванию"""
+        with self._lock:
+            self._ensure_current()
+            ranked = self._ranked.get(code, [])
+            return [(user_id, balance)
+                    for balance, user_id in reversed(ranked[-limit:])] \
+                if limit > 0 else []
+
+
+# Глобальный экземпляр
+holdings_index = HoldingsIndex()
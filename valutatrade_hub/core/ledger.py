@@ -0,0 +1,193 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import defaultdict, deque
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from ..infra.settings import settings
+
+# Остаток лота меньше этого значения считается нулевым
+_EPSILON = 1e-12
+
+
+class _TimeIndex:
+    """Список сделок, упорядоченный по времени, с выборкой по диапазону"""
+
+    def __init__(self):
+        self.timestamps = []
+        self.trades = []
+
+    def add(self, trade: Dict):
+        # Сделки почти всегда приходят по порядку, поэтому это append
+        position = bisect_right(self.timestamps, trade["timestamp"])
+        self.timestamps.insert(position, trade["timestamp"])
+        self.trades.insert(position, trade)
+
+    def range(self, start: float = None, end: float = None) -> List[Dict]:
+        first = 0 if start is None else bisect_left(self.timestamps, start)
+        last = len(self.timestamps) if end is None else bisect_right(
+            self.timestamps, end)
+        return self.trades[first:last]
+
+
+class TradeLedger:
+    """Журнал исполненных сделок с индексами и FIFO-лотами.
+
+    Сделки дописываются в trades.jsonl по одной строке. В памяти журнал
+    индексируется по пользователю, по валюте и по кошельку
+    (пользователь + валюта), а для каждого кошелька ведётся очередь
+    налоговых лотов. Реализованный P&L накапливается при каждой продаже,
+    поэтому запрос P&L пользователя - O(1), а выборка сделок - O(log n + k).
+    Журнал дочитывает строки, дописанные другими процессами.
+    """
+
+    def __init__(self, path=None):
+        self.path = Path(path or settings.data_dir() / "trades.jsonl")
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self._offset = 0  # сколько байт файла уже применено
+        self._count = 0
+        self._by_user = defaultdict(_TimeIndex)
+        self._by_currency = defaultdict(_TimeIndex)
+        self._by_wallet = defaultdict(_TimeIndex)
+        self._lots = defaultdict(deque)          # (user_id, код) -> [[кол-во, цена]]
+        self._open_qty = defaultdict(float)      # (user_id, код) -> кол-во в лотах
+        self._open_cost = defaultdict(float)     # (user_id, код) -> стоимость лотов
+        self._realized = defaultdict(float)      # user_id -> реализованный P&L
+        self._realized_by_wallet = defaultdict(float)
+
+    def _sync(self):
+        """Применить строки, появившиеся в файле с прошлого чтения"""
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            size = 0
+
+        if size < self._offset:  # файл заменён или обрезан
+            self._reset()
+        if size == self._offset:
+            return
+
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            chunk = f.read(size - self._offset)
+
+        # Незавершённая последняя строка будет дочитана позже
+        complete = chunk[:chunk.rfind(b"\n") + 1]
+        for line in complete.splitlines():
+            if line.strip():
+                self._apply(json.loads(line))
+        self._offset += len(complete)
+
+    def _apply(self, trade: Dict):
+        user_id = trade["user_id"]
+        code = trade["currency_code"]
+        wallet = (user_id, code)
+
+        self._count += 1
+        self._by_user[user_id].add(trade)
+        self._by_currency[code].add(trade)
+        self._by_wallet[wallet].add(trade)
+
+        amount, rate = trade["amount"], trade["rate"]
+        lots = self._lots[wallet]
+
+        if trade["side"] == "BUY":
+            lots.append([amount, rate])
+            self._open_qty[wallet] += amount
+            self._open_cost[wallet] += amount * rate
+            return
+
+        # Продажа закрывает самые старые лоты. Количество без лотов
+        # (например, пополненное через deposit) не имеет базы и в P&L
+        # не учитывается.
+        remaining = amount
+        realized = 0.0
+        while remaining > _EPSILON and lots:
+            lot = lots[0]
+            taken = min(remaining, lot[0])
+            realized += taken * (rate - lot[1])
+            lot[0] -= taken
+            remaining -= taken
+            self._open_qty[wallet] -= taken
+            self._open_cost[wallet] -= taken * lot[1]
+            if lot[0] <= _EPSILON:
+                lots.popleft()
+
+        self._realized[user_id] += realized
+        self._realized_by_wallet[wallet] += realized
+
+    def record(self, user_id: int, side: str, currency_code: str,
+               amount: float, rate: float) -> Dict:
+        """Записать исполненную сделку (side: BUY или SELL)"""
+        with self._lock:
+            self._sync()
+            trade = {
+                "trade_id": self._count + 1,
+                "user_id": user_id,
+                "side": side,
+                "currency_code": currency_code,
+                "amount": amount,
+                "rate": rate,
+                "total_usd": amount * rate,
+                "timestamp": time.time(),
+            }
+
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            line = json.dumps(trade, ensure_ascii=False) + "\n"
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+            # Применяем всё, включая чужие строки, дописанные до нашей
+            self._sync()
+            return trade
+
+    def get_trades(self, user_id: Optional[int] = None,
+                   currency_code: Optional[str] = None,
+                   start: float = None, end: float = None) -> List[Dict]:
+        """Сделки по пользователю и/или валюте за интервал [start, end]"""
+        with self._lock:
+            self._sync()
+            if user_id is not None and currency_code is not None:
+                index = self._by_wallet.get((user_id, currency_code))
+            elif user_id is not None:
+                index = self._by_user.get(user_id)
+            elif currency_code is not None:
+                index = self._by_currency.get(currency_code)
+            else:
+                raise ValueError("Укажите пользователя или валюту")
+            return index.range(start, end) if index else []
+
+    def realized_pnl(self, user_id: int,
+                     currency_code: Optional[str] = None) -> float:
+        """Реализованный P&L пользователя в USD"""
+        with self._lock:
+            self._sync()
+            if currency_code is None:
+                return self._realized.get(user_id, 0.0)
+            return self._realized_by_wallet.get((user_id, currency_code), 0.0)
+
+    def open_position(self, user_id: int,
+                      currency_code: str) -> Tuple[float, float]:
+        """Количество и стоимость открытых лотов кошелька"""
+        with self._lock:
+            self._sync()
+            wallet = (user_id, currency_code)
+            return self._open_qty.get(wallet, 0.0), self._open_cost.get(wallet, 0.0)
+
+    def unrealized_pnl(self, user_id: int, currency_code: str,
+                       rate: float) -> float:
+        """Нереализованный P&L открытых лотов по текущему курсу"""
+        quantity, cost = self.open_position(user_id, currency_code)
+        return quantity * rate - cost
+
+
+# Глобальный экземпляр
+trade_ledger = TradeLedger()
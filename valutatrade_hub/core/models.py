@@ -9,6 +9,11 @@ from .currencies import (
 from .exceptions import InsufficientFundsError
 
 
+def hash_password(password: str, salt: str) -> str:
+    """Хеш пароля с солью (функция модуля - доступна процессам пула)"""
+    return hashlib.sha256(f"{password}{salt}".encode()).hexdigest()
+
+
 class User:
     def __init__(self, user_id: int, username: str, password: str, salt: str = None):
         self._user_id = user_id
@@ -57,7 +62,7 @@ class User:
         return self._registration_date
     
     def _hash_password(self, password: str, salt: str) -> str:
-        return hashlib.sha256(f"{password}{salt}".encode()).hexdigest()
+        return hash_password(password, salt)
     
     def get_user_info(self) -> Dict:
         return {
@@ -189,10 +194,11 @@ class Portfolio:
     
     def get_total_value(self, base_currency: str = 'USD') -> float:
         from ..infra.database import db
-        from .utils import is_rate_fresh
+        from .utils import is_rate_fresh, pair_updated_at
         
         rates = db.read_json("rates.json")
         pairs = rates.get("pairs", {})
+        confirmations = db.read_json("rate_confirmations.json") or {}
         
         total = 0.0
         for wallet in self._wallets.values():
@@ -202,7 +208,8 @@ class Portfolio:
                 pair_key = f"{wallet.currency_code}_{base_currency}"
                 if pair_key in pairs:
                     rate_info = pairs[pair_key]
-                    if is_rate_fresh(rate_info.get("updated_at", "")):
+                    updated_at = pair_updated_at(rates, pair_key, confirmations)
+                    if is_rate_fresh(updated_at):
                         total += wallet.balance * rate_info["rate"]
         
         return total
@@ -0,0 +1,198 @@
+import heapq
+import json
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from ..infra.database import atomic_write_json, file_version
+from ..infra.locks import file_lock
+from ..infra.settings import settings
+from .currencies import validate_currency_code
+
+logger = logging.getLogger(__name__)
+
+ORDER_SIDES = ("buy", "sell")
+ORDER_TYPES = ("limit", "stop")
+
+
+def _fires_below(side: str, order_type: str) -> bool:
+    """Срабатывает ли заявка при падении цены до триггера.
+
+    Лимитная покупка и стоп продажи исполняются, когда цена <= триггера;
+    стоп покупки и лимитная продажа - когда цена >= триггера.
+    """
+    return (side == "buy") == (order_type == "limit")
+
+
+class _PairTriggers:
+    """Триггеры одной пары в двух кучах.
+
+    below - max-куча заявок "цена <= триггер" (ключ -триггер),
+    above - min-куча заявок "цена >= триггер" (ключ триггер).
+    На каждом тике снимаются только сработавшие заявки: O(k log n).
+    """
+
+    def __init__(self):
+        self.below = []
+        self.above = []
+
+    def push(self, order: Dict):
+        if _fires_below(order["side"], order["type"]):
+            heapq.heappush(self.below, (-order["trigger_price"], order["order_id"]))
+        else:
+            heapq.heappush(self.above, (order["trigger_price"], order["order_id"]))
+
+    def pop_fired(self, price: float) -> List[int]:
+        fired = []
+        while self.below and -self.below[0][0] >= price:
+            fired.append(heapq.heappop(self.below)[1])
+        while self.above and self.above[0][0] <= price:
+            fired.append(heapq.heappop(self.above)[1])
+        return fired
+
+
+class OrderBook:
+    """Отложенные лимитные и стоп-заявки.
+
+    Открытые заявки хранятся в orders.json и переживают перезапуск;
+    если файл изменил другой процесс, кучи перестраиваются.
+    Отменённые заявки удаляются из кучи лениво: при срабатывании
+    заявка, которой уже нет среди открытых, пропускается. Чтение,
+    изменение и запись orders.json идут под flock orders.lock, чтобы
+    размещение в одном процессе и исполнение в другом (планировщик,
+    лента) не затирали друг друга.
+    """
+
+    def __init__(self, path=None):
+        self.path = Path(path or settings.data_dir() / "orders.json")
+        self._lock_path = self.path.with_suffix(".lock")
+        self._lock = threading.RLock()
+        self._orders = None   # order_id -> заявка, загружаются лениво
+        self._triggers = {}   # пара -> _PairTriggers
+        self._next_id = 1
+        self._version = None  # метка orders.json, с которой согласована память
+
+    def _load(self):
+        version = file_version(self.path)
+        if self._orders is not None and version == self._version:
+            return
+        self._orders = {}
+        self._triggers = {}
+        self._version = version
+        data = {}
+        if version is not None:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        self._next_id = data.get("next_id", 1)
+        for order in data.get("orders", []):
+            self._index(order)
+
+    def _index(self, order: Dict):
+        self._orders[order["order_id"]] = order
+        self._triggers.setdefault(order["pair"], _PairTriggers()).push(order)
+
+    def _save(self):
+        atomic_write_json(self.path, {
+            "next_id": self._next_id,
+            "orders": list(self._orders.values()),
+        }, ensure_ascii=False)
+        self._version = file_version(self.path)
+
+    def place(self, user_id: int, side: str, order_type: str,
+              currency_code: str, amount: float, trigger_price: float) -> Dict:
+        """Разместить заявку; цена триггера задаётся в USD"""
+        currency_code = currency_code.upper()
+        if side not in ORDER_SIDES:
+            raise ValueError(f"Неизвестная сторона заявки: {side}")
+        if order_type not in ORDER_TYPES:
+            raise ValueError(f"Неизвестный тип заявки: {order_type}")
+        if not validate_currency_code(currency_code) or currency_code == "USD":
+            raise ValueError(f"Неизвестная валюта: {currency_code}")
+        if amount <= 0 or trigger_price <= 0:
+            raise ValueError("Количество и цена должны быть положительными")
+
+        with self._lock, file_lock(self._lock_path):
+            self._load()
+            order = {
+                "order_id": self._next_id,
+                "user_id": user_id,
+                "side": side,
+                "type": order_type,
+                "currency_code": currency_code,
+                "pair": f"{currency_code}_USD",
+                "amount": amount,
+                "trigger_price": trigger_price,
+                "created_at": time.time(),
+            }
+            self._next_id += 1
+            self._index(order)
+            self._save()
+            return order
+
+    def cancel(self, user_id: int, order_id: int) -> bool:
+        """Отменить свою заявку"""
+        with self._lock, file_lock(self._lock_path):
+            self._load()
+            order = self._orders.get(order_id)
+            if not order or order["user_id"] != user_id:
+                return False
+            del self._orders[order_id]
+            self._save()
+            return True
+
+    def get_orders(self, user_id: Optional[int] = None) -> List[Dict]:
+        """Открытые заявки (всех пользователей или одного)"""
+        with self._lock:
+            self._load()
+            return [
+                order for order in self._orders.values()
+                if user_id is None or order["user_id"] == user_id
+            ]
+
+    def on_rates(self, pairs: Dict) -> List[Dict]:
+        """Исполнить заявки, сработавшие на новых курсах.
+
+        Вызывается после сохранения rates.json, поэтому сделки проходят
+        через PortfolioManager по тем же курсам. Возвращает сработавшие
+        заявки с результатом исполнения.
+        """
+        from .usecases import PortfolioManager
+
+        with self._lock, file_lock(self._lock_path):
+            self._load()
+            fired = []
+            for pair, triggers in self._triggers.items():
+                rate_info = pairs.get(pair)
+                if not rate_info:
+                    continue
+                for order_id in triggers.pop_fired(rate_info["rate"]):
+                    order = self._orders.pop(order_id, None)
+                    if order is not None:  # иначе заявка уже отменена
+                        fired.append(order)
+
+            if not fired:
+                return []
+            # Сначала фиксируем снятие заявок, чтобы не исполнить их дважды
+            self._save()
+
+        for order in fired:
+            execute = PortfolioManager.buy_currency if order["side"] == "buy" \
+                else PortfolioManager.sell_currency
+            try:
+                success, message = execute(
+                    order["user_id"], order["currency_code"], order["amount"])
+            except Exception as e:
+                success, message = False, str(e)
+
+            order["executed"] = success
+            order["message"] = message
+            # При нехватке средств заявка снимается с пометкой об ошибке
+            status = "исполнена" if success else "отклонена"
+            logger.info(f"Заявка #{order['order_id']} {status}: {message}")
+        return fired
+
+
+# Глобальный экземпляр
+order_book = OrderBook()
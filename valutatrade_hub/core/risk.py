@@ -0,0 +1,181 @@
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from ..infra.database import db
+from ..parser_service.retention import RetentionManager, bar_points
+from ..parser_service.storage import DataStorage
+from .utils import to_epoch
+from .valuation import _balances, _load_pairs, _usd_rate
+
+# Уровни доверия, для которых считаются VaR и ES
+CONFIDENCE_LEVELS = (0.95, 0.99)
+
+_SECONDS_PER_DAY = 86400
+# Меньше этого числа портфелей пул процессов не окупает своего запуска
+_POOL_THRESHOLD = 2000
+DEFAULT_CHUNK_SIZE = 500
+
+# Матрица доходностей в процессе-исполнителе (задаётся инициализатором пула)
+_worker_columns = None
+
+
+def daily_closes(history: List[Dict]) -> Dict[str, Dict[int, float]]:
+    """Последний курс каждой пары X_USD за каждые UTC-сутки истории"""
+    closes = {}
+    stamps = {}
+    for entry in history:
+        pair = entry.get("pair", "")
+        if not pair.endswith("_USD") or "rate" not in entry:
+            continue
+        try:
+            timestamp = to_epoch(entry.get("recorded_at", entry.get("updated_at")))
+        except ValueError:
+            continue
+        day = int(timestamp // _SECONDS_PER_DAY)
+        if timestamp >= stamps.get((pair, day), -math.inf):
+            stamps[(pair, day)] = timestamp
+            closes.setdefault(pair[:-4], {})[day] = float(entry["rate"])
+    return closes
+
+
+def build_returns(
+        closes: Dict[str, Dict[int, float]]) -> Tuple[List[str], List[List[float]]]:
+    """Матрица дневных доходностей: (коды валют, столбцы доходностей).
+
+    Сценарии - пары соседних суток общей сетки. Пропущенные сутки
+    заполняются последним известным курсом, поэтому до первого
+    наблюдения и в пропусках доходность валюты нулевая.
+    """
+    days = sorted({day for series in closes.values() for day in series})
+    codes = sorted(closes)
+    columns = []
+    for code in codes:
+        series = closes[code]
+        column = []
+        previous = None
+        for day in days:
+            price = series.get(day, previous)
+            if previous and price:
+                column.append(price / previous - 1.0)
+            elif day != days[0]:
+                column.append(0.0)
+            previous = price
+        columns.append(column)
+    return codes, columns
+
+
+def tail_measures(pnl: Sequence[float],
+                  levels: Sequence[float] = CONFIDENCE_LEVELS) -> Dict[str, float]:
+    """VaR и expected shortfall (в виде положительного убытка) по сценариям"""
+    ordered = sorted(pnl)
+    measures = {}
+    for level in levels:
+        tail = max(1, math.ceil((1.0 - level) * len(ordered)))
+        percent = round(level * 100)
+        measures[f"var{percent}"] = -ordered[tail - 1]
+        measures[f"es{percent}"] = -sum(ordered[:tail]) / tail
+    return measures
+
+
+def _scenario_pnl(columns: List[List[float]],
+                  exposures: Sequence[Tuple[int, float]]) -> List[float]:
+    """P&L портфеля по всем сценариям: сумма позиций на столбцы доходностей"""
+    pnl = [0.0] * len(columns[0])
+    for index, exposure in exposures:
+        pnl = [p + exposure * r for p, r in zip(pnl, columns[index])]
+    return pnl
+
+
+def _evaluate_chunk(chunk, columns=None) -> List[Dict]:
+    columns = columns if columns is not None else _worker_columns
+    results = []
+    for user_id, value, exposures in chunk:
+        result = {"user_id": user_id, "value": value}
+        if exposures:
+            result.update(tail_measures(_scenario_pnl(columns, exposures)))
+        else:
+            result.update(tail_measures([0.0]))
+        results.append(result)
+    return results
+
+
+def _init_worker(columns):
+    global _worker_columns
+    _worker_columns = columns
+
+
+class RiskEngine:
+    """Историческое моделирование VaR/ES на 1 день по истории курсов.
+
+    Матрица доходностей всех пар строится один раз, затем к ней
+    применяется матрица позиций пользователи x валюты (в USD).
+    Позиции разрежены, поэтому для каждого портфеля складываются только
+    столбцы его валют. Портфели обрабатываются пачками, большие
+    наборы - в пуле процессов.
+    """
+
+    def __init__(self, codes: List[str], columns: List[List[float]]):
+        if not columns or len(columns[0]) < 2:
+            raise ValueError("Недостаточно истории курсов для оценки риска")
+        self.codes = codes
+        self.columns = columns
+        self._index = {code: i for i, code in enumerate(codes)}
+
+    @classmethod
+    def from_history(cls, history: List[Dict] = None) -> "RiskEngine":
+        if history is None:
+            # Старая история хранится только в агрегатах после уплотнения
+            history = (bar_points(RetentionManager().all_bars())
+                       + DataStorage().load_historical())
+        return cls(*build_returns(daily_closes(history)))
+
+    @property
+    def scenario_count(self) -> int:
+        return len(self.columns[0])
+
+    def exposures(self, balances: Dict[str, float],
+                  pairs: Dict) -> Tuple[float, List[Tuple[int, float]]]:
+        """Стоимость портфеля и позиции (индекс столбца, сумма в USD)"""
+        value = 0.0
+        exposures = []
+        for code, balance in balances.items():
+            rate = _usd_rate(pairs, code)
+            if rate is None or not balance:
+                continue
+            value += balance * rate
+            # Валюты без истории (и сам USD) риска не добавляют
+            if code in self._index:
+                exposures.append((self._index[code], balance * rate))
+        return value, exposures
+
+    def evaluate(self, portfolios: List[Dict], pairs: Dict = None,
+                 workers: Optional[int] = None,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE) -> List[Dict]:
+        """Риск для списка портфелей в формате portfolios.json"""
+        if pairs is None:
+            pairs = _load_pairs()
+        rows = [
+            (data["user_id"], *self.exposures(_balances(data), pairs))
+            for data in portfolios
+        ]
+        chunks = [rows[i:i + chunk_size] for i in range(0, len(rows), chunk_size)]
+
+        if len(rows) < _POOL_THRESHOLD or workers == 1:
+            return [
+                result for chunk in chunks
+                for result in _evaluate_chunk(chunk, self.columns)
+            ]
+
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                                 initializer=_init_worker,
+                                 initargs=(self.columns,)) as pool:
+            return [
+                result for chunk_results in pool.map(_evaluate_chunk, chunks)
+                for result in chunk_results
+            ]
+
+    def evaluate_user(self, user_id: int, pairs: Dict = None) -> Optional[Dict]:
+        data = db.find_record("portfolios.json", "user_id", user_id)
+        return None if data is None else self.evaluate([data], pairs)[0]
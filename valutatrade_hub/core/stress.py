@@ -0,0 +1,142 @@
+"""Нагрузочная проверка параллельных сделок.
+
+Запуск: python -m valutatrade_hub.core.stress [--users N] [--trades N]
+[--threads N]. Работает во временном каталоге данных со своими
+курсами, рабочие данные не трогает.
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ..infra.settings import settings
+
+_RATES = {"BTC": 50000.0, "EUR": 1.25, "ETH": 2500.0}
+_INITIAL_USD = 10000.0
+
+
+def _prepare_data(users: int):
+    data_dir = settings.data_dir()
+    os.makedirs(data_dir, exist_ok=True)
+    now = time.time()
+    with open(data_dir / "rates.json", 'w', encoding='utf-8') as f:
+        json.dump({
+            "pairs": {
+                f"{code}_USD": {"rate": rate, "updated_at": now, "source": "stress"}
+                for code, rate in _RATES.items()
+            },
+            "version": 1,
+            "last_refresh": now,
+        }, f)
+    with open(data_dir / "portfolios.json", 'w', encoding='utf-8') as f:
+        json.dump([
+            {"user_id": user_id, "wallets": {
+                "USD": {"currency_code": "USD", "balance": _INITIAL_USD}}}
+            for user_id in range(1, users + 1)
+        ], f)
+
+
+def _portfolio_value(wallets) -> float:
+    return sum(
+        wallet["balance"] * _RATES.get(code, 1.0) for code, wallet in wallets.items()
+    )
+
+
+def run_stress(users: int = 20, trades: int = 2000, threads: int = 16,
+               seed: int = 1) -> dict:
+    """Случайные покупки и продажи из пула потоков по общим портфелям.
+
+    При постоянных курсах сделка не меняет стоимость портфеля, поэтому
+    после прогона стоимость каждого портфеля должна остаться равной
+    начальной, балансы - неотрицательными, а баланс каждой валюты -
+    равным сумме успешных сделок по ней. Возвращает сводку и список
+    нарушений (пустой, если инварианты выполнены).
+    """
+    # Пути глобальных объектов вычисляются при импорте, поэтому сделки
+    # импортируются после того, как каталог данных задан
+    from .usecases import PortfolioManager
+    
+    rng = random.Random(seed)
+    plan = [
+        (rng.randint(1, users), rng.choice(("buy", "sell")),
+         rng.choice(list(_RATES)), round(rng.uniform(0.01, 0.2), 4))
+        for _ in range(trades)
+    ]
+    expected = {}
+    expected_lock = threading.Lock()
+
+    def execute(trade):
+        user_id, side, code, amount = trade
+        if side == "buy":
+            success, _ = PortfolioManager.buy_currency(user_id, code, amount)
+        else:
+            success, _ = PortfolioManager.sell_currency(user_id, code, amount)
+        if success:
+            with expected_lock:
+                key = (user_id, code)
+                expected[key] = expected.get(key, 0.0) + (
+                    amount if side == "buy" else -amount)
+        return success
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        succeeded = sum(pool.map(execute, plan))
+    elapsed = time.perf_counter() - started
+
+    with open(settings.data_dir() / "portfolios.json", 'r', encoding='utf-8') as f:
+        portfolios = {data["user_id"]: data["wallets"] for data in json.load(f)}
+
+    violations = []
+    for user_id in range(1, users + 1):
+        wallets = portfolios.get(user_id, {})
+        value = _portfolio_value(wallets)
+        if abs(value - _INITIAL_USD) > 1e-6 * _INITIAL_USD:
+            violations.append(f"user {user_id}: стоимость {value:.6f}")
+        for code, wallet in wallets.items():
+            if wallet["balance"] < -1e-9:
+                violations.append(f"user {user_id}: {code} = {wallet['balance']}")
+            if code in _RATES:
+                held = expected.get((user_id, code), 0.0)
+                if abs(wallet["balance"] - held) > 1e-9:
+                    violations.append(
+                        f"user {user_id}: {code} = {wallet['balance']}, "
+                        f"по сделкам {held}")
+    return {
+        "trades": trades,
+        "succeeded": succeeded,
+        "seconds": elapsed,
+        "violations": violations,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="stress")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--trades", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=16)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        settings.DATA_DIR = os.path.join(tmp, "data")
+        settings.HOT_DIR = None
+        # Снимок быстрого старта сохранялся бы при выходе в удалённый каталог
+        settings.WARM_START = False
+        _prepare_data(args.users)
+        result = run_stress(args.users, args.trades, args.threads)
+
+    print(f"Сделок: {result['trades']}, успешных: {result['succeeded']}, "
+          f"время: {result['seconds']:.2f} с")
+    if result["violations"]:
+        print("Нарушения сохранности балансов:")
+        for violation in result["violations"][:20]:
+            print(f"  {violation}")
+        raise SystemExit(1)
+    print("Балансы сохранены")
+
+
+if __name__ == "__main__":
+    main()
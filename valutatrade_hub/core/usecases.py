@@ -1,18 +1,39 @@
-from typing import Optional, Tuple
+import csv
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, TextIO, Tuple
 
 from ..decorators import log_action
 from ..infra.database import db
+from ..infra.events import TOPIC_PORTFOLIO, publish
+from ..infra.locks import StripedLock
+from ..tracing import traced
 from .currencies import validate_currency_code
 from .exceptions import (
     RegistrationError,
     ValutaTradeException,
 )
-from .models import Portfolio, User
+from .holdings import holdings_index, wallet_balances
+from .ledger import trade_ledger
+from .models import Portfolio, User, hash_password
+from .valuation import valuation_history
 
+logger = logging.getLogger(__name__)
 
-def get_next_user_id() -> int:
+# Меньше этого числа записей пул процессов не окупает своего запуска
+_BULK_POOL_THRESHOLD = 2000
+
+# Операции с портфелем одного пользователя выполняются по очереди
+user_locks = StripedLock()
+
+
+def get_next_user_id(users: Optional[List[Dict]] = None) -> int:
     """Генерация следующего ID пользователя"""
-    users = db.read_json("users.json")
+    if users is None:
+        users = db.read_json("users.json")
     if not users:
         return 1
     return max(user["user_id"] for user in users) + 1
@@ -31,56 +52,182 @@ class UserManager:
         if len(password) < 4:
             raise RegistrationError("Пароль должен быть не короче 4 символов")
         
-        user_id = get_next_user_id()
-        user = User(user_id, username, password)
+        # Пароль хешируется заранее, а ID выделяется и имя перепроверяется
+        # уже на свежем содержимом users.json при записи: параллельная
+        # регистрация (в том числе массовая) не теряется и не дублирует ID
+        user_data = User(0, username, password).to_dict()
+        
+        def add_user(users):
+            if any(user["username"] == username for user in users):
+                return
+            user_data["user_id"] = get_next_user_id(users)
+            users.append(user_data)
         
-        users.append(user.to_dict())
-        db.write_json("users.json", users)
+        db.update_json("users.json", add_user)
+        user_id = user_data["user_id"]
+        if not user_id:
+            raise RegistrationError(f"Имя пользователя '{username}' уже занято")
         
-        portfolios = db.read_json("portfolios.json")
-        portfolio = Portfolio(user_id)
-        portfolios.append(portfolio.to_dict())
-        db.write_json("portfolios.json", portfolios)
+        # Портфель дописывается к свежему содержимому файла, чтобы не
+        # затереть сделки, записанные параллельно
+        portfolio_data = Portfolio(user_id).to_dict()
+        db.update_json("portfolios.json",
+                       lambda portfolios: portfolios.append(portfolio_data))
         
         return user_id
     
+    @staticmethod
+    def read_credentials(stream: TextIO,
+                         fmt: str = "csv") -> Iterable[Tuple[int, Dict]]:
+        """Записи (номер строки, {"username", "password"}) из CSV или JSONL.
+
+        CSV должен иметь заголовок с колонками username и password.
+        Строка JSONL, которая не разбирается, даёт запись None.
+        """
+        if fmt == "csv":
+            for line_no, row in enumerate(csv.DictReader(stream), start=2):
+                yield line_no, row
+        elif fmt == "jsonl":
+            for line_no, line in enumerate(stream, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield line_no, json.loads(line)
+                except json.JSONDecodeError:
+                    yield line_no, None
+        else:
+            raise ValueError(f"Неизвестный формат: {fmt}")
+    
+    @staticmethod
+    @log_action("REGISTER_BULK")
+    def register_users_bulk(stream: TextIO, fmt: str = "csv",
+                            workers: Optional[int] = None) -> Dict:
+        """Массовая регистрация пользователей из потока CSV/JSONL.
+
+        Уникальность имён проверяется по множеству, ID выделяются одним
+        диапазоном, пароли хешируются в пуле процессов, users.json и
+        portfolios.json записываются по одному разу. Некорректные
+        записи и занятые имена пропускаются и возвращаются в "skipped".
+        Диапазон ID выделяется и имена перепроверяются на свежем
+        содержимом users.json при записи, поэтому регистрации, прошедшие
+        во время хеширования, не теряются.
+        """
+        users = db.read_json("users.json")
+        taken = {user["username"] for user in users}
+        
+        accepted = []
+        line_numbers = {}
+        skipped = []
+        for line_no, record in UserManager.read_credentials(stream, fmt):
+            if record is None:
+                skipped.append((line_no, "строка не разбирается как JSON"))
+                continue
+            if not isinstance(record, dict):
+                skipped.append((line_no, "запись не является объектом"))
+                continue
+            username = record.get("username") or ""
+            password = record.get("password") or ""
+            if not isinstance(username, str) or not isinstance(password, str):
+                skipped.append((line_no, "имя и пароль должны быть строками"))
+                continue
+            username = username.strip()
+            if not username:
+                skipped.append((line_no, "пустое имя пользователя"))
+            elif username in taken:
+                skipped.append((line_no, f"имя '{username}' уже занято"))
+            elif len(password) < 4:
+                skipped.append((line_no, "пароль короче 4 символов"))
+            else:
+                taken.add(username)
+                accepted.append((username, password))
+                line_numbers[username] = line_no
+        
+        if not accepted:
+            return {"created": 0, "first_id": None, "skipped": skipped}
+        
+        salts = [os.urandom(16).hex() for _ in accepted]
+        passwords = [password for _, password in accepted]
+        if len(accepted) < _BULK_POOL_THRESHOLD or workers == 1:
+            hashes = list(map(hash_password, passwords, salts))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                chunksize = max(1, len(accepted) // ((workers or os.cpu_count()) * 4))
+                hashes = list(pool.map(hash_password, passwords, salts,
+                                       chunksize=chunksize))
+        
+        registered_at = datetime.now().isoformat()
+        new_users = []
+        
+        def add_users(users):
+            new_users.clear()
+            current = {user["username"] for user in users}
+            next_id = get_next_user_id(users)
+            for (username, _), salt, hashed in zip(accepted, salts, hashes):
+                if username in current:
+                    continue  # зарегистрирован параллельно
+                new_users.append({
+                    "user_id": next_id + len(new_users),
+                    "username": username,
+                    "hashed_password": hashed,
+                    "salt": salt,
+                    "registration_date": registered_at
+                })
+            users.extend(new_users)
+        
+        db.update_json("users.json", add_users)
+        
+        created = {user["username"] for user in new_users}
+        skipped.extend((line_numbers[username], f"имя '{username}' уже занято")
+                       for username, _ in accepted if username not in created)
+        if not new_users:
+            return {"created": 0, "first_id": None, "skipped": skipped}
+        
+        new_portfolios = [Portfolio(user["user_id"]).to_dict() for user in new_users]
+        db.update_json("portfolios.json",
+                       lambda portfolios: portfolios.extend(new_portfolios))
+        
+        return {"created": len(new_users), "first_id": new_users[0]["user_id"],
+                "skipped": skipped}
+    
     @staticmethod
     @log_action("LOGIN")
     def login_user(username: str, password: str) -> Tuple[bool, str, Optional[User]]:
-        users = db.read_json("users.json")
+        user_data = db.find_record("users.json", "username", username)
         
-        for user_data in users:
-            if user_data["username"] == username:
-                user = User.from_dict(user_data)
-                if user.verify_password(password):
-                    return True, f"Вы вошли как '{username}'", user
+        if user_data is not None:
+            user = User.from_dict(user_data)
+            if user.verify_password(password):
+                return True, f"Вы вошли как '{username}'", user
         
         return False, "Неверное имя пользователя или пароль", None
 
 
 class PortfolioManager:
     @staticmethod
+    @traced("PortfolioManager.get_user_portfolio")
     def get_user_portfolio(user_id: int) -> Optional[Portfolio]:
-        portfolios = db.read_json("portfolios.json")
+        portfolio_data = db.find_record("portfolios.json", "user_id", user_id)
         
-        for portfolio_data in portfolios:
-            if portfolio_data["user_id"] == user_id:
-                return Portfolio.from_dict(portfolio_data)
+        if portfolio_data is not None:
+            return Portfolio.from_dict(portfolio_data)
         
         return None
     
     
     @staticmethod
+    @user_locks.serialized
     @log_action("DEPOSIT")
     def deposit_currency(user_id: int, currency_code: str, 
-                         amount: float) -> Tuple[bool, str]:
+                         amount: float,
+                         portfolio: Optional[Portfolio] = None) -> Tuple[bool, str]:
         if amount <= 0:
             return False, "Сумма должна быть положительной"
         
         if not validate_currency_code(currency_code):
             return False, f"Неизвестная валюта: {currency_code}"
         
-        portfolio = PortfolioManager.get_user_portfolio(user_id)
+        if portfolio is None:
+            portfolio = PortfolioManager.get_user_portfolio(user_id)
         if not portfolio:
             return False, "Портфель не найден"
         
@@ -102,29 +249,62 @@ class PortfolioManager:
             return False, str(e)
         
     @staticmethod
+    @traced("PortfolioManager.update_portfolio")
     def update_portfolio(portfolio: Portfolio):
-        portfolios = db.read_json("portfolios.json")
-        
-        for i, portfolio_data in enumerate(portfolios):
-            if portfolio_data["user_id"] == portfolio.user_id:
-                portfolios[i] = portfolio.to_dict()
-                break
-        else:
-            portfolios.append(portfolio.to_dict())
-        
-        db.write_json("portfolios.json", portfolios)
+        data = portfolio.to_dict()
+        # Прежние балансы и версия файла, к которому применена запись, -
+        # для сводки по валютам
+        replaced = {"old": None, "version": None}
+        
+        # Меняется только запись этого пользователя в свежем содержимом файла,
+        # поэтому параллельные записи других пользователей не теряются
+        def replace_portfolio(portfolios):
+            replaced["version"] = db.get_version("portfolios.json")
+            for i, portfolio_data in enumerate(portfolios):
+                if portfolio_data["user_id"] == data["user_id"]:
+                    replaced["old"] = portfolio_data
+                    portfolios[i] = data
+                    break
+            else:
+                portfolios.append(data)
+        
+        with user_locks.lock_for(portfolio.user_id):
+            db.update_json("portfolios.json", replace_portfolio)
+            holdings_index.apply_delta(
+                portfolio.user_id, wallet_balances(replaced["old"]),
+                wallet_balances(data), replaced["version"],
+                db.last_write_version("portfolios.json"))
+        
+        # Ряд стоимости и события - производные данные, сделку они не отменяют
+        try:
+            valuation_history.record_portfolio(portfolio)
+            publish(TOPIC_PORTFOLIO, {"user_id": portfolio.user_id})
+        except OSError as e:
+            logger.warning(f"Не удалось записать стоимость портфеля: {e}")
+    
+    @staticmethod
+    def _record_trade(user_id: int, side: str, currency_code: str,
+                      amount: float, rate: float):
+        """Запись исполненной сделки в журнал"""
+        try:
+            trade_ledger.record(user_id, side, currency_code, amount, rate)
+        except OSError as e:
+            logger.warning(f"Не удалось записать сделку в журнал: {e}")
     
     @staticmethod
+    @user_locks.serialized
     @log_action("BUY")
     def buy_currency(user_id: int, currency_code: str, 
-                     amount: float) -> Tuple[bool, str]:
+                     amount: float,
+                     portfolio: Optional[Portfolio] = None) -> Tuple[bool, str]:
         if amount <= 0:
             return False, "Количество должно быть положительным числом"
         
         if not validate_currency_code(currency_code):
             return False, f"Неизвестная валюта: {currency_code}"
         
-        portfolio = PortfolioManager.get_user_portfolio(user_id)
+        if portfolio is None:
+            portfolio = PortfolioManager.get_user_portfolio(user_id)
         if not portfolio:
             return False, "Портфель не найден"
         
@@ -155,6 +335,8 @@ class PortfolioManager:
             
             target_wallet.deposit(amount)
             PortfolioManager.update_portfolio(portfolio)
+            PortfolioManager._record_trade(user_id, "BUY", currency_code,
+                                           amount, rate)
             
             return True, f"Куплено {amount:.4f} {currency_code} за {cost_usd:.2f} USD"
             
@@ -162,16 +344,19 @@ class PortfolioManager:
             return False, str(e)
     
     @staticmethod
+    @user_locks.serialized
     @log_action("SELL")
     def sell_currency(user_id: int, currency_code: str, 
-                      amount: float) -> Tuple[bool, str]:
+                      amount: float,
+                      portfolio: Optional[Portfolio] = None) -> Tuple[bool, str]:
         if amount <= 0:
             return False, "Количество должно быть положительным числом"
         
         if not validate_currency_code(currency_code):
             return False, f"Неизвестная валюта: {currency_code}"
         
-        portfolio = PortfolioManager.get_user_portfolio(user_id)
+        if portfolio is None:
+            portfolio = PortfolioManager.get_user_portfolio(user_id)
         if not portfolio:
             return False, "Портфель не найден"
         
@@ -207,6 +392,8 @@ class PortfolioManager:
             
             usd_wallet.deposit(revenue_usd)
             PortfolioManager.update_portfolio(portfolio)
+            PortfolioManager._record_trade(user_id, "SELL", currency_code,
+                                           amount, rate)
             message = f"Продано {amount:.4f} {currency_code}" 
             message = message + f" за {revenue_usd:.2f} USD"
             return True, message
@@ -1,4 +1,6 @@
+import time
 from datetime import datetime
+from email.utils import parsedate_to_datetime
 
 
 def format_amount(amount: float, currency: str) -> str:
@@ -8,12 +10,50 @@ def format_amount(amount: float, currency: str) -> str:
     else:
         return f"{amount:.2f}"
 
-def is_rate_fresh(updated_at: str) -> bool:
-    """Проверка свежести курса"""
+def to_epoch(value) -> float:
+    """Приведение отметки времени к секундам UTC epoch.
+
+    Вызывается один раз при получении курса. Понимает числа, ISO 8601
+    (без зоны - локальное время) и RFC 2822, как в ответе ExchangeRate-API:
+    "Thu, 15 Jan 2026 00:00:01 +0000".
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if not isinstance(value, str) or not value:
+        raise ValueError(f"Некорректная отметка времени: {value!r}")
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        pass
     try:
-        from valutatrade_hub.infra.settings import settings
-        update_time = datetime.fromisoformat(updated_at.replace('Z', '+00:00'))
-        age = (datetime.now() - update_time).total_seconds()
-        return age < settings.RATES_TTL
-    except (ValueError, TypeError):
-        return False
\ No newline at end of file
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        raise ValueError(f"Некорректная отметка времени: {value!r}")
+
+_last_now = 0.0
+
+def wall_clock() -> float:
+    """Текущее время epoch, не идущее назад в пределах процесса"""
+    global _last_now
+    _last_now = max(_last_now, time.time())
+    return _last_now
+
+def pair_updated_at(rates: dict, pair: str, confirmations: dict = None):
+    """Время последнего подтверждения курса пары: изменения (updated_at в
+    снимке rates.json) или подтверждения без изменений (confirmations -
+    содержимое rate_confirmations.json)"""
+    updated_at = rates.get("pairs", {}).get(pair, {}).get("updated_at")
+    confirmed_at = (confirmations or rates.get("confirmed_at") or {}).get(pair)
+    if not isinstance(updated_at, (int, float)):
+        return confirmed_at
+    if not isinstance(confirmed_at, (int, float)):
+        return updated_at
+    return max(updated_at, confirmed_at)
+
+def is_rate_fresh(updated_at: float, now: float = None) -> bool:
+    """Проверка свежести курса (updated_at - секунды epoch)"""
+    from valutatrade_hub.infra.settings import settings
+    if not isinstance(updated_at, (int, float)):
+        return False
+    now = wall_clock() if now is None else now
+    return now - updated_at < settings.RATES_TTL
\ No newline at end of file
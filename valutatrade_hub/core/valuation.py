@@ -0,0 +1,185 @@
+import os
+import struct
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from ..infra.database import db
+from ..infra.settings import settings
+
+# Запись ряда: (время в секундах epoch, стоимость портфеля в USD)
+RECORD = struct.Struct("<dd")
+
+
+def _load_pairs() -> Dict:
+    """Текущие курсы из rates.json"""
+    rates = db.read_json("rates.json")
+    return rates.get("pairs", {}) if isinstance(rates, dict) else {}
+
+
+def _usd_rate(pairs: Dict, currency_code: str) -> Optional[float]:
+    if currency_code == "USD":
+        return 1.0
+    rate_info = pairs.get(f"{currency_code}_USD")
+    return rate_info["rate"] if rate_info else None
+
+
+def value_wallets(balances: Dict[str, float], pairs: Dict) -> float:
+    """Стоимость балансов в USD по последним известным курсам"""
+    total = 0.0
+    for code, balance in balances.items():
+        rate = _usd_rate(pairs, code)
+        if rate is not None:
+            total += balance * rate
+    return total
+
+
+def _balances(portfolio_data: Dict) -> Dict[str, float]:
+    return {
+        code: wallet["balance"]
+        for code, wallet in portfolio_data.get("wallets", {}).items()
+    }
+
+
+class ValuationHistory:
+    """Инкрементальный ряд стоимости портфеля для каждого пользователя.
+
+    Каждый пользователь хранится в своём файле из записей фиксированного
+    размера, упорядоченных по времени. Последняя точка читается за O(1),
+    выборка по диапазону - бинарным поиском за O(log n + k).
+    """
+
+    def __init__(self, directory=None):
+        self.directory = Path(directory or settings.data_dir() / "valuations")
+
+    def _path(self, user_id: int) -> Path:
+        return self.directory / f"{user_id}.bin"
+
+    @staticmethod
+    def _count(f) -> int:
+        # Хвост от недописанной записи игнорируется
+        return os.fstat(f.fileno()).st_size // RECORD.size
+
+    @staticmethod
+    def _read_at(f, index: int) -> Tuple[float, float]:
+        f.seek(index * RECORD.size)
+        return RECORD.unpack(f.read(RECORD.size))
+
+    def last(self, user_id: int) -> Optional[Tuple[float, float]]:
+        """Последняя точка ряда (время, стоимость)"""
+        try:
+            with open(self._path(user_id), 'rb') as f:
+                count = self._count(f)
+                return self._read_at(f, count - 1) if count else None
+        except FileNotFoundError:
+            return None
+
+    def append(self, user_id: int, value: float, timestamp: float = None) -> bool:
+        """Добавить точку, если стоимость изменилась"""
+        previous = self.last(user_id)
+        if previous is not None and abs(previous[1] - value) <= 1e-9 * max(
+                1.0, abs(value)):
+            return False
+
+        timestamp = time.time() if timestamp is None else timestamp
+        if previous is not None and timestamp < previous[0]:
+            timestamp = previous[0]  # ряд должен оставаться упорядоченным
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._path(user_id)
+        with open(path, 'ab') as f:
+            size = f.tell()
+            if size % RECORD.size:
+                f.truncate(size - size % RECORD.size)
+            f.write(RECORD.pack(timestamp, value))
+        return True
+
+    def record_portfolio(self, portfolio, pairs: Dict = None) -> bool:
+        """Записать полную стоимость портфеля (после сделки)"""
+        pairs = _load_pairs() if pairs is None else pairs
+        balances = {
+            code: wallet.balance for code, wallet in portfolio.wallets.items()
+        }
+        return self.append(portfolio.user_id, value_wallets(balances, pairs))
+
+    def apply_rate_changes(self, old_pairs: Dict, new_pairs: Dict) -> int:
+        """Обновить ряды всех пользователей по изменению курсов.
+
+        Новая стоимость = последняя точка + сумма(баланс * изменение курса),
+        поэтому портфели не переоцениваются целиком. Возвращает число
+        добавленных точек.
+        """
+        deltas = {}
+        for pair, info in new_pairs.items():
+            code, _, quote = pair.partition("_")
+            if quote != "USD":
+                continue
+            old_info = old_pairs.get(pair)
+            delta = info["rate"] - (old_info["rate"] if old_info else 0.0)
+            if delta:
+                deltas[code] = delta
+
+        if not deltas:
+            return 0
+
+        timestamp = time.time()
+        written = 0
+        for portfolio_data in db.read_json("portfolios.json"):
+            balances = _balances(portfolio_data)
+            if not any(balances.get(code) for code in deltas):
+                continue
+
+            user_id = portfolio_data["user_id"]
+            previous = self.last(user_id)
+            if previous is None:
+                value = value_wallets(balances, {**old_pairs, **new_pairs})
+            else:
+                value = previous[1] + sum(
+                    balances.get(code, 0.0) * delta
+                    for code, delta in deltas.items()
+                )
+            written += self.append(user_id, value, timestamp)
+        return written
+
+    def get_range(self, user_id: int, start: float = None,
+                  end: float = None) -> List[Tuple[float, float]]:
+        """Точки ряда в интервале [start, end]"""
+        try:
+            f = open(self._path(user_id), 'rb')
+        except FileNotFoundError:
+            return []
+
+        with f:
+            count = self._count(f)
+
+            # Первая запись со временем >= start
+            lo, hi = 0, count
+            if start is None:
+                hi = 0
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if self._read_at(f, mid)[0] < start:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            first = lo
+
+            # Первая запись со временем > end
+            lo, hi = first, count
+            if end is None:
+                lo = count
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if self._read_at(f, mid)[0] <= end:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            last = lo
+
+            f.seek(first * RECORD.size)
+            chunk = f.read((last - first) * RECORD.size)
+        return list(RECORD.iter_unpack(chunk))
+
+
+# Глобальный экземпляр
+valuation_history = ValuationHistory()
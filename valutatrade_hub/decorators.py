@@ -4,6 +4,8 @@ import time
 from datetime import datetime
 from typing import Any, Callable, Dict
 
+from .tracing import span
+
 logger = logging.getLogger(__name__)
 
 
@@ -59,7 +61,11 @@ def log_action(action_name: str, verbose: bool = False):
             start_time = time.time()
             
             try:
-                result = func(*args, **kwargs)
+                with span(action_name, **{
+                    key: value for key, value in log_data.items()
+                    if key in ("user_id", "currency_code", "amount")
+                }):
+                    result = func(*args, **kwargs)
                 execution_time = time.time() - start_time
                 log_data["execution_time"] = f"{execution_time:.3f}s"
                 
@@ -1,6 +1,207 @@
 import json
+import os
+import tempfile
+import threading
+import time
 from pathlib import Path
 
+from ..tracing import span
+from .settings import settings
+from .warm_start import MISS, content_stamp, warm_start
+
+
+def atomic_write_json(filepath, data, **dump_kwargs):
+    """Атомарная запись JSON: временный файл + fsync + os.replace.
+
+    Читатель всегда видит либо старую, либо новую версию файла целиком,
+    но никогда не обрезанную. Возвращает метку содержимого записанного
+    файла (см. warm_start.content_stamp).
+    """
+    filepath = Path(filepath)
+    filepath.parent.mkdir(parents=True, exist_ok=True)
+    dump_kwargs.setdefault("indent", 2)
+    dump_kwargs.setdefault("default", str)
+
+    fd, tmp_name = tempfile.mkstemp(
+        prefix=f".{filepath.name}.", suffix=".tmp", dir=filepath.parent)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, **dump_kwargs)
+            f.flush()
+            os.fsync(f.fileno())
+            stamp = content_stamp(os.fstat(f.fileno()))
+        os.replace(tmp_name, filepath)
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except OSError:
+            pass
+        raise
+
+    _fsync_directory(filepath.parent)
+    return stamp
+
+
+def file_version(filepath):
+    """Дешёвая метка версии файла: (inode, mtime, ctime, размер) или None.
+
+    os.replace всегда создаёт новый inode, поэтому любая атомарная
+    перезапись меняет метку.
+    """
+    try:
+        st = os.stat(filepath)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_ctime_ns, st.st_size)
+
+
+def _fsync_directory(directory: Path):
+    """fsync каталога, чтобы переименование пережило сбой питания"""
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return  # Например, Windows не позволяет открыть каталог
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
+# Метка: данные для изменений нужно прочитать из файла при сбросе пачки
+_LOAD = object()
+
+
+class GroupCommitWriter:
+    """Групповая фиксация записей (group commit).
+
+    Первый поток, пришедший с записью, становится лидером: ждёт окно
+    window секунд, забирает все накопившиеся записи и сбрасывает их на диск
+    одним проходом. Для каждого файла пишется только последняя версия.
+    Остальные потоки ждут, пока их пачка не будет записана, поэтому
+    write() возвращается только после надёжной записи.
+
+    update() ставит в пачку не готовые данные, а изменение: лидер
+    читает файл один раз и применяет к нему все изменения пачки по
+    порядку. Так потоки, меняющие разные записи одного файла (портфели
+    разных пользователей), не затирают друг друга.
+
+    Ошибка записи одного файла (повреждённый JSON, исключение в
+    изменении) не мешает записи остальных файлов пачки и достаётся
+    только потокам, писавшим этот файл.
+    """
+
+    def __init__(self, window: float = 0.0, on_flush=None):
+        self.window = window
+        # on_flush(путь, данные, метка содержимого) после записи каждого файла
+        self._on_flush = on_flush
+        self._cond = threading.Condition()
+        # путь -> [данные или _LOAD, [изменения], загрузчик, параметры json.dump]
+        self._pending = {}
+        self._batch = 0         # номер пачки, собираемой сейчас
+        self._flushed = 0       # сколько пачек уже записано
+        self._flushing = False
+        self._errors = {}       # номер пачки -> {путь: исключение}
+        self._waiters = {}      # номер пачки -> сколько потоков ждёт её записи
+        self._versions = {}     # путь -> метка версии после нашей записи
+
+    def write(self, filepath, data, **dump_kwargs):
+        """Записать данные и дождаться надёжной записи пачки.
+
+        Изменения (update), уже стоящие в пачке для этого файла, не
+        отбрасываются: они применяются поверх записываемых данных, иначе
+        их вызывающие получили бы успех, а изменения пропали бы.
+        """
+        with self._cond:
+            entry = self._pending.get(Path(filepath))
+            mutators = entry[1] if entry is not None else []
+            self._pending[Path(filepath)] = [data, mutators, None, dump_kwargs]
+            self._wait_for_batch(Path(filepath))
+
+    def update(self, filepath, mutator, loader, **dump_kwargs):
+        """Применить mutator(данные) к текущему содержимому файла в пачке.
+
+        loader() читает файл, если до изменения в пачке не было полной
+        записи. mutator меняет данные на месте или возвращает новые.
+        """
+        with self._cond:
+            entry = self._pending.get(Path(filepath))
+            if entry is None:
+                entry = [_LOAD, [], loader, dump_kwargs]
+                self._pending[Path(filepath)] = entry
+            entry[1].append(mutator)
+            self._wait_for_batch(Path(filepath))
+
+    def _wait_for_batch(self, filepath: Path):
+        """Дождаться записи текущей пачки и поднять ошибку записи filepath,
+        если она была; вызывается с захваченной блокировкой"""
+        my_batch = self._batch
+        self._waiters[my_batch] = self._waiters.get(my_batch, 0) + 1
+
+        try:
+            while self._flushed <= my_batch:
+                if not self._flushing:
+                    self._flush_as_leader()
+                else:
+                    self._cond.wait()
+        finally:
+            # Ошибка пачки хранится, пока её не прочитают все ждущие потоки
+            self._waiters[my_batch] -= 1
+            if self._waiters[my_batch]:
+                errors = self._errors.get(my_batch, {})
+            else:
+                del self._waiters[my_batch]
+                errors = self._errors.pop(my_batch, {})
+
+        error = errors.get(filepath)
+        if error is not None:
+            raise error
+
+    def last_version(self, filepath):
+        """Метка версии, которую получил файл после нашей последней записи"""
+        return self._versions.get(Path(filepath))
+
+    def _flush_as_leader(self):
+        """Сброс пачки; вызывается с захваченной блокировкой"""
+        self._flushing = True
+
+        if self.window > 0:
+            self._cond.release()
+            try:
+                time.sleep(self.window)
+            finally:
+                self._cond.acquire()
+
+        batch, self._pending = self._pending, {}
+        batch_no = self._batch
+        self._batch += 1
+        self._cond.release()
+
+        errors = {}
+        try:
+            for filepath, (data, mutators, loader, dump_kwargs) in batch.items():
+                try:
+                    if data is _LOAD:
+                        data = loader()
+                    for mutator in mutators:
+                        result = mutator(data)
+                        if result is not None:
+                            data = result
+                    stamp = atomic_write_json(filepath, data, **dump_kwargs)
+                    self._versions[filepath] = file_version(filepath)
+                    if self._on_flush is not None:
+                        self._on_flush(filepath, data, stamp)
+                except Exception as e:
+                    errors[filepath] = e
+        finally:
+            self._cond.acquire()
+            if errors:
+                self._errors[batch_no] = errors
+            self._flushed = batch_no + 1
+            self._flushing = False
+            self._cond.notify_all()
+
 
 class DatabaseManager:
     _instance = None
@@ -8,11 +209,24 @@ class DatabaseManager:
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
+            cls._instance._writer = GroupCommitWriter(
+                settings.get("GROUP_COMMIT_WINDOW", 0.0),
+                on_flush=cls._remember_written)
         return cls._instance
     
     def read_json(self, filename: str):
         """Чтение JSON файла с обработкой ошибок"""
-        filepath = Path("data") / filename
+        with span("db.read_json", file=filename):
+            return self._read_json(filename)
+    
+    def _read_json(self, filename: str, strict: bool = False):
+        """Содержимое файла данных.
+
+        strict=True - для чтения перед записью: некорректный JSON
+        вызывает ValueError, а не подменяется пустым значением, которое
+        затем затёрло бы файл.
+        """
+        filepath = settings.data_dir() / filename
         
         # Если файла нет, возвращаем значение по умолчанию
         if not filepath.exists():
@@ -20,22 +234,74 @@ class DatabaseManager:
         
         try:
             with open(filepath, 'r', encoding='utf-8') as f:
+                # Метка снимается с открытого файла: она точно описывает
+                # прочитанное содержимое, даже если файл тут же заменят
+                stamp = content_stamp(os.fstat(f.fileno()))
+                cached = warm_start.load(filename, stamp)
+                if cached is not MISS:
+                    return cached
+                
                 content = f.read().strip()
                 if not content:  # Если файл пустой
                     return [] if filename.endswith(".json") else {}
-                return json.loads(content)
-        except (json.JSONDecodeError, ValueError):
+                data = json.loads(content)
+                warm_start.note(filename, stamp)
+                return data
+        except (json.JSONDecodeError, ValueError) as e:
+            if strict:
+                raise ValueError(f"Файл {filename} повреждён, изменение "
+                                 f"не записано: {e}") from e
             # Если JSON некорректен, возвращаем значение по умолчанию
             print(f"Внимание: Ошибка чтения {filename}. Файл будет перезаписан.")
             return [] if filename.endswith(".json") else {}
     
+    def find_record(self, filename: str, field: str, value):
+        """Запись JSON-списка с record[field] == value или None.
+
+        При актуальном снимке быстрого старта распаковывается только
+        нужная запись, иначе файл читается целиком.
+        """
+        filepath = settings.data_dir() / filename
+        with span("db.find_record", file=filename):
+            try:
+                stamp = content_stamp(os.stat(filepath))
+            except OSError:
+                return None
+            record = warm_start.find(filename, stamp, field, value)
+            if record is not MISS:
+                return record
+            for record in self._read_json(filename):
+                if record.get(field) == value:
+                    return record
+            return None
+    
+    @staticmethod
+    def _remember_written(filepath: Path, data, stamp):
+        """Записанный файл попадёт в следующий снимок быстрого старта"""
+        warm_start.note(filepath.name, stamp)
+    
     def write_json(self, filename: str, data):
-        """Запись в JSON файл"""
-        filepath = Path("data") / filename
-        filepath.parent.mkdir(exist_ok=True)
-        
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, default=str, ensure_ascii=False)
+        """Атомарная запись в JSON файл через групповую фиксацию"""
+        filepath = settings.data_dir() / filename
+        with span("db.write_json", file=filename):
+            self._writer.write(filepath, data, ensure_ascii=False)
+    
+    def update_json(self, filename: str, mutator):
+        """Изменение JSON файла на месте: mutator(данные) применяется к
+        свежему содержимому при групповой фиксации"""
+        filepath = settings.data_dir() / filename
+        with span("db.update_json", file=filename):
+            self._writer.update(filepath, mutator,
+                                lambda: self._read_json(filename, strict=True),
+                                ensure_ascii=False)
+    
+    def get_version(self, filename: str):
+        """Текущая метка версии файла (без чтения содержимого)"""
+        return file_version(settings.data_dir() / filename)
+    
+    def last_write_version(self, filename: str):
+        """Метка версии файла сразу после последней записи этим процессом"""
+        return self._writer.last_version(settings.data_dir() / filename)
 
 # Глобальный экземпляр
 db = DatabaseManager()
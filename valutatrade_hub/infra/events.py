@@ -0,0 +1,129 @@
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional
+
+from .settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Темы событий
+TOPIC_RATES = "rates"
+TOPIC_PORTFOLIO = "portfolio"
+
+_SUPPORTED = hasattr(socket, "AF_UNIX")
+_MAX_EVENT_SIZE = 1 << 20
+
+
+def _events_dir() -> Path:
+    return settings.data_dir() / "events"
+
+
+def publish(topic: str, data: Dict) -> int:
+    """Разослать событие всем подписчикам.
+
+    Брокера нет: каждый подписчик держит свой Unix-сокет (датаграммы)
+    в каталоге events, издатель отправляет событие в каждый из них,
+    не блокируясь. Сокеты завершившихся процессов удаляются.
+    Возвращает число доставленных копий.
+    """
+    directory = _events_dir()
+    if not _SUPPORTED or not directory.is_dir():
+        return 0
+
+    message = json.dumps({
+        "topic": topic,
+        "timestamp": time.time(),
+        "data": data,
+    }, ensure_ascii=False, default=str).encode("utf-8")
+
+    delivered = 0
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    try:
+        for entry in os.scandir(directory):
+            if not entry.name.endswith(".sock"):
+                continue
+            try:
+                sock.sendto(message, entry.path)
+                delivered += 1
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Подписчик умер, не закрыв сокет
+                try:
+                    os.unlink(entry.path)
+                except OSError:
+                    pass
+            except (BlockingIOError, OSError) as e:
+                # Очередь подписчика переполнена: событие для него теряется
+                logger.debug(f"Событие {topic} не доставлено {entry.name}: {e}")
+    finally:
+        sock.close()
+    return delivered
+
+
+class EventSubscriber:
+    """Клиент подписки на события изменений.
+
+    Пример:
+        with EventSubscriber([TOPIC_RATES]) as subscriber:
+            for event in subscriber:
+                invalidate(event["data"]["changed"])
+    """
+
+    def __init__(self, topics: Optional[Iterable[str]] = None):
+        if not _SUPPORTED:
+            raise RuntimeError("Unix-сокеты не поддерживаются на этой платформе")
+        self.topics = set(topics) if topics else None
+
+        directory = _events_dir()
+        directory.mkdir(parents=True, exist_ok=True)
+        self.path = directory / f"sub-{os.getpid()}-{uuid.uuid4().hex[:8]}.sock"
+
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.bind(str(self.path))
+
+    def receive(self, timeout: Optional[float] = None) -> Optional[Dict]:
+        """Следующее событие нужной темы или None по таймауту"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._sock.settimeout(remaining)
+            else:
+                self._sock.settimeout(None)
+
+            try:
+                payload = self._sock.recv(_MAX_EVENT_SIZE)
+            except socket.timeout:
+                return None
+
+            event = json.loads(payload.decode("utf-8"))
+            if self.topics is None or event["topic"] in self.topics:
+                return event
+
+    def __iter__(self) -> Iterator[Dict]:
+        while True:
+            yield self.receive()
+
+    def fileno(self) -> int:
+        """Дескриптор для select/selectors"""
+        return self._sock.fileno()
+
+    def close(self):
+        self._sock.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
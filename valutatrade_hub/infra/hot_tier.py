@@ -0,0 +1,150 @@
+import atexit
+import logging
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import Dict, Iterator, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Временные файлы записи, блокировки и сокеты событий в надёжный каталог
+# не переносятся
+_SKIP_SUFFIXES = (".tmp", ".lock", ".inflight", ".sock")
+
+
+def _stamp(st: os.stat_result) -> Tuple[int, int]:
+    return (st.st_mtime_ns, st.st_size)
+
+
+class HotTier:
+    """Горячий уровень хранения: быстрый каталог (например, tmpfs),
+    изменения которого переносятся в надёжный каталог асинхронно.
+
+    При запуске в горячий каталог копируются файлы надёжного, которых в
+    нём нет или которые в нём старше (по времени изменения); оставшиеся
+    от прошлого запуска более новые горячие файлы сохраняются. Фоновый
+    поток раз в interval секунд копирует в надёжный каталог изменившиеся
+    файлы (копия во временный файл, fsync, атомарная замена) и удаляет
+    там файлы, удалённые из горячего, - только те, что сам туда переносил.
+    Последний перенос выполняется при выходе из процесса; при сбое
+    теряются изменения не более чем за interval. Файл, дописываемый во
+    время переноса, может попасть в копию с неполным хвостом - следующий
+    перенос его заменит.
+    """
+
+    def __init__(self, hot_dir, durable_dir, interval: float = 5.0):
+        self.hot_dir = Path(hot_dir)
+        self.durable_dir = Path(durable_dir)
+        self.interval = interval
+        self._synced: Dict[Path, Tuple[int, int]] = {}  # путь -> метка при переносе
+        # Файлы, которые этот процесс записал в надёжный каталог: удаление
+        # переносится только для них
+        self._written: Set[Path] = set()
+        self._stop = threading.Event()
+        self._sync_lock = threading.Lock()
+        self._thread = None
+
+    @staticmethod
+    def _files(root: Path) -> Iterator[Path]:
+        """Относительные пути обычных файлов каталога (без временных и
+        блокировок)"""
+        for directory, _, filenames in os.walk(root):
+            for filename in filenames:
+                path = Path(directory) / filename
+                if filename.endswith(_SKIP_SUFFIXES) or not path.is_file():
+                    continue
+                yield path.relative_to(root)
+
+    @staticmethod
+    def _copy(source: Path, target: Path):
+        """Атомарное копирование с сохранением времени изменения"""
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+        try:
+            shutil.copyfile(source, tmp_path)
+            shutil.copystat(source, tmp_path)
+            with open(tmp_path, 'rb') as f:
+                os.fsync(f.fileno())
+            os.replace(tmp_path, target)
+        except BaseException:
+            if tmp_path.exists():
+                tmp_path.unlink()
+            raise
+
+    def seed(self) -> int:
+        """Наполнить горячий каталог из надёжного; возвращает число файлов"""
+        self.hot_dir.mkdir(parents=True, exist_ok=True)
+        copied = 0
+        if self.durable_dir.exists():
+            for relative in self._files(self.durable_dir):
+                hot_path = self.hot_dir / relative
+                durable_path = self.durable_dir / relative
+                try:
+                    if hot_path.stat().st_mtime_ns >= durable_path.stat().st_mtime_ns:
+                        continue  # горячая копия не старше надёжной
+                except FileNotFoundError:
+                    pass
+                self._copy(durable_path, hot_path)
+                copied += 1
+        # Совпадающие с надёжным каталогом файлы переносить не нужно
+        for relative in self._files(self.hot_dir):
+            try:
+                hot_stamp = _stamp(os.stat(self.hot_dir / relative))
+                if hot_stamp == _stamp(os.stat(self.durable_dir / relative)):
+                    self._synced[relative] = hot_stamp
+            except FileNotFoundError:
+                continue
+        return copied
+
+    def sync(self) -> int:
+        """Перенести изменения в надёжный каталог; возвращает число файлов"""
+        with self._sync_lock:
+            moved = 0
+            present = set()
+            for relative in self._files(self.hot_dir):
+                present.add(relative)
+                try:
+                    stamp = _stamp(os.stat(self.hot_dir / relative))
+                    if self._synced.get(relative) == stamp:
+                        continue
+                    self._copy(self.hot_dir / relative, self.durable_dir / relative)
+                except FileNotFoundError:
+                    continue  # файл заменили или удалили во время обхода
+                self._synced[relative] = stamp
+                self._written.add(relative)
+                moved += 1
+            for relative in set(self._synced) - present:
+                del self._synced[relative]
+                if relative not in self._written:
+                    continue
+                self._written.discard(relative)
+                try:
+                    (self.durable_dir / relative).unlink()
+                except FileNotFoundError:
+                    pass
+                moved += 1
+            return moved
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sync()
+            except OSError as e:
+                logger.warning(f"Не удалось сохранить горячий уровень: {e}")
+
+    def start(self):
+        copied = self.seed()
+        logger.info(f"Горячий уровень {self.hot_dir}: скопировано {copied} файлов "
+                    f"из {self.durable_dir}")
+        self._thread = threading.Thread(target=self._run, name="hot-tier-sync",
+                                        daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Остановить фоновый перенос и перенести последние изменения"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.sync()
@@ -0,0 +1,64 @@
+import functools
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Hashable
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировки действуют только внутри процесса
+    fcntl = None
+
+DEFAULT_STRIPES = 64
+
+_local_locks: Dict[str, threading.Lock] = {}
+_local_locks_guard = threading.Lock()
+
+
+class StripedLock:
+    """Таблица блокировок, разделённая на полосы по ключу.
+
+    Операции с одним ключом (пользователем) выполняются по очереди,
+    с разными ключами - параллельно, пока ключи не попали в одну
+    полосу. Память не растёт с числом ключей. Блокировки реентерабельны:
+    операция может вызвать другую операцию того же ключа.
+    """
+
+    def __init__(self, stripes: int = DEFAULT_STRIPES):
+        self._locks = [threading.RLock() for _ in range(stripes)]
+
+    def lock_for(self, key: Hashable) -> threading.RLock:
+        return self._locks[hash(key) % len(self._locks)]
+
+    def serialized(self, func: Callable) -> Callable:
+        """Декоратор: выполнять func под блокировкой первого аргумента"""
+
+        @functools.wraps(func)
+        def wrapper(key, *args, **kwargs):
+            with self.lock_for(key):
+                return func(key, *args, **kwargs)
+
+        return wrapper
+
+
+@contextmanager
+def file_lock(path: Path):
+    """Исключительная блокировка файла, общая для процессов (flock).
+
+    Без fcntl блокировка действует только между потоками процесса.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if fcntl is None:
+        with _local_locks_guard:
+            lock = _local_locks.setdefault(str(path), threading.Lock())
+        with lock:
+            yield
+        return
+
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)  # закрытие снимает блокировку
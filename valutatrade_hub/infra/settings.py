@@ -1,3 +1,31 @@
+import os
+import threading
+import tomllib
+from pathlib import Path
+
+from .hot_tier import HotTier
+
+# Файл настроек, который ищется в текущем каталоге, если
+# VALUTATRADE_CONFIG не задана
+CONFIG_FILE = "valutatrade.toml"
+# Любую настройку можно переопределить переменной VALUTATRADE_<ИМЯ>
+ENV_PREFIX = "VALUTATRADE_"
+# Настройки-пути: относительные пути из файла настроек отсчитываются от
+# каталога файла, остальные - от текущего каталога при запуске
+_PATH_KEYS = ("DATA_DIR", "HOT_DIR", "LOG_FILE")
+
+
+def _parse_env(value: str, default):
+    """Значение переменной окружения в типе значения по умолчанию"""
+    if isinstance(default, bool):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    if isinstance(default, int):
+        return int(value)
+    if isinstance(default, float):
+        return float(value)
+    return value or None
+
+
 class SettingsLoader:
     _instance = None
     
@@ -8,11 +36,89 @@ class SettingsLoader:
         return cls._instance
     
     def _load_settings(self):
-        """Загрузка настроек"""
+        """Загрузка настроек: значения по умолчанию, файл настроек
+        (TOML), переменные окружения - каждый следующий источник
+        переопределяет предыдущий"""
         self.DATA_DIR = "data"
         self.RATES_TTL = 300  # 5 минут
         self.DEFAULT_BASE_CURRENCY = "USD"
         self.API_TIMEOUT = 10
+        # Окно групповой фиксации записей (секунды)
+        self.GROUP_COMMIT_WINDOW = 0.002
+        # Двоичный снимок разобранных данных для быстрого старта
+        self.WARM_START = True
+        # Горячий уровень (например, tmpfs): чтение и запись идут в нём,
+        # а в DATA_DIR изменения переносятся в фоне раз в HOT_SYNC_INTERVAL
+        self.HOT_DIR = None
+        self.HOT_SYNC_INTERVAL = 5.0
+        self.LOG_FILE = "valutatrade.log"
+        # Сегмент разделяемой памяти с курсами; у изолированных экземпляров
+        # должен быть свой
+        self.SHARED_RATES_SEGMENT = "valutatrade_rates"
+        # Имена пользователей через запятую, которым доступны сводки по
+        # чужим портфелям (holdings, top)
+        self.ADMIN_USERS = ""
+        
+        self._hot_tier = None
+        self._hot_tier_lock = threading.Lock()
+        
+        config_file = os.getenv(f"{ENV_PREFIX}CONFIG")
+        if config_file:
+            self._load_file(Path(config_file))
+        elif Path(CONFIG_FILE).exists():
+            self._load_file(Path(CONFIG_FILE))
+        self._load_env()
+        
+        # Пути фиксируются при загрузке и не зависят от смены каталога
+        for key in _PATH_KEYS:
+            value = getattr(self, key)
+            if value:
+                setattr(self, key, str(Path(value).expanduser().absolute()))
+    
+    def _known_keys(self):
+        return [key for key in vars(self) if key.isupper()]
+    
+    def _load_file(self, path: Path):
+        """Настройки из TOML-файла: ключи - имена настроек в любом регистре"""
+        with open(path, 'rb') as f:
+            values = tomllib.load(f)
+        known = self._known_keys()
+        for key, value in values.items():
+            name = key.upper()
+            if name not in known:
+                raise ValueError(f"Неизвестная настройка '{key}' в {path}")
+            if name in _PATH_KEYS and value:
+                value = str(path.parent / Path(value).expanduser())
+            setattr(self, name, value)
+    
+    def _load_env(self):
+        for key in self._known_keys():
+            value = os.getenv(f"{ENV_PREFIX}{key}")
+            if value is not None:
+                setattr(self, key, _parse_env(value, getattr(self, key)))
+    
+    def data_dir(self) -> Path:
+        """Каталог, в котором читаются и пишутся данные.
+
+        При заданном HOT_DIR это горячий уровень: при первом обращении он
+        наполняется из DATA_DIR и запускается фоновое сохранение.
+        """
+        if not self.HOT_DIR:
+            return Path(self.DATA_DIR)
+        with self._hot_tier_lock:
+            if self._hot_tier is None:
+                self._hot_tier = HotTier(self.HOT_DIR, self.DATA_DIR,
+                                         self.HOT_SYNC_INTERVAL)
+                self._hot_tier.start()
+        return Path(self.HOT_DIR)
+    
+    def admin_users(self) -> set:
+        """Имена администраторов (ADMIN_USERS - строка через запятую или
+        список в файле настроек)"""
+        names = self.ADMIN_USERS or []
+        if isinstance(names, str):
+            names = names.split(",")
+        return {name.strip() for name in names if name.strip()}
     
     def get(self, key, default=None):
         """Получение настройки"""
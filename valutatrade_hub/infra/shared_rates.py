@@ -0,0 +1,176 @@
+import struct
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, Optional, Tuple
+
+# Имя сегмента разделяемой памяти по умолчанию
+SEGMENT_NAME = "valutatrade_rates"
+
+# Заголовок: сигнатура, версия формата, счётчик seqlock, ёмкость, число пар
+_HEADER = struct.Struct("<4sIQII")
+# Слот пары: имя (до 16 байт ASCII), курс, время обновления (epoch)
+_SLOT = struct.Struct("<16sdd")
+_MAGIC = b"VTRT"
+_FORMAT_VERSION = 1
+_SEQ_OFFSET = 8  # смещение счётчика внутри заголовка
+
+DEFAULT_CAPACITY = 4096
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """Подключение к существующему сегменту без его удаления при выходе.
+
+    До Python 3.13 resource_tracker считает сегмент своим у каждого
+    подключившегося процесса и удаляет его при выходе любого из них.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    segment = shared_memory.SharedMemory(name=name)
+    resource_tracker.unregister(segment._name, "shared_memory")
+    return segment
+
+
+class SharedRateTable:
+    """Таблица курсов в multiprocessing.shared_memory.
+
+    Двоичный формат фиксирован: заголовок и массив слотов. Писатель
+    (RatesUpdater) один; читателей сколько угодно. Согласованность
+    обеспечивает seqlock: писатель делает счётчик нечётным на время
+    записи и чётным после, читатель повторяет чтение, если счётчик
+    был нечётным или изменился. JSON-файл остаётся надёжной копией.
+    """
+
+    def __init__(self, segment: shared_memory.SharedMemory):
+        self._segment = segment
+        self._buf = segment.buf
+
+    @classmethod
+    def create(cls, name: str = SEGMENT_NAME,
+               capacity: int = DEFAULT_CAPACITY) -> "SharedRateTable":
+        """Создать сегмент (или подключиться к уже созданному) для записи"""
+        size = _HEADER.size + capacity * _SLOT.size
+        try:
+            segment = shared_memory.SharedMemory(name=name, create=True, size=size)
+            # Сегмент переживает процесс-создателя: удаляется через unlink()
+            if sys.version_info < (3, 13):
+                resource_tracker.unregister(segment._name, "shared_memory")
+            _HEADER.pack_into(segment.buf, 0, _MAGIC, _FORMAT_VERSION, 0,
+                              capacity, 0)
+        except FileExistsError:
+            segment = _attach(name)
+        table = cls(segment)
+        table._check_header()
+        return table
+
+    @classmethod
+    def attach(cls, name: str = SEGMENT_NAME) -> Optional["SharedRateTable"]:
+        """Подключиться для чтения; None, если таблица ещё не опубликована"""
+        try:
+            table = cls(_attach(name))
+        except FileNotFoundError:
+            return None
+        table._check_header()
+        return table
+
+    def _check_header(self) -> Tuple[int, int]:
+        magic, version, _, capacity, _ = _HEADER.unpack_from(self._buf, 0)
+        if magic != _MAGIC or version != _FORMAT_VERSION:
+            raise ValueError("Неизвестный формат таблицы курсов")
+        return capacity, version
+
+    @property
+    def capacity(self) -> int:
+        return _HEADER.unpack_from(self._buf, 0)[3]
+
+    def _sequence(self) -> int:
+        return struct.unpack_from("<Q", self._buf, _SEQ_OFFSET)[0]
+
+    def _set_sequence(self, value: int):
+        struct.pack_into("<Q", self._buf, _SEQ_OFFSET, value)
+
+    def publish(self, pairs: Dict[str, Dict]):
+        """Записать полный снимок курсов (вызывает единственный писатель)"""
+        capacity = self.capacity
+        # Имена длиннее слота в таблицу не попадают: их читают из JSON
+        items = sorted(
+            (pair, info) for pair, info in pairs.items()
+            if len(pair.encode("ascii")) <= 16
+        )
+        if len(items) > capacity:
+            raise ValueError(
+                f"Таблица рассчитана на {capacity} пар, получено {len(items)}")
+
+        sequence = self._sequence()
+        self._set_sequence(sequence + 1)  # нечётный: идёт запись
+        try:
+            for index, (pair, info) in enumerate(items):
+                updated_at = info.get("updated_at")
+                _SLOT.pack_into(
+                    self._buf, _HEADER.size + index * _SLOT.size,
+                    pair.encode("ascii"), float(info["rate"]),
+                    updated_at if isinstance(updated_at, (int, float)) else 0.0)
+            struct.pack_into("<I", self._buf, _HEADER.size - 4, len(items))
+        finally:
+            self._set_sequence(sequence + 2)  # чётный: снимок согласован
+
+    def _read_consistent(self, reader):
+        while True:
+            before = self._sequence()
+            if before % 2:
+                time.sleep(0)
+                continue
+            result = reader()
+            if self._sequence() == before:
+                return result, before // 2
+
+    def snapshot(self) -> Tuple[Dict[str, Tuple[float, float]], int]:
+        """Согласованная копия всей таблицы: ({пара: (курс, время)}, версия)"""
+        def read():
+            count = _HEADER.unpack_from(self._buf, 0)[4]
+            table = {}
+            for name, rate, updated_at in _SLOT.iter_unpack(
+                    self._buf[_HEADER.size:_HEADER.size + count * _SLOT.size]):
+                table[name.rstrip(b"\0").decode("ascii")] = (rate, updated_at)
+            return table
+        return self._read_consistent(read)
+
+    def get(self, pair: str) -> Optional[Tuple[float, float]]:
+        """Курс и время обновления одной пары без копирования таблицы"""
+        key = pair.encode("ascii").ljust(16, b"\0")
+        if len(key) > 16:
+            return None
+
+        def read():
+            count = _HEADER.unpack_from(self._buf, 0)[4]
+            # Слоты отсортированы по имени пары: бинарный поиск
+            lo, hi = 0, count
+            while lo < hi:
+                mid = (lo + hi) // 2
+                offset = _HEADER.size + mid * _SLOT.size
+                name = bytes(self._buf[offset:offset + 16])
+                if name < key:
+                    lo = mid + 1
+                elif name > key:
+                    hi = mid
+                else:
+                    _, rate, updated_at = _SLOT.unpack_from(self._buf, offset)
+                    return rate, updated_at
+            return None
+        return self._read_consistent(read)[0]
+
+    @property
+    def version(self) -> int:
+        """Номер снимка: растёт на 1 при каждой публикации"""
+        return self._sequence() // 2
+
+    def close(self):
+        self._buf = None
+        self._segment.close()
+
+    def unlink(self):
+        """Удалить сегмент из системы (выполняет владелец)"""
+        if sys.version_info < (3, 13):
+            # unlink() снимает регистрацию, которую мы уже сняли сами
+            resource_tracker.register(self._segment._name, "shared_memory")
+        self._segment.unlink()
@@ -0,0 +1,308 @@
+import atexit
+import bisect
+import json
+import logging
+import mmap
+import os
+import pickle
+import stat
+import struct
+import threading
+import zlib
+from array import array
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from .settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Заголовок: сигнатура, версия формата, crc32 тела, длина каталога секций
+_HEADER = struct.Struct("<4sIIQ")
+_MAGIC = b"VTWS"
+_FORMAT_VERSION = 1
+
+# Поля, по которым индексируются записи файлов-списков
+INDEX_FIELDS = ("user_id", "username")
+# Файлы, которые попадают в снимок: большие и редко меняющиеся. Часто
+# переписываемые (rates.json и т.п.) читаются из JSON
+SNAPSHOT_FILES = ("users.json", "portfolios.json")
+
+# Отличает «в снимке нет ответа» от «записи нет»
+MISS = object()
+
+
+def content_stamp(st: os.stat_result) -> Tuple[int, int, int]:
+    """Метка содержимого файла: (inode, mtime, размер).
+
+    Файлы данных меняются только атомарной заменой, поэтому содержимое
+    inode после публикации не меняется. ctime не входит в метку:
+    переименование меняет его, не меняя содержимого.
+    """
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def _untrusted_reason(st: os.stat_result) -> Optional[str]:
+    """Почему файл или каталог нельзя считать своим (None - можно).
+
+    Снимок распаковывается через pickle, поэтому он должен принадлежать
+    текущему пользователю и не быть доступным на запись другим: иначе,
+    например в общем /dev/shm, можно загрузить чужой снимок.
+    """
+    if hasattr(os, "getuid") and st.st_uid != os.getuid():
+        return "принадлежит другому пользователю"
+    if st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        return "доступен на запись группе или другим"
+    return None
+
+
+def _build_index(data: List[Dict], field: str):
+    """Индекс по полю: (отсортированные значения, номера записей) или None"""
+    if not data or not all(field in item for item in data):
+        return None
+    try:
+        order = sorted(range(len(data)), key=lambda i: data[i][field])
+    except TypeError:
+        return None  # значения разных типов не сравниваются
+    return [data[i][field] for i in order], array("I", order)
+
+
+def _build_section(data: Any) -> Dict:
+    """Секция снимка: записи списка сериализуются по отдельности,
+    чтобы одну запись можно было достать по индексу без разбора всех"""
+    if isinstance(data, list) and all(isinstance(item, dict) for item in data):
+        records = [pickle.dumps(item, pickle.HIGHEST_PROTOCOL) for item in data]
+        index = {}
+        for field in INDEX_FIELDS:
+            built = _build_index(data, field)
+            if built is not None:
+                index[field] = built
+        return {"kind": "list", "records": records, "index": index}
+    record = pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+    return {"kind": "object", "records": [record], "index": {}}
+
+
+class WarmStartSnapshot:
+    """Двоичный снимок разобранных JSON-файлов для быстрого старта.
+
+    Снимок лежит рядом с JSON-файлами и читается, только если он и его
+    каталог принадлежат текущему пользователю и закрыты от записи другим
+    (crc32 защищает от повреждения, а не от подмены): заголовок с crc32, каталог секций
+    (метка содержимого исходного файла, границы записей и индексы по
+    user_id и username в виде компактных массивов - каталог разбирается
+    за миллисекунды) и сами секции в pickle. Файл открывается через
+    mmap, записи распаковываются по требованию. Секция используется,
+    только если метка совпадает с текущим файлом, иначе файл читается
+    из JSON. Запись и чтение файла этим процессом только отмечают
+    метку (note), а секции устаревших файлов собираются при выходе из
+    процесса (save) - из файла, если его метка не изменилась, - поэтому
+    сделки не платят за пересборку индексов.
+
+    Путь и настройка WARM_START определяются при первом обращении, а не
+    при импорте: settings.data_dir() может запустить горячий уровень.
+    """
+
+    def __init__(self, path=None, enabled: Optional[bool] = None):
+        self._path = Path(path) if path else None
+        self._enabled = enabled
+        self._lock = threading.Lock()
+        self._opened = False
+        self._map = None
+        self._directory = {}
+        self._data_start = 0
+        self._fresh = {}   # имя файла -> метка содержимого новее снимка на диске
+        atexit.register(self.save)
+
+    @property
+    def path(self) -> Path:
+        if self._path is None:
+            self._path = settings.data_dir() / "warm_start.bin"
+        return self._path
+
+    @property
+    def enabled(self) -> bool:
+        if self._enabled is None:
+            self._enabled = bool(settings.get("WARM_START", True))
+        return self._enabled
+
+    def _open(self):
+        """Подключение снимка с проверкой формата и контрольной суммы"""
+        self._opened = True
+        try:
+            with open(self.path, 'rb') as f:
+                # Файл проверяется по открытому дескриптору, каталог - чтобы
+                # файл в нём не могли подменить
+                for what, st in (("файл", os.fstat(f.fileno())),
+                                 ("каталог", os.stat(self.path.parent))):
+                    reason = _untrusted_reason(st)
+                    if reason is not None:
+                        logger.warning(f"Снимок {self.path} не используется: "
+                                       f"{what} {reason}")
+                        return
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return  # снимка нет или он пуст
+
+        try:
+            magic, version, crc, directory_length = _HEADER.unpack_from(mapped, 0)
+            if magic != _MAGIC or version != _FORMAT_VERSION:
+                raise ValueError("неизвестный формат")
+            body = memoryview(mapped)[_HEADER.size:]
+            try:
+                if zlib.crc32(body) != crc:
+                    raise ValueError("контрольная сумма не совпадает")
+                directory = pickle.loads(body[:directory_length])
+            finally:
+                body.release()
+        except (ValueError, struct.error, pickle.UnpicklingError, EOFError) as e:
+            logger.warning(f"Снимок {self.path} повреждён ({e}), чтение из JSON")
+            mapped.close()
+            return
+        self._map = mapped
+        self._directory = directory
+        self._data_start = _HEADER.size + directory_length
+
+    def _section(self, filename: str, stamp) -> Optional[Tuple[Dict, Any]]:
+        """(секция, буфер записей) для файла с данной меткой или None"""
+        if filename not in SNAPSHOT_FILES or not self.enabled:
+            return None
+        with self._lock:
+            if not self._opened:
+                self._open()
+            if filename in self._fresh:
+                return None  # секция на диске устарела
+            entry = self._directory.get(filename)
+            if entry is None or entry["stamp"] != stamp:
+                return None
+            return entry, self._map
+
+    def _record(self, section: Dict, buffer, i: int) -> Any:
+        bounds = section["bounds"]
+        start = self._data_start
+        return pickle.loads(buffer[start + bounds[i]:start + bounds[i + 1]])
+
+    @staticmethod
+    def _count(section: Dict, buffer) -> int:
+        return len(section["bounds"]) - 1
+
+    def load(self, filename: str, stamp) -> Any:
+        """Содержимое файла из снимка или MISS"""
+        found = self._section(filename, stamp)
+        if found is None:
+            return MISS
+        section, buffer = found
+        records = [
+            self._record(section, buffer, i)
+            for i in range(self._count(section, buffer))
+        ]
+        return records if section["kind"] == "list" else records[0]
+
+    def find(self, filename: str, stamp, field: str, value) -> Any:
+        """Запись файла-списка с record[field] == value, None или MISS"""
+        found = self._section(filename, stamp)
+        if found is None:
+            return MISS
+        section, buffer = found
+        index = section["index"].get(field)
+        if index is None:
+            return MISS
+        keys, positions = index
+        try:
+            i = bisect.bisect_left(keys, value)
+        except TypeError:
+            return MISS
+        if i == len(keys) or keys[i] != value:
+            return None
+        return self._record(section, buffer, positions[i])
+
+    def note(self, filename: str, stamp):
+        """Отметить, что файл прочитан или записан с данной меткой: его
+        секция будет собрана при следующем сохранении снимка"""
+        if filename not in SNAPSHOT_FILES or not self.enabled:
+            return
+        with self._lock:
+            self._fresh[filename] = stamp
+
+    def _build_fresh(self, filename: str, stamp) -> Optional[Dict]:
+        """Секция из файла, если его содержимое всё ещё имеет метку stamp"""
+        try:
+            with open(self.path.parent / filename, 'r', encoding='utf-8') as f:
+                if content_stamp(os.fstat(f.fileno())) != stamp:
+                    return None  # файл изменили после отметки
+                return _build_section(json.load(f))
+        except (OSError, ValueError):
+            return None
+
+    def save(self):
+        """Записать снимок, если есть секции новее сохранённых"""
+        if not self._fresh:
+            return
+        with self._lock:
+            if not self._fresh:
+                return
+            sections = []
+            for filename, entry in self._directory.items():
+                if filename not in self._fresh:
+                    start, bounds = self._data_start, entry["bounds"]
+                    records = [
+                        bytes(self._map[start + bounds[i]:start + bounds[i + 1]])
+                        for i in range(len(bounds) - 1)
+                    ]
+                    sections.append((filename, entry["stamp"],
+                                     {**entry, "records": records}))
+            for filename, stamp in self._fresh.items():
+                section = self._build_fresh(filename, stamp)
+                if section is not None:
+                    sections.append((filename, stamp, section))
+            try:
+                self._write(sections)
+            except OSError as e:
+                logger.warning(f"Не удалось сохранить снимок {self.path}: {e}")
+                return
+            self._fresh = {}
+            # Снимок перечитывается при следующем обращении; старое
+            # отображение закроется, когда его отпустят читающие потоки
+            self._map = None
+            self._directory = {}
+            self._opened = False
+
+    def _write(self, sections):
+        # Смещения записей считаются от начала области данных за каталогом
+        directory = {}
+        data_offset = 0
+        for filename, stamp, section in sections:
+            bounds = array("Q", [data_offset])
+            for record in section["records"]:
+                data_offset += len(record)
+                bounds.append(data_offset)
+            directory[filename] = {"stamp": stamp, "kind": section["kind"],
+                                   "bounds": bounds, "index": section["index"]}
+        raw_directory = pickle.dumps(directory, pickle.HIGHEST_PROTOCOL)
+
+        crc = zlib.crc32(raw_directory)
+        for _, _, section in sections:
+            for record in section["records"]:
+                crc = zlib.crc32(record, crc)
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        try:
+            # Только для владельца: чужой снимок _open не примет
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(_HEADER.pack(_MAGIC, _FORMAT_VERSION, crc, len(raw_directory)))
+                f.write(raw_directory)
+                for _, _, section in sections:
+                    for record in section["records"]:
+                        f.write(record)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if tmp_path.exists():
+                tmp_path.unlink()
+            raise
+
+
+# Глобальный экземпляр
+warm_start = WarmStartSnapshot()
@@ -1,17 +1,24 @@
 import logging
+from pathlib import Path
 
+from .infra.settings import settings
 
-def setup_logging():
-    """Минимальная настройка логирования"""
+
+def setup_logging(console: bool = True):
+    """Минимальная настройка логирования.
+
+    Журнал пишется в settings.LOG_FILE; console=False - без вывода в
+    консоль (интерактивная оболочка: сообщения фоновых задач не должны
+    смешиваться с вводом пользователя).
+    """
+    Path(settings.LOG_FILE).parent.mkdir(parents=True, exist_ok=True)
+    handlers = [logging.FileHandler(settings.LOG_FILE, encoding="utf-8")]
+    if console:
+        handlers.append(logging.StreamHandler())
     logging.basicConfig(
         level=logging.INFO,
         format='%(asctime)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler('valutatrade.log'),
-            logging.StreamHandler()
-        ]
+        handlers=handlers
     )
 
-# Инициализируем сразу
-setup_logging()
-logger = logging.getLogger(__name__)
\ No newline at end of file
+logger = logging.getLogger(__name__)
@@ -1,21 +1,104 @@
+import functools
+import json
+import logging
+import math
+import random
+import time
 from abc import ABC, abstractmethod
-from datetime import datetime
+from pathlib import Path
 
 import requests
 
 from ..core.exceptions import ApiRequestError
+from ..core.utils import to_epoch
+from ..infra.settings import settings
+from ..tracing import SPAN_KIND_CLIENT, traced
 from . import config
+from .rate_limit import get_budget
+
+logger = logging.getLogger(__name__)
+
+
+def _within_budget(fetch_rates):
+    @functools.wraps(fetch_rates)
+    def wrapper(self):
+        budget = get_budget(self.provider_name) if self.provider_name else None
+        if budget is None:
+            return fetch_rates(self)
+        return budget.call(lambda: fetch_rates(self))
+    return wrapper
 
 
 class BaseApiClient(ABC):
     """Абстрактный базовый класс для API клиентов"""
     
+    # Имя в реестре провайдеров (задаёт register_provider)
+    provider_name = None
+    
+    def __init_subclass__(cls, **kwargs):
+        """Каждая реализация fetch_rates выполняется внутри спана
+        и расходует общий бюджет запросов провайдера"""
+        super().__init_subclass__(**kwargs)
+        if "fetch_rates" in cls.__dict__:
+            cls.fetch_rates = traced(
+                f"{cls.__name__}.fetch_rates", SPAN_KIND_CLIENT)(
+                    _within_budget(cls.fetch_rates))
+    
     @abstractmethod
     def fetch_rates(self) -> dict:
         """Получение курсов валют"""
         pass
+    
+    def fetch_history(self, start: float, end: float, step: float) -> list:
+        """Исторические курсы за [start, end) с шагом около step секунд.
+
+        Возвращает записи истории {pair, recorded_at, rate, updated_at,
+        source}, упорядоченные по времени.
+        """
+        raise ApiRequestError(f"{self.name}: исторические курсы не поддерживаются")
+    
+    def _take_token(self):
+        """Дождаться жетона общего бюджета запросов перед обращением к API"""
+        budget = get_budget(self.provider_name) if self.provider_name else None
+        if budget is not None:
+            budget.bucket.acquire()
+
+
+# Реестр провайдеров курсов
+_provider_registry = {}
 
 
+def register_provider(name: str):
+    """Декоратор регистрации класса провайдера в реестре"""
+    def decorator(cls):
+        cls.provider_name = name
+        _provider_registry[name] = cls
+        return cls
+    return decorator
+
+
+def get_provider(name: str, **options) -> BaseApiClient:
+    """Фабричный метод: создать провайдера по имени из реестра"""
+    if name not in _provider_registry:
+        raise ApiRequestError(f"Неизвестный провайдер курсов '{name}'")
+    return _provider_registry[name](**options)
+
+
+def get_all_providers():
+    """Имена всех зарегистрированных провайдеров"""
+    return sorted(_provider_registry)
+
+
+def record_response(path, provider: str, rates: dict):
+    """Дописать ответ провайдера в файл записи для ReplayClient"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    line = json.dumps({"provider": provider, "rates": rates}, ensure_ascii=False)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(line + "\n")
+
+
+@register_provider("coingecko")
 class CoinGeckoClient(BaseApiClient):
     def __init__(self):
         self.name = "CoinGecko"
@@ -29,7 +112,7 @@ class CoinGeckoClient(BaseApiClient):
             data = response.json()
             
             rates = {}
-            timestamp = datetime.now().isoformat()
+            timestamp = time.time()
             
             for code, coin_id in config.CRYPTO_ID_MAP.items():
                 if coin_id in data and "usd" in data[coin_id]:
@@ -44,8 +127,38 @@ class CoinGeckoClient(BaseApiClient):
             
         except requests.exceptions.RequestException as e:
             raise ApiRequestError(f"Ошибка при обращении к CoinGecko API: {str(e)}")
+    
+    def fetch_history(self, start: float, end: float, step: float) -> list:
+        # Шаг точек CoinGecko выбирает сам по длине диапазона
+        entries = []
+        for code, coin_id in config.CRYPTO_ID_MAP.items():
+            self._take_token()
+            try:
+                url = config.COINGECKO_HISTORY_URL.format(coin_id=coin_id)
+                response = requests.get(url, params={
+                    "vs_currency": "usd", "from": int(start), "to": int(end)
+                }, timeout=config.REQUEST_TIMEOUT)
+                response.raise_for_status()
+                prices = response.json().get("prices", [])
+            except requests.exceptions.RequestException as e:
+                raise ApiRequestError(f"Ошибка при обращении к CoinGecko API: {str(e)}")
+            
+            pair_key = f"{code}_{config.BASE_CURRENCY}"
+            for timestamp_ms, price in prices:
+                timestamp = timestamp_ms / 1000.0
+                if start <= timestamp < end:
+                    entries.append({
+                        "pair": pair_key,
+                        "recorded_at": timestamp,
+                        "rate": float(price),
+                        "updated_at": timestamp,
+                        "source": self.name
+                    })
+        entries.sort(key=lambda entry: entry["recorded_at"])
+        return entries
 
 
+@register_provider("exchangerate")
 class ExchangeRateApiClient(BaseApiClient):
     def __init__(self):
         self.name = "ExchangeRate-API"
@@ -55,32 +168,41 @@ class ExchangeRateApiClient(BaseApiClient):
             # Формируем URL
             url = f"{config.EXCHANGERATE_API_URL}/{config.BASE_CURRENCY}"
             
-            # Отладочная информация
-            print(f"DEBUG: Запрос к ExchangeRate-API: {url}")
+            # URL содержит ключ API, поэтому в журнал он не пишется
+            logger.debug(f"Запрос к ExchangeRate-API: {config.BASE_CURRENCY}")
             
             response = requests.get(url, timeout=config.REQUEST_TIMEOUT)
             
-            print(f"DEBUG: Статус код: {response.status_code}")
+            logger.debug(f"Статус код: {response.status_code}")
             
             response.raise_for_status()
             data = response.json()
             
-            print(f"DEBUG: Результат API: {data.get('result', 'unknown')}")
+            logger.debug(f"Результат API: {data.get('result', 'unknown')}")
             
             if data.get("result") != "success":
                 error_type = data.get("error-type", "unknown")
                 raise ApiRequestError(f"ExchangeRate-API вернуло ошибку: {error_type}")
             
             rates = {}
-            timestamp = data.get("time_last_update_utc", datetime.now().isoformat())
+            # Свежесть курса отсчитывается от получения, как у CoinGecko:
+            # провайдер публикует курсы раз в сутки, и время публикации
+            # почти всегда старше RATES_TTL. Оно хранится отдельно, в epoch
+            fetched_at = time.time()
+            if "time_last_update_unix" in data:
+                published_at = float(data["time_last_update_unix"])
+            elif "time_last_update_utc" in data:
+                published_at = to_epoch(data["time_last_update_utc"])
+            else:
+                published_at = fetched_at
             base = data.get("base_code", config.BASE_CURRENCY)
             
-            print(f"DEBUG: Базовая валюта: {base}")
-            print(f"DEBUG: Ключи в ответе: {list(data.keys())}")
+            logger.debug(f"Базовая валюта: {base}")
+            logger.debug(f"Ключи в ответе: {list(data.keys())}")
             
             # ВАЖНО: API возвращает курсы в поле "conversion_rates", а не "rates"!
             conversion_rates = data.get("conversion_rates", {})
-            print(f"DEBUG: Всего валют в conversion_rates: {len(conversion_rates)}")
+            logger.debug(f"Всего валют в conversion_rates: {len(conversion_rates)}")
             
             # Получаем курсы для нужных нам валют
             for currency in config.FIAT_CURRENCIES:
@@ -88,15 +210,153 @@ class ExchangeRateApiClient(BaseApiClient):
                     pair_key = f"{currency}_{base}"
                     rates[pair_key] = {
                         "rate": conversion_rates[currency],
-                        "updated_at": timestamp,
+                        "updated_at": fetched_at,
+                        "published_at": published_at,
                         "source": self.name
                     }
-                    print(
-                        f"DEBUG: Найден курс {pair_key} = {conversion_rates[currency]}")
+                    logger.debug(
+                        f"Найден курс {pair_key} = {conversion_rates[currency]}")
             
-            print(f"DEBUG: ExchangeRate-API вернул {len(rates)} курсов")
+            logger.debug(f"ExchangeRate-API вернул {len(rates)} курсов")
             return rates
             
         except requests.exceptions.RequestException as e:
-            print(f"DEBUG: Исключение при запросе: {str(e)}")
-            raise ApiRequestError(f"Ошибка при обращении к ExchangeRate-API: {str(e)}")
\ No newline at end of file
+            logger.debug(f"Исключение при запросе: {str(e)}")
+            raise ApiRequestError(f"Ошибка при обращении к ExchangeRate-API: {str(e)}")
+
+
+@register_provider("replay")
+class ReplayClient(BaseApiClient):
+    """Воспроизведение записанных ответов провайдеров без сети.
+
+    Файл - JSON lines {"provider": имя, "rates": ответ fetch_rates},
+    его пишет RatesUpdater при заданном config.RECORD_FILE.
+    Каждый вызов fetch_rates возвращает следующий ответ.
+    """
+    
+    def __init__(self, path: str = None, provider: str = None, loop: bool = True):
+        self.name = "Replay"
+        self.path = Path(path or config.RECORD_FILE
+                         or settings.data_dir() / "recorded_rates.jsonl")
+        self.provider = provider
+        self.loop = loop
+        self._responses = None
+        self._position = 0
+    
+    def _load(self):
+        if not self.path.exists():
+            raise ApiRequestError(f"Нет файла записанных ответов: {self.path}")
+        with open(self.path, 'r', encoding='utf-8') as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        self._responses = [
+            record["rates"] for record in records
+            if self.provider is None or record["provider"] == self.provider
+        ]
+    
+    def fetch_rates(self) -> dict:
+        if self._responses is None:
+            self._load()
+        if self._position >= len(self._responses):
+            if not self.loop or not self._responses:
+                raise ApiRequestError("Записанные ответы закончились")
+            self._position = 0
+        
+        rates = self._responses[self._position]
+        self._position += 1
+        # Время курса - момент воспроизведения, иначе курсы сразу устаревают
+        timestamp = time.time()
+        return {
+            pair: {**info, "updated_at": timestamp, "source": self.name}
+            for pair, info in rates.items()
+        }
+
+
+@register_provider("randomwalk")
+class RandomWalkClient(BaseApiClient):
+    """Синтетический провайдер: геометрическое случайное блуждание.
+
+    pairs - число синтетических пар (SYN0000_USD, ...) или список имён;
+    tick_rate - тиков в секунду: между вызовами fetch_rates цена делает
+    столько шагов, сколько тиков прошло (не меньше одного);
+    volatility и drift - годовые параметры, seed - для воспроизводимости.
+    """
+    
+    _SECONDS_PER_YEAR = 365 * 24 * 3600
+    
+    def __init__(self, pairs=100, tick_rate: float = 1.0,
+                 volatility: float = 0.8, drift: float = 0.0,
+                 start_price: float = 100.0, seed: int = None):
+        self.name = "RandomWalk"
+        if isinstance(pairs, int):
+            pairs = [f"SYN{i:04d}_USD" for i in range(pairs)]
+        self.tick_rate = float(tick_rate)
+        self.volatility = volatility
+        self.drift = drift
+        self.start_price = float(start_price)
+        self._seed = seed
+        self._waves = {}
+        self._random = random.Random(seed)
+        self._prices = {pair: float(start_price) for pair in pairs}
+        self._last_fetch = None
+    
+    def fetch_rates(self) -> dict:
+        now = time.time()
+        elapsed = 0.0 if self._last_fetch is None else now - self._last_fetch
+        self._last_fetch = now
+        
+        ticks = max(1, round(elapsed * self.tick_rate))
+        # Шаги блуждания складываются: один шаг длиной ticks тиков
+        dt = ticks / self.tick_rate / self._SECONDS_PER_YEAR
+        mean = (self.drift - self.volatility ** 2 / 2) * dt
+        deviation = self.volatility * math.sqrt(dt)
+        
+        gauss = self._random.gauss
+        rates = {}
+        for pair, price in self._prices.items():
+            price *= math.exp(mean + deviation * gauss(0.0, 1.0))
+            self._prices[pair] = price
+            rates[pair] = {"rate": price, "updated_at": now, "source": self.name}
+        return rates
+    
+    def _history_waves(self, pair: str):
+        """Гармоники детерминированной траектории пары"""
+        waves = self._waves.get(pair)
+        if waves is None:
+            rng = random.Random(f"{self._seed}:{pair}")
+            waves = []
+            # Периоды от часа до года; амплитуда растёт как корень из периода,
+            # как у броуновского движения
+            for j in range(16):
+                period = 3600 * (8760 ** (j / 15))
+                amplitude = self.volatility * math.sqrt(
+                    period / self._SECONDS_PER_YEAR) * rng.gauss(0.0, 0.5)
+                waves.append((2 * math.pi / period, rng.uniform(0, 2 * math.pi),
+                              amplitude))
+            self._waves[pair] = waves
+        return waves
+    
+    def fetch_history(self, start: float, end: float, step: float) -> list:
+        """Детерминированная синтетическая история - локальная замена API.
+
+        Курс в момент t зависит только от seed, пары и t, поэтому любые
+        куски диапазона, запрошенные в любом порядке, складываются в одну
+        непрерывную траекторию.
+        """
+        entries = []
+        index = math.ceil(start / step)
+        while index * step < end:
+            timestamp = index * step
+            for pair in self._prices:
+                log_price = sum(
+                    amplitude * math.sin(frequency * timestamp + phase)
+                    for frequency, phase, amplitude in self._history_waves(pair)
+                )
+                entries.append({
+                    "pair": pair,
+                    "recorded_at": float(timestamp),
+                    "rate": self.start_price * math.exp(log_price),
+                    "updated_at": float(timestamp),
+                    "source": self.name
+                })
+            index += 1
+        return entries
\ No newline at end of file
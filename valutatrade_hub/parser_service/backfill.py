@@ -0,0 +1,135 @@
+import json
+import logging
+import math
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from ..infra.database import atomic_write_json
+from . import config
+from .api_clients import get_provider
+from .storage import DataStorage
+
+logger = logging.getLogger(__name__)
+
+
+class Backfill:
+    """Догрузка истории курсов за прошлые даты.
+
+    Диапазон [start, end) делится на куски по chunk секунд, куски
+    запрашиваются параллельно (общий бюджет запросов провайдера
+    соблюдается внутри клиента), а в хранилище истории дописываются
+    строго по порядку. После каждого дописанного куска контрольная точка
+    сохраняется атомарно, поэтому после сбоя догрузка продолжается с
+    первого недописанного куска. Дописывание идемпотентно: записи,
+    которые уже есть в истории (та же пара и время), пропускаются.
+    """
+
+    def __init__(self, provider: str, start: float, end: float,
+                 step: float = 3600, chunk: float = 86400,
+                 workers: int = None, client=None):
+        if end <= start:
+            raise ValueError("Конец диапазона должен быть позже начала")
+        if step <= 0 or chunk <= 0:
+            raise ValueError("Шаг и размер куска должны быть положительными")
+        self.provider = provider
+        self.start = float(start)
+        self.end = float(end)
+        self.step = float(step)
+        self.chunk = float(chunk)
+        self.workers = workers or config.BACKFILL_WORKERS
+        self.client = client or get_provider(
+            provider, **config.PROVIDER_OPTIONS.get(provider, {}))
+        self.storage = DataStorage()
+        self.checkpoint_path = Path(config.BACKFILL_DIR) / f"{provider}.json"
+
+    @property
+    def chunk_count(self) -> int:
+        return math.ceil((self.end - self.start) / self.chunk)
+
+    def _chunk_range(self, index: int):
+        chunk_start = self.start + index * self.chunk
+        return chunk_start, min(self.end, chunk_start + self.chunk)
+
+    def _parameters(self) -> Dict:
+        return {"provider": self.provider, "start": self.start, "end": self.end,
+                "step": self.step, "chunk": self.chunk}
+
+    def load_checkpoint(self) -> int:
+        """Номер первого недописанного куска (0, если догрузка новая)"""
+        try:
+            with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            return 0
+        if checkpoint.get("parameters") != self._parameters():
+            return 0  # контрольная точка другой догрузки
+        return checkpoint.get("next_chunk", 0)
+
+    def _save_checkpoint(self, next_chunk: int, appended: int):
+        atomic_write_json(self.checkpoint_path, {
+            "parameters": self._parameters(),
+            "next_chunk": next_chunk,
+            "chunks": self.chunk_count,
+            "appended": appended,
+        })
+
+    def reset(self):
+        if self.checkpoint_path.exists():
+            self.checkpoint_path.unlink()
+
+    def _fetch(self, index: int) -> List[Dict]:
+        return self.client.fetch_history(*self._chunk_range(index), self.step)
+
+    def _append(self, index: int, entries: List[Dict]) -> int:
+        chunk_start, chunk_end = self._chunk_range(index)
+        existing = {
+            (entry.get("pair"), entry.get("recorded_at"))
+            for entry in self.storage.load_historical(chunk_start, chunk_end)
+        }
+        new_entries = [
+            entry for entry in entries
+            if (entry["pair"], entry["recorded_at"]) not in existing
+        ]
+        self.storage.append_historical(new_entries)
+        return len(new_entries)
+
+    def run(self, progress: Optional[Callable[[int, int, int], None]] = None) -> Dict:
+        """Выполнить (или продолжить) догрузку; progress(кусок, всего, записей)"""
+        total = self.chunk_count
+        next_chunk = self.load_checkpoint()
+        resumed_from = next_chunk
+        appended = 0
+        if next_chunk >= total:
+            return {"chunks": total, "resumed_from": resumed_from, "appended": 0}
+
+        done = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending = {}
+            submitted = next_chunk
+            # Вперёд запрашивается не больше двух кусков на поток, чтобы
+            # готовые, но ещё не дописанные куски не копились в памяти
+            window = self.workers * 2
+
+            while next_chunk < total:
+                while submitted < total and submitted - next_chunk < window:
+                    pending[pool.submit(self._fetch, submitted)] = submitted
+                    submitted += 1
+
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    done[pending.pop(future)] = future
+
+                # Дописываются только куски, идущие подряд от контрольной
+                # точки; ошибка куска поднимается, когда до него дошла очередь,
+                # чтобы успешные куски перед ним успели попасть в историю
+                while next_chunk in done:
+                    entries = done.pop(next_chunk).result()
+                    count = self._append(next_chunk, entries)
+                    appended += count
+                    next_chunk += 1
+                    self._save_checkpoint(next_chunk, appended)
+                    if progress is not None:
+                        progress(next_chunk, total, count)
+
+        return {"chunks": total, "resumed_from": resumed_from, "appended": appended}
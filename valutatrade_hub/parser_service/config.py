@@ -1,10 +1,15 @@
+import json
 import os
 
+from ..infra.settings import settings
+
 # Ключ ExchangeRate-API (по умолчанию из задания)
 EXCHANGERATE_API_KEY = os.getenv("EXCHANGERATE_API_KEY", "f55b4fd1a8f979f145bdd035")
 
 # URL API
 COINGECKO_URL = "https://api.coingecko.com/api/v3/simple/price"
+COINGECKO_HISTORY_URL = (
+    "https://api.coingecko.com/api/v3/coins/{coin_id}/market_chart/range")
 EXCHANGERATE_API_URL = f"https://v6.exchangerate-api.com/v6/{EXCHANGERATE_API_KEY}/latest"
 
 # Валюты для отслеживания
@@ -17,10 +22,62 @@ CRYPTO_ID_MAP = {
     "SOL": "solana",
 }
 
-# Пути к файлам
-DATA_DIR = "data"
+# Пути к файлам (каталог данных задаётся настройками, см. infra/settings.py)
+DATA_DIR = str(settings.data_dir())
 RATES_FILE = f"{DATA_DIR}/rates.json"
-HISTORY_FILE = f"{DATA_DIR}/exchange_rates.json"
+HISTORY_FILE = f"{DATA_DIR}/exchange_rates.hist"
+# Кодек блоков файла истории: zlib (быстрее) или lzma (плотнее)
+HISTORY_CODEC = os.getenv("VALUTATRADE_HISTORY_CODEC", "zlib")
+ROLLUPS_FILE = f"{DATA_DIR}/rate_rollups.json"
 
 # Параметры запросов
-REQUEST_TIMEOUT = 10
\ No newline at end of file
+REQUEST_TIMEOUT = 10
+
+# Бюджет запросов провайдеров, общий для всех процессов: rate - жетонов
+# в секунду, capacity - размер всплеска, max_wait - сколько ждать жетона,
+# прежде чем отдать последний полученный ответ
+RATE_LIMITS = {
+    # Бесплатный тариф CoinGecko: около 30 запросов в минуту
+    "coingecko": {"rate": 0.5, "capacity": 5, "max_wait": 30.0},
+    # Бесплатный ключ ExchangeRate-API: 1500 запросов в месяц
+    "exchangerate": {"rate": 1500 / (30 * 24 * 3600), "capacity": 3,
+                     "max_wait": 30.0},
+}
+
+# Провайдеры курсов из реестра api_clients, опрашиваемые командой update
+PROVIDERS = [
+    name.strip()
+    for name in os.getenv("VALUTATRADE_PROVIDERS", "coingecko,exchangerate").split(",")
+    if name.strip()
+]
+
+# Параметры конструкторов провайдеров, например
+# {"randomwalk": {"pairs": 5000, "tick_rate": 10, "seed": 1}}
+PROVIDER_OPTIONS = json.loads(os.getenv("VALUTATRADE_PROVIDER_OPTIONS", "{}"))
+
+# Если задан, ответы провайдеров записываются сюда для ReplayClient
+RECORD_FILE = os.getenv("VALUTATRADE_RECORD_FILE", "")
+
+# Хранение истории: сырые записи держатся RAW_RETENTION секунд,
+# затем сворачиваются в агрегаты OHLC. Уровни (ширина интервала,
+# срок хранения в секундах; None - бессрочно) идут от мелкого к крупному:
+# агрегат с истёкшим сроком сворачивается в следующий уровень.
+RAW_RETENTION = 24 * 3600
+ROLLUP_TIERS = [
+    (60, 7 * 24 * 3600),
+    (3600, 90 * 24 * 3600),
+    (86400, None),
+]
+
+# Как часто планировщик запускает уплотнение истории (секунды)
+COMPACTION_INTERVAL = 3600
+
+# Догрузка истории: каталог контрольных точек и число параллельных запросов
+BACKFILL_DIR = f"{DATA_DIR}/backfill"
+BACKFILL_WORKERS = 4
+
+# Потоковый приём тиков: окно свёртки (секунды) - курсы пишутся не чаще
+# раза в окно, порт тестовой ленты, период отчёта о ходе приёма
+STREAM_WINDOW = 0.25
+STREAM_PORT = 9100
+STREAM_REPORT_INTERVAL = 10
\ No newline at end of file
@@ -0,0 +1,503 @@
+import json
+import lzma
+import os
+import struct
+import threading
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from ..core.utils import to_epoch
+from ..infra.database import _fsync_directory
+from ..infra.locks import file_lock
+
+# Заголовок: сигнатура, версия формата, смещение индекса блоков
+_HEADER = struct.Struct("<4sHxxQ")
+_MAGIC = b"VTHB"
+# Версия 2 добавила в колоночные записи дополнительные поля; файлы версии 1
+# читаются как есть
+_FORMAT_VERSION = 2
+_READABLE_VERSIONS = (1, 2)
+_INDEX_OFFSET_POS = 8
+# Запись индекса: смещение, длина, кодек, число записей, мин. и макс. время
+_INDEX_ENTRY = struct.Struct("<QIBxxxIdd")
+_DOUBLE = struct.Struct("<d")
+_INT64 = struct.Struct("<q")
+
+CODECS = {"zlib": 0, "lzma": 1}
+DEFAULT_BLOCK_RECORDS = 4096
+# Сколько неполных блоков может накопиться в конце файла, прежде чем
+# дописывание сольёт их в один
+_MAX_TAIL_BLOCKS = 16
+
+# Виды записей внутри блока
+_COLUMNAR = 0
+_RAW_JSON = 1
+_COLUMNAR_FIELDS = {"pair", "rate", "recorded_at", "updated_at", "version", "source"}
+# Вид значения дополнительного поля колоночной записи
+_EXTRA_TIME = 0     # double - дельтой от recorded_at
+_EXTRA_JSON = 1     # прочее - строкой JSON из словаря блока
+
+
+def entry_time(entry: Dict) -> float:
+    """Время записи истории в секундах epoch (0.0, если не разбирается)"""
+    try:
+        return to_epoch(entry.get("recorded_at", entry.get("updated_at")))
+    except ValueError:
+        return 0.0
+
+
+def _float_bits(value: float) -> int:
+    return _INT64.unpack(_DOUBLE.pack(value))[0]
+
+
+def _bits_float(bits: int) -> float:
+    return _DOUBLE.unpack(_INT64.pack(bits))[0]
+
+
+def _put_varint(out: bytearray, value: int):
+    # zigzag: малые по модулю отрицательные числа тоже занимают мало байт
+    value = -2 * value - 1 if value < 0 else 2 * value
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _get_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            break
+        shift += 7
+    return (result >> 1) ^ -(result & 1), pos
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _is_columnar(entry: Dict) -> bool:
+    return (
+        {"pair", "rate", "recorded_at"} <= entry.keys()
+        and isinstance(entry["pair"], str)
+        and _is_number(entry["rate"])
+        and _is_number(entry["recorded_at"])
+        and _is_number(entry.get("updated_at", 0.0))
+        and type(entry.get("version", 0)) is int
+        and isinstance(entry.get("source", ""), str)
+    )
+
+
+def encode_block(entries: List[Dict]) -> bytes:
+    """Несжатое содержимое блока.
+
+    Время и курсы хранятся дельтами двоичного представления double
+    (для положительных чисел оно монотонно, поэтому дельты малы и
+    кодирование без потерь): время - от предыдущей записи блока, курс -
+    от предыдущего курса той же пары, updated_at - от recorded_at.
+    Целые курсы и времена (CoinGecko отдаёт курс целым числом) хранятся
+    как double. Прочие поля записи (например, published_at фиатных
+    курсов) идут дополнительной колонкой: double - дельтой от
+    recorded_at, остальное - строкой JSON. Строки (пары, источники,
+    имена полей) кодируются номерами в словаре блока.
+    """
+    out = bytearray()
+    strings = {}
+    previous_time = 0
+    previous_version = 0
+    previous_rates = {}
+
+    def put_string(value: str):
+        index = strings.get(value)
+        if index is not None:
+            _put_varint(out, index)
+            return
+        strings[value] = len(strings)
+        _put_varint(out, len(strings) - 1)
+        raw = value.encode("utf-8")
+        _put_varint(out, len(raw))
+        out.extend(raw)
+
+    for entry in entries:
+        if not _is_columnar(entry):
+            raw = json.dumps(entry, ensure_ascii=False, default=str).encode("utf-8")
+            _put_varint(out, _RAW_JSON)
+            _put_varint(out, len(raw))
+            out.extend(raw)
+            continue
+
+        _put_varint(out, _COLUMNAR)
+        put_string(entry["pair"])
+        time_bits = _float_bits(float(entry["recorded_at"]))
+        _put_varint(out, time_bits - previous_time)
+        previous_time = time_bits
+        rate_bits = _float_bits(float(entry["rate"]))
+        _put_varint(out, rate_bits - previous_rates.get(entry["pair"], 0))
+        previous_rates[entry["pair"]] = rate_bits
+
+        # Необязательные поля: битовая маска наличия
+        extra = [key for key in entry if key not in _COLUMNAR_FIELDS]
+        present = (("updated_at" in entry) | ("version" in entry) << 1
+                   | ("source" in entry) << 2 | bool(extra) << 3)
+        _put_varint(out, present)
+        if "updated_at" in entry:
+            _put_varint(out, _float_bits(float(entry["updated_at"])) - time_bits)
+        if "version" in entry:
+            _put_varint(out, entry["version"] - previous_version)
+            previous_version = entry["version"]
+        if "source" in entry:
+            put_string(entry["source"])
+        if extra:
+            _put_varint(out, len(extra))
+            for key in extra:
+                put_string(key)
+                value = entry[key]
+                if type(value) is float:
+                    _put_varint(out, _EXTRA_TIME)
+                    _put_varint(out, _float_bits(value) - time_bits)
+                else:
+                    _put_varint(out, _EXTRA_JSON)
+                    put_string(json.dumps(value, ensure_ascii=False, default=str))
+    return bytes(out)
+
+
+def decode_block(data: bytes) -> List[Dict]:
+    entries = []
+    strings = []
+    previous_time = 0
+    previous_version = 0
+    previous_rates = {}
+    pos = 0
+
+    def get_string():
+        nonlocal pos
+        index, pos = _get_varint(data, pos)
+        if index == len(strings):
+            length, pos = _get_varint(data, pos)
+            strings.append(data[pos:pos + length].decode("utf-8"))
+            pos += length
+        return strings[index]
+
+    while pos < len(data):
+        kind, pos = _get_varint(data, pos)
+        if kind == _RAW_JSON:
+            length, pos = _get_varint(data, pos)
+            entries.append(json.loads(data[pos:pos + length]))
+            pos += length
+            continue
+
+        pair = get_string()
+        delta, pos = _get_varint(data, pos)
+        previous_time += delta
+        delta, pos = _get_varint(data, pos)
+        rate_bits = previous_rates.get(pair, 0) + delta
+        previous_rates[pair] = rate_bits
+        # Порядок ключей как у записей, которые пишет RatesUpdater
+        entry = {"pair": pair}
+        present, pos = _get_varint(data, pos)
+        if present & 1:
+            delta, pos = _get_varint(data, pos)
+            updated_at = _bits_float(previous_time + delta)
+        if present & 2:
+            delta, pos = _get_varint(data, pos)
+            previous_version += delta
+            entry["version"] = previous_version
+        entry["recorded_at"] = _bits_float(previous_time)
+        entry["rate"] = _bits_float(rate_bits)
+        if present & 1:
+            entry["updated_at"] = updated_at
+        if present & 4:
+            entry["source"] = get_string()
+        if present & 8:
+            count, pos = _get_varint(data, pos)
+            for _ in range(count):
+                key = get_string()
+                kind, pos = _get_varint(data, pos)
+                if kind == _EXTRA_TIME:
+                    delta, pos = _get_varint(data, pos)
+                    entry[key] = _bits_float(previous_time + delta)
+                else:
+                    entry[key] = json.loads(get_string())
+        entries.append(entry)
+    return entries
+
+
+def _compress(data: bytes, codec: int) -> bytes:
+    return lzma.compress(data) if codec == CODECS["lzma"] else zlib.compress(data, 6)
+
+
+def _decompress(data: bytes, codec: int) -> bytes:
+    return lzma.decompress(data) if codec == CODECS["lzma"] else zlib.decompress(data)
+
+
+class BlockInfo:
+    """Запись индекса: где лежит блок и какой интервал времени он покрывает"""
+
+    __slots__ = ("offset", "length", "codec", "count", "min_time", "max_time")
+
+    def __init__(self, offset, length, codec, count, min_time, max_time):
+        self.offset = offset
+        self.length = length
+        self.codec = codec
+        self.count = count
+        self.min_time = min_time
+        self.max_time = max_time
+
+    def pack(self) -> bytes:
+        return _INDEX_ENTRY.pack(self.offset, self.length, self.codec,
+                                 self.count, self.min_time, self.max_time)
+
+    def overlaps(self, start: Optional[float], end: Optional[float]) -> bool:
+        return ((start is None or self.max_time >= start)
+                and (end is None or self.min_time < end))
+
+
+class _PathLock:
+    """Блокировка файла истории: реентерабельная внутри процесса, flock -
+    между процессами (берётся только на внешнем уровне вложенности)"""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.depth = 0
+
+
+_path_locks: Dict[str, _PathLock] = {}
+_path_locks_guard = threading.Lock()
+
+
+class HistoryFile:
+    """Файл истории курсов из независимо сжатых блоков.
+
+    Формат: заголовок со смещением индекса, блоки (zlib или lzma) и
+    индекс в конце файла. Выборка по времени читает и распаковывает
+    только блоки, пересекающие диапазон. Дописывание не трогает
+    существующие блоки: неполный последний блок и индекс пишутся
+    заново в конец файла, после fsync смещение индекса в заголовке
+    переключается на новый. Читатель всегда видит согласованный индекс,
+    а накопившийся мусор убирается полной перезаписью (compact).
+    """
+
+    def __init__(self, path, codec: str = "zlib",
+                 block_records: int = DEFAULT_BLOCK_RECORDS):
+        if codec not in CODECS:
+            raise ValueError(f"Неизвестный кодек истории: {codec}")
+        self.path = Path(path)
+        self.codec = CODECS[codec]
+        self.block_records = block_records
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    @contextmanager
+    def _exclusive(self):
+        """Дописывание, перезапись и чистка файла выполняются по одной:
+        иначе две записи читают один индекс и одна теряет блоки другой"""
+        key = str(self.path.absolute())
+        with _path_locks_guard:
+            path_lock = _path_locks.setdefault(key, _PathLock())
+        with path_lock.lock:
+            path_lock.depth += 1
+            try:
+                if path_lock.depth == 1:
+                    with file_lock(self.path.with_name(f"{self.path.name}.lock")):
+                        yield
+                else:
+                    yield
+            finally:
+                path_lock.depth -= 1
+
+    def _read_index(self, f) -> Tuple[List[BlockInfo], int]:
+        magic, version, index_offset = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != _MAGIC or version not in _READABLE_VERSIONS:
+            raise ValueError(f"Неизвестный формат файла истории: {self.path}")
+        f.seek(index_offset)
+        count = struct.unpack("<I", f.read(4))[0]
+        raw = f.read(count * _INDEX_ENTRY.size)
+        blocks = [BlockInfo(*fields) for fields in _INDEX_ENTRY.iter_unpack(raw)]
+        return blocks, index_offset
+
+    def blocks(self) -> List[BlockInfo]:
+        if not self.exists():
+            return []
+        with open(self.path, 'rb') as f:
+            return self._read_index(f)[0]
+
+    def _read_block(self, f, block: BlockInfo) -> List[Dict]:
+        f.seek(block.offset)
+        return decode_block(_decompress(f.read(block.length), block.codec))
+
+    def _make_blocks(self, entries: List[Dict], offset: int):
+        """Сжатые блоки из записей: [(BlockInfo, байты)]"""
+        result = []
+        for i in range(0, len(entries), self.block_records):
+            chunk = entries[i:i + self.block_records]
+            data = _compress(encode_block(chunk), self.codec)
+            times = [entry_time(entry) for entry in chunk]
+            result.append((BlockInfo(offset, len(data), self.codec, len(chunk),
+                                     min(times), max(times)), data))
+            offset += len(data)
+        return result
+
+    @staticmethod
+    def _index_bytes(blocks: List[BlockInfo]) -> bytes:
+        return struct.pack("<I", len(blocks)) + b"".join(b.pack() for b in blocks)
+
+    def read(self, start: float = None, end: float = None,
+             pair: str = None) -> List[Dict]:
+        """Записи за [start, end), опционально по одной паре"""
+        if not self.exists():
+            return []
+        result = []
+        with open(self.path, 'rb') as f:
+            blocks, _ = self._read_index(f)
+            for block in blocks:
+                if not block.overlaps(start, end):
+                    continue
+                for entry in self._read_block(f, block):
+                    if pair is not None and entry.get("pair") != pair:
+                        continue
+                    if start is not None or end is not None:
+                        timestamp = entry_time(entry)
+                        if ((start is not None and timestamp < start)
+                                or (end is not None and timestamp >= end)):
+                            continue
+                    result.append(entry)
+        return result
+
+    def write(self, entries: List[Dict]):
+        """Записать файл целиком (атомарно, через временный файл)"""
+        with self._exclusive():
+            self._rewrite([(None, entries)])
+
+    def _rewrite(self, parts: Iterable[Tuple[Optional[BlockInfo], object]]):
+        """Новый файл из частей: (блок, сжатые байты) копируется как есть,
+        (None, записи) сжимается в новые блоки"""
+        tmp_path = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        blocks = []
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(_HEADER.pack(_MAGIC, _FORMAT_VERSION, 0))
+                for block, payload in parts:
+                    offset = f.tell()
+                    if block is None:
+                        for info, data in self._make_blocks(payload, offset):
+                            f.write(data)
+                            blocks.append(info)
+                    else:
+                        f.write(payload)
+                        blocks.append(BlockInfo(offset, block.length, block.codec,
+                                                block.count, block.min_time,
+                                                block.max_time))
+                index_offset = f.tell()
+                f.write(self._index_bytes(blocks))
+                f.seek(_INDEX_OFFSET_POS)
+                f.write(struct.pack("<Q", index_offset))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if tmp_path.exists():
+                tmp_path.unlink()
+            raise
+        _fsync_directory(self.path.parent)
+
+    def append(self, entries: List[Dict]):
+        """Дописать записи.
+
+        Записи пишутся новым блоком в конец без чтения прежних; когда в
+        конце файла накапливается _MAX_TAIL_BLOCKS неполных блоков, они
+        сливаются с новыми записями. Частое дописывание малыми пачками
+        (потоковая лента) не пересжимает каждый раз весь последний блок.
+        """
+        if not entries:
+            return
+        with self._exclusive():
+            if not self.exists():
+                self.write(entries)
+                return
+
+            with open(self.path, 'r+b') as f:
+                blocks, index_offset = self._read_index(f)
+                tail = 0
+                while (tail < len(blocks)
+                       and blocks[-1 - tail].count < self.block_records):
+                    tail += 1
+                if tail >= _MAX_TAIL_BLOCKS:
+                    merged = []
+                    for block in blocks[-tail:]:
+                        merged += self._read_block(f, block)
+                    entries = merged + entries
+                    blocks = blocks[:-tail]
+
+                f.seek(0, os.SEEK_END)
+                end = f.tell()
+                new_blocks = self._make_blocks(entries, end)
+                for _, data in new_blocks:
+                    f.write(data)
+                blocks += [info for info, _ in new_blocks]
+                new_index_offset = f.tell()
+                index = self._index_bytes(blocks)
+                f.write(index)
+                f.flush()
+                os.fsync(f.fileno())
+
+                # Переключение на новый индекс - одна запись заголовка (файл
+                # версии 1 заодно помечается версией 2: в новых блоках могут
+                # быть дополнительные поля)
+                f.seek(0)
+                f.write(_HEADER.pack(_MAGIC, _FORMAT_VERSION, new_index_offset))
+                f.flush()
+                os.fsync(f.fileno())
+
+            live = _HEADER.size + sum(block.length for block in blocks) + len(index)
+            garbage = new_index_offset + len(index) - live
+            if garbage > max(live, 1 << 16):
+                self.compact()
+
+    def compact(self):
+        """Переписать файл без мусора от прошлых дописываний"""
+        with self._exclusive():
+            with open(self.path, 'rb') as f:
+                blocks, _ = self._read_index(f)
+                parts = []
+                for block in blocks:
+                    f.seek(block.offset)
+                    parts.append((block, f.read(block.length)))
+            self._rewrite(parts)
+
+    def prune(self, before: float) -> int:
+        """Удалить записи старше before; возвращает число удалённых.
+
+        Блоки целиком старше границы отбрасываются без распаковки,
+        блок на границе пересобирается, остальные копируются как есть.
+        """
+        with self._exclusive():
+            if not self.exists():
+                return 0
+            removed = 0
+            parts = []
+            with open(self.path, 'rb') as f:
+                blocks, _ = self._read_index(f)
+                for block in blocks:
+                    if block.max_time < before:
+                        removed += block.count
+                    elif block.min_time < before:
+                        kept = [entry for entry in self._read_block(f, block)
+                                if entry_time(entry) >= before]
+                        removed += block.count - len(kept)
+                        parts.append((None, kept))
+                    else:
+                        f.seek(block.offset)
+                        parts.append((block, f.read(block.length)))
+            if removed:
+                self._rewrite(parts)
+            return removed
+
+    def count(self) -> int:
+        return sum(block.count for block in self.blocks())
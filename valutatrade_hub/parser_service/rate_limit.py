@@ -0,0 +1,125 @@
+import json
+import logging
+import struct
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+from ..core.exceptions import ApiRequestError
+from ..infra.database import atomic_write_json
+from ..infra.locks import file_lock
+from ..infra.settings import settings
+from . import config
+
+logger = logging.getLogger(__name__)
+
+# Состояние корзины: число жетонов и время последнего пополнения
+_BUCKET = struct.Struct("<dd")
+
+
+class TokenBucket:
+    """Корзина жетонов, общая для всех процессов.
+
+    Состояние хранится в маленьком двоичном файле и меняется только под
+    flock, поэтому планировщики, оболочки и скрипты расходуют один
+    бюджет запросов. Жетоны пополняются со скоростью rate в секунду до
+    capacity.
+    """
+
+    def __init__(self, path, rate: float, capacity: float):
+        self.path = Path(path)
+        self.rate = rate
+        self.capacity = capacity
+
+    def _take(self) -> float:
+        """Взять жетон; 0.0 при успехе, иначе сколько секунд ждать"""
+        with file_lock(self.path.with_suffix(".lock")):
+            now = time.time()
+            try:
+                tokens, updated = _BUCKET.unpack(self.path.read_bytes())
+            except (OSError, struct.error):
+                tokens, updated = self.capacity, now
+            tokens = min(self.capacity, tokens + max(0.0, now - updated) * self.rate)
+
+            wait = 0.0
+            if tokens >= 1.0:
+                tokens -= 1.0
+            else:
+                wait = (1.0 - tokens) / self.rate
+            # Файл состояния меняется только под блокировкой: запись на месте
+            with open(self.path, 'wb') as f:
+                f.write(_BUCKET.pack(tokens, now))
+            return wait
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """Дождаться жетона; False, если ждать пришлось бы дольше timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self._take()
+            if not wait:
+                return True
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class RequestBudget:
+    """Бюджет исходящих запросов одного провайдера.
+
+    Запросы к провайдеру выполняются по одному на всю систему (flock на
+    файле <имя>.inflight). Кто пришёл, пока запрос уже выполнялся,
+    ждёт его и получает тот же результат без своего обращения к API.
+    Новый запрос ждёт жетона корзины; если ждать дольше max_wait,
+    возвращается последний полученный результат, а не ошибка 429.
+    """
+
+    def __init__(self, name: str, rate: float, capacity: float,
+                 max_wait: float = 30.0, directory=None):
+        directory = Path(directory or settings.data_dir() / "ratelimit")
+        self.name = name
+        self.bucket = TokenBucket(directory / f"{name}.bucket", rate, capacity)
+        self.max_wait = max_wait
+        self._inflight = directory / f"{name}.inflight"
+        self._result = directory / f"{name}.last.json"
+
+    def _last_result(self) -> Optional[Dict]:
+        try:
+            with open(self._result, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def call(self, fetch: Callable[[], dict]) -> dict:
+        requested_at = time.time()
+        with file_lock(self._inflight):
+            last = self._last_result()
+            if last is not None and last["fetched_at"] >= requested_at:
+                # Запрос завершился, пока мы ждали: присоединяемся к нему
+                logger.info(f"{self.name}: используется только что полученный ответ")
+                return last["rates"]
+
+            if not self.bucket.acquire(self.max_wait):
+                if last is not None:
+                    logger.warning(f"{self.name}: бюджет запросов исчерпан, "
+                                   f"используется ответ от {last['fetched_at']:.0f}")
+                    return last["rates"]
+                raise ApiRequestError(
+                    f"{self.name}: бюджет запросов исчерпан, повторите позже")
+
+            rates = fetch()
+            atomic_write_json(self._result, {"fetched_at": time.time(),
+                                             "rates": rates})
+            return rates
+
+
+_budgets: Dict[str, RequestBudget] = {}
+
+
+def get_budget(name: str) -> Optional[RequestBudget]:
+    """Бюджет провайдера из config.RATE_LIMITS или None, если лимита нет"""
+    limits = config.RATE_LIMITS.get(name)
+    if limits is None:
+        return None
+    if name not in _budgets:
+        _budgets[name] = RequestBudget(name, **limits)
+    return _budgets[name]
@@ -0,0 +1,139 @@
+import bisect
+import time
+from typing import Dict, Iterable, List
+
+from . import config
+from .history_file import entry_time
+from .storage import DataStorage
+
+
+def merge_bar(bars: Dict, pair: str, start: int, bar: Dict):
+    """Влить агрегат (или одну точку) в агрегат пары за интервал start"""
+    key = (pair, start)
+    current = bars.get(key)
+    if current is None:
+        bars[key] = {"pair": pair, "start": start, **bar}
+        return
+    if bar["first_at"] < current["first_at"]:
+        current["open"] = bar["open"]
+        current["first_at"] = bar["first_at"]
+    if bar["last_at"] >= current["last_at"]:
+        current["close"] = bar["close"]
+        current["last_at"] = bar["last_at"]
+    current["high"] = max(current["high"], bar["high"])
+    current["low"] = min(current["low"], bar["low"])
+    current["count"] += bar["count"]
+
+
+def _point(rate: float, timestamp: float) -> Dict:
+    return {
+        "open": rate, "high": rate, "low": rate, "close": rate,
+        "count": 1, "first_at": timestamp, "last_at": timestamp,
+    }
+
+
+def bar_points(bars: Iterable[Dict]) -> List[Dict]:
+    """Агрегаты в виде записей истории (курс закрытия на момент last_at)"""
+    return [
+        {"pair": bar["pair"], "rate": bar["close"], "recorded_at": bar["last_at"]}
+        for bar in bars
+    ]
+
+
+class RetentionManager:
+    """Политика хранения истории курсов с понижением детализации.
+
+    Сырые записи истории курсов живут config.RAW_RETENTION секунд,
+    затем сворачиваются в агрегаты OHLC+count первого уровня
+    (rate_rollups.json); агрегаты с истёкшим сроком сворачиваются в
+    следующий уровень. Границы отсечения выровнены по интервалу
+    принимающего уровня, поэтому каждый интервал сворачивается целиком.
+    Уплотнение инкрементально: обрабатывается только то, что пересекло
+    границу с прошлого запуска (для сырых записей граница запоминается,
+    а из файла истории читаются только блоки старше неё), а объём
+    истории и агрегатов ограничен сроками хранения.
+    """
+
+    def __init__(self, raw_retention: float = None, tiers=None):
+        self.raw_retention = (config.RAW_RETENTION if raw_retention is None
+                              else raw_retention)
+        self.tiers = list(tiers or config.ROLLUP_TIERS)
+        self.storage = DataStorage()
+
+    def compact(self, now: float = None) -> Dict[str, int]:
+        """Один шаг уплотнения; возвращает число свёрнутых записей по уровням"""
+        now = time.time() if now is None else now
+        rollups = self.storage.load_rollups()
+        watermarks = rollups.setdefault("watermarks", {})
+        all_bars = rollups.setdefault("bars", {})
+        stats = {}
+
+        # Сырые записи -> первый уровень
+        width = self.tiers[0][0]
+        cutoff = int((now - self.raw_retention) // width * width)
+        if cutoff > watermarks.get("raw", float("-inf")):
+            # Распаковываются только блоки истории старше границы
+            expired = self.storage.load_historical(end=cutoff)
+            if expired:
+                bars = self._index(all_bars.get(str(width), []))
+                for entry in expired:
+                    if "pair" not in entry or "rate" not in entry:
+                        continue
+                    timestamp = entry_time(entry)
+                    start = int(timestamp // width * width)
+                    merge_bar(bars, entry["pair"], start,
+                              _point(float(entry["rate"]), timestamp))
+                all_bars[str(width)] = self._sorted(bars)
+                # Агрегаты сохраняются раньше удаления сырых записей:
+                # при сбое между шагами точки учтутся дважды, но не пропадут
+                self.storage.save_rollups(rollups)
+                self.storage.prune_historical(cutoff)
+            stats["raw"] = len(expired)
+            watermarks["raw"] = cutoff
+
+        # Уровень i -> уровень i + 1 по истечении срока хранения
+        for (width, retention), (next_width, _) in zip(self.tiers, self.tiers[1:]):
+            cutoff = int((now - retention) // next_width * next_width)
+            key = str(width)
+            source = all_bars.get(key, [])
+            split = bisect.bisect_left([bar["start"] for bar in source], cutoff)
+            if split:
+                target = self._index(all_bars.get(str(next_width), []))
+                for bar in source[:split]:
+                    start = bar["start"] // next_width * next_width
+                    merge_bar(target, bar["pair"], start, {
+                        field: bar[field] for field in (
+                            "open", "high", "low", "close",
+                            "count", "first_at", "last_at")
+                    })
+                all_bars[str(next_width)] = self._sorted(target)
+                all_bars[key] = source[split:]
+            stats[key] = split
+
+        self.storage.save_rollups(rollups)
+        return stats
+
+    @staticmethod
+    def _index(bars: List[Dict]) -> Dict:
+        return {(bar["pair"], bar["start"]): bar for bar in bars}
+
+    @staticmethod
+    def _sorted(bars: Dict) -> List[Dict]:
+        # Порядок по началу интервала нужен для бинарного поиска границы
+        return [bars[key] for key in sorted(bars, key=lambda key: (key[1], key[0]))]
+
+    def get_bars(self, width: int, pair: str = None,
+                 start: float = None, end: float = None) -> List[Dict]:
+        """Агрегаты уровня width, опционально по паре и диапазону начала"""
+        bars = self.storage.load_rollups().get("bars", {}).get(str(width), [])
+        starts = [bar["start"] for bar in bars]
+        lo = 0 if start is None else bisect.bisect_left(starts, start)
+        hi = len(bars) if end is None else bisect.bisect_right(starts, end)
+        return [bar for bar in bars[lo:hi] if pair is None or bar["pair"] == pair]
+
+    def all_bars(self) -> List[Dict]:
+        """Агрегаты всех уровней"""
+        return [
+            bar for bars in self.storage.load_rollups().get("bars", {}).values()
+            for bar in bars
+        ]
@@ -1,12 +1,19 @@
+import logging
 import time
 
+from . import config
+from .retention import RetentionManager
 from .updater import RatesUpdater
 
+logger = logging.getLogger(__name__)
+
 
 class UpdateScheduler:
     def __init__(self, interval_minutes: int = 5):
         self.interval = interval_minutes * 60
         self.updater = RatesUpdater()
+        self.retention = RetentionManager()
+        self.last_compaction = 0.0
         self.running = False
     
     def start(self):
@@ -16,8 +23,21 @@ class UpdateScheduler:
         
         while self.running:
             self.updater.run_update()
+            self.compact_history()
             time.sleep(self.interval)
     
+    def compact_history(self):
+        """Уплотнение истории курсов не чаще config.COMPACTION_INTERVAL"""
+        now = time.time()
+        if now - self.last_compaction < config.COMPACTION_INTERVAL:
+            return
+        self.last_compaction = now
+        try:
+            stats = self.retention.compact(now)
+            logger.info(f"Уплотнение истории курсов: {stats}")
+        except (OSError, ValueError) as e:
+            logger.warning(f"Не удалось уплотнить историю курсов: {e}")
+    
     def stop(self):
         """Остановка планировщика"""
         self.running = False
@@ -1,29 +1,94 @@
 import json
-from pathlib import Path
+
+from ..infra.database import atomic_write_json
+from ..infra.settings import settings
+from ..tracing import traced
+from . import config
+from .history_file import HistoryFile
 
 
 class DataStorage:
     def __init__(self):
-        self.data_dir = Path("data")
-        self.data_dir.mkdir(exist_ok=True)
+        self.data_dir = settings.data_dir()
+        self.data_dir.mkdir(parents=True, exist_ok=True)
     
+    @traced("storage.save_rates")
     def save_rates(self, rates_data: dict):
         """Сохранение текущих курсов в rates.json"""
         filepath = self.data_dir / "rates.json"
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(rates_data, f, indent=2, default=str)
+        atomic_write_json(filepath, rates_data)
     
+    @traced("storage.load_rates")
+    def load_rates(self) -> dict:
+        """Загрузка текущих курсов из rates.json"""
+        filepath = self.data_dir / "rates.json"
+        if not filepath.exists():
+            return {}
+        
+        with open(filepath, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    
+    def save_confirmations(self, confirmed_at: dict):
+        """Сохранение времени подтверждения курсов ({пара: время}).
+
+        Подтверждения лежат отдельно от rates.json, чтобы обновление без
+        изменений курсов не переписывало снимок и не будило его читателей.
+        """
+        atomic_write_json(self.data_dir / "rate_confirmations.json", confirmed_at)
+    
+    def load_confirmations(self) -> dict:
+        """Загрузка времени подтверждения курсов"""
+        filepath = self.data_dir / "rate_confirmations.json"
+        if not filepath.exists():
+            return {}
+        
+        with open(filepath, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    
+    def _history(self) -> HistoryFile:
+        """Блочный файл истории; JSON старого формата переносится в него"""
+        history = HistoryFile(self.data_dir / "exchange_rates.hist",
+                              codec=config.HISTORY_CODEC)
+        legacy = self.data_dir / "exchange_rates.json"
+        if not history.exists() and legacy.exists():
+            with open(legacy, 'r', encoding='utf-8') as f:
+                history.write(json.load(f))
+            legacy.unlink()
+        return history
+    
+    @traced("storage.save_historical")
     def save_historical(self, historical_data: list):
         """Сохранение исторических данных"""
-        filepath = self.data_dir / "exchange_rates.json"
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(historical_data, f, indent=2, default=str)
+        self._history().write(historical_data)
     
-    def load_historical(self) -> list:
-        """Загрузка исторических данных"""
-        filepath = self.data_dir / "exchange_rates.json"
+    @traced("storage.append_historical")
+    def append_historical(self, entries: list):
+        """Дописать записи в историю курсов"""
+        self._history().append(entries)
+    
+    @traced("storage.load_historical")
+    def load_historical(self, start: float = None, end: float = None,
+                        pair: str = None) -> list:
+        """Загрузка исторических данных (опционально за [start, end) по паре)"""
+        return self._history().read(start, end, pair)
+    
+    @traced("storage.prune_historical")
+    def prune_historical(self, before: float) -> int:
+        """Удалить записи истории старше before"""
+        return self._history().prune(before)
+    
+    @traced("storage.load_rollups")
+    def load_rollups(self) -> dict:
+        """Загрузка агрегатов истории: {"bars": {ширина: [...]}, ...}"""
+        filepath = self.data_dir / "rate_rollups.json"
         if not filepath.exists():
-            return []
+            return {"bars": {}, "watermarks": {}}
         
         with open(filepath, 'r', encoding='utf-8') as f:
-            return json.load(f)
\ No newline at end of file
+            return json.load(f)
+    
+    @traced("storage.save_rollups")
+    def save_rollups(self, rollups: dict):
+        """Сохранение агрегатов истории"""
+        filepath = self.data_dir / "rate_rollups.json"
+        atomic_write_json(filepath, rollups)
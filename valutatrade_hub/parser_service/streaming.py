@@ -0,0 +1,338 @@
+"""Потоковый приём курсов (тиков) из push-источника.
+
+Тик - строка JSON: {"pair": "BTC_USD", "rate": 50000.1, "ts": 1767225600.25,
+"source": "feed"} (ts и source необязательны). Тики одной пары внутри
+окна сворачиваются в последний, и раз в окно изменившиеся пары
+записываются в хранилище курсов одной пачкой через
+RatesUpdater.apply_rates - со всеми подписчиками (история, заявки,
+оповещения), но без записи на каждый тик.
+
+Запуск:
+  python -m valutatrade_hub.parser_service.streaming feed [--port N]
+      - локальная тестовая лента (случайное блуждание по синтетическим
+        парам SYN0000_USD, ...) по TCP;
+  python -m valutatrade_hub.parser_service.streaming ingest
+      [--connect HOST:PORT] [--window SEC] [--duration SEC]
+      - приём тиков из ленты (без --connect - из встроенной ленты).
+"""
+import argparse
+import json
+import logging
+import math
+import random
+import socket
+import socketserver
+import threading
+import time
+from typing import Dict, Iterator, Optional, Tuple
+
+from . import config
+from .updater import RatesUpdater
+
+logger = logging.getLogger(__name__)
+
+# (пара, курс, время, источник)
+Tick = Tuple[str, float, float, str]
+
+
+def parse_tick(line, default_source: str = "stream") -> Optional[Tick]:
+    """Тик из строки JSON или None, если строка некорректна"""
+    try:
+        message = json.loads(line)
+        pair = message["pair"]
+        rate = float(message["rate"])
+    except (ValueError, KeyError, TypeError):
+        return None
+    if not isinstance(pair, str) or "_" not in pair or not rate > 0:
+        return None
+    timestamp = message.get("ts")
+    if not isinstance(timestamp, (int, float)):
+        timestamp = time.time()
+    return pair.upper(), rate, float(timestamp), message.get("source", default_source)
+
+
+def format_tick(pair: str, rate: float, timestamp: float, source: str) -> bytes:
+    return (json.dumps({"pair": pair, "rate": rate, "ts": timestamp,
+                        "source": source}) + "\n").encode("utf-8")
+
+
+class StreamTickSource:
+    """Тики из потока строк (файл, stdin)"""
+
+    def __init__(self, stream, source: str = "stream"):
+        self.stream = stream
+        self.source = source
+
+    def ticks(self, stop: threading.Event) -> Iterator[Tick]:
+        for line in self.stream:
+            if stop.is_set():
+                return
+            tick = parse_tick(line, self.source)
+            if tick is not None:
+                yield tick
+
+
+class SocketTickSource:
+    """Тики из TCP-соединения с лентой (строки JSON через перевод строки).
+
+    Чтение идёт с коротким таймаутом, чтобы остановка срабатывала и
+    при молчащей ленте.
+    """
+
+    def __init__(self, host: str, port: int, source: str = "socket",
+                 timeout: float = 0.5):
+        self.address = (host, port)
+        self.source = source
+        self.timeout = timeout
+
+    def ticks(self, stop: threading.Event) -> Iterator[Tick]:
+        with socket.create_connection(self.address, timeout=config.REQUEST_TIMEOUT) \
+                as sock:
+            sock.settimeout(self.timeout)
+            logger.info(f"Подключено к ленте {self.address[0]}:{self.address[1]}")
+            buffer = b""
+            while not stop.is_set():
+                try:
+                    chunk = sock.recv(65536)
+                except socket.timeout:
+                    continue
+                if not chunk:
+                    logger.info("Лента закрыла соединение")
+                    return
+                buffer += chunk
+                *lines, buffer = buffer.split(b"\n")
+                for line in lines:
+                    tick = parse_tick(line, self.source)
+                    if tick is not None:
+                        yield tick
+
+
+class RandomWalkFeed:
+    """Локальная тестовая лента: тики случайного блуждания.
+
+    Тики идут со скоростью tick_rate в секунду по случайным парам из
+    pairs; каждый тик - шаг геометрического блуждания цены пары. pairs -
+    число синтетических пар (SYN0000_USD, ...) или список имён: по
+    умолчанию лента не трогает курсы настоящих валют, иначе её цены
+    попали бы в заявки, оповещения и стоимость портфелей.
+    """
+
+    _SECONDS_PER_YEAR = 365 * 24 * 3600
+
+    def __init__(self, pairs=10, tick_rate: float = 1000.0,
+                 volatility: float = 0.8, start_price: float = 100.0,
+                 seed: int = None, source: str = "RandomWalkFeed"):
+        if isinstance(pairs, int):
+            pairs = [f"SYN{i:04d}_{config.BASE_CURRENCY}" for i in range(pairs)]
+        self.pairs = list(pairs)
+        self.tick_rate = float(tick_rate)
+        self.source = source
+        self._prices = {pair: float(start_price) for pair in self.pairs}
+        self._random = random.Random(seed)
+        dt = 1.0 / self.tick_rate / self._SECONDS_PER_YEAR
+        self._deviation = volatility * math.sqrt(dt)
+        self._mean = -volatility ** 2 / 2 * dt
+
+    def ticks(self, stop: threading.Event) -> Iterator[Tick]:
+        started = time.monotonic()
+        emitted = 0
+        choice, gauss = self._random.choice, self._random.gauss
+        while not stop.is_set():
+            # Сколько тиков должно было выйти к этому моменту
+            due = int((time.monotonic() - started) * self.tick_rate)
+            if due <= emitted:
+                time.sleep(min(0.01, (emitted + 1 - due) / self.tick_rate))
+                continue
+            now = time.time()
+            for _ in range(due - emitted):
+                pair = choice(self.pairs)
+                price = self._prices[pair] * math.exp(
+                    self._mean + self._deviation * gauss(0.0, 1.0))
+                self._prices[pair] = price
+                yield pair, price, now, self.source
+            emitted = due
+
+
+class TickCoalescer:
+    """Последний тик каждой пары с момента предыдущей выборки"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latest: Dict[str, Tick] = {}
+        self.received = 0
+
+    def offer(self, tick: Tick):
+        with self._lock:
+            self._latest[tick[0]] = tick
+            self.received += 1
+
+    def drain(self) -> Dict[str, Dict]:
+        """Накопленные пары в формате курсов RatesUpdater.apply_rates"""
+        with self._lock:
+            latest, self._latest = self._latest, {}
+        return {
+            pair: {"rate": rate, "updated_at": timestamp, "source": source}
+            for pair, rate, timestamp, source in latest.values()
+        }
+
+
+class StreamIngestor:
+    """Приём тиков: поток чтения наполняет TickCoalescer, а цикл записи
+    раз в window секунд сохраняет накопленное одной пачкой.
+
+    Если запись пачки длится дольше окна, следующая просто забирает
+    больше свёрнутых тиков: чтение от записи не отстаёт и не копит
+    очередь.
+    """
+
+    def __init__(self, source, window: float = None, updater: RatesUpdater = None):
+        self.source = source
+        self.window = config.STREAM_WINDOW if window is None else window
+        self.updater = updater or RatesUpdater(providers=[])
+        self.coalescer = TickCoalescer()
+        self.flushes = 0
+        self.written = 0
+        self.error = None
+
+    def _read(self, stop: threading.Event):
+        try:
+            for tick in self.source.ticks(stop):
+                self.coalescer.offer(tick)
+        except Exception as e:
+            self.error = e
+            logger.error(f"Ошибка чтения ленты: {e}")
+        finally:
+            stop.set()
+
+    def flush(self) -> int:
+        """Сохранить накопленные тики; возвращает число записанных пар"""
+        batch = self.coalescer.drain()
+        if not batch:
+            return 0
+        changes = self.updater.apply_rates(batch, report=logger.info)
+        self.flushes += 1
+        self.written += len(changes)
+        return len(changes)
+
+    def run(self, stop: threading.Event = None, duration: float = None) -> Dict:
+        """Принимать тики до остановки (stop), конца ленты или duration"""
+        stop = stop or threading.Event()
+        reader = threading.Thread(target=self._read, args=(stop,),
+                                  name="tick-reader", daemon=True)
+        started = time.monotonic()
+        reader.start()
+        last_report = started
+        try:
+            while not stop.wait(self.window):
+                self.flush()
+                now = time.monotonic()
+                if duration is not None and now - started >= duration:
+                    stop.set()
+                if now - last_report >= config.STREAM_REPORT_INTERVAL:
+                    last_report = now
+                    logger.info(f"Лента: тиков {self.coalescer.received}, "
+                                f"пачек {self.flushes}, записано пар {self.written}")
+        finally:
+            stop.set()  # при ошибке записи поток чтения тоже завершается
+            reader.join()
+        self.flush()  # хвост, пришедший до остановки
+        return self.stats(time.monotonic() - started)
+
+    def stats(self, seconds: float) -> Dict:
+        return {
+            "ticks": self.coalescer.received,
+            "flushes": self.flushes,
+            "written": self.written,
+            "seconds": seconds,
+        }
+
+
+class FeedServer(socketserver.ThreadingTCPServer):
+    """TCP-сервер тестовой ленты: каждый клиент получает свой поток тиков"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, feed: RandomWalkFeed, address: Tuple[str, int]):
+        self.feed = feed
+        self.stop = threading.Event()
+        super().__init__(address, _FeedHandler)
+
+    def shutdown(self):
+        self.stop.set()  # завершает потоки клиентов
+        super().shutdown()
+        self.server_close()
+
+
+class _FeedHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        try:
+            for tick in self.server.feed.ticks(self.server.stop):
+                self.request.sendall(format_tick(*tick))
+        except OSError:
+            pass  # клиент отключился
+
+
+def serve_feed(feed: RandomWalkFeed, host: str = "127.0.0.1",
+               port: int = 0) -> FeedServer:
+    """Запустить тестовую ленту по TCP в фоновом потоке.
+
+    server_address сервера - фактический адрес, shutdown() - остановка.
+    """
+    server = FeedServer(feed, (host, port))
+    threading.Thread(target=server.serve_forever, name="tick-feed",
+                     daemon=True).start()
+    return server
+
+
+def parse_address(address: str) -> Tuple[str, int]:
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="streaming")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    feed_parser = commands.add_parser("feed", help="Тестовая лента по TCP")
+    feed_parser.add_argument("--host", default="127.0.0.1")
+    feed_parser.add_argument("--port", type=int, default=config.STREAM_PORT)
+    feed_parser.add_argument("--tick-rate", type=float, default=1000.0)
+
+    ingest_parser = commands.add_parser("ingest", help="Приём тиков")
+    ingest_parser.add_argument("--connect", metavar="HOST:PORT",
+                               help="Адрес ленты (без него - встроенная лента)")
+    ingest_parser.add_argument("--window", type=float, default=config.STREAM_WINDOW)
+    ingest_parser.add_argument("--duration", type=float)
+    ingest_parser.add_argument("--tick-rate", type=float, default=1000.0)
+    args = parser.parse_args()
+
+    if args.command == "feed":
+        server = serve_feed(RandomWalkFeed(tick_rate=args.tick_rate),
+                            args.host, args.port)
+        print(f"Лента: {server.server_address[0]}:{server.server_address[1]}, "
+              f"{args.tick_rate:.0f} тиков/с. Ctrl+C - остановка")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
+        return
+
+    if args.connect:
+        source = SocketTickSource(*parse_address(args.connect))
+    else:
+        source = RandomWalkFeed(tick_rate=args.tick_rate)
+    ingestor = StreamIngestor(source, args.window)
+    stop = threading.Event()
+    try:
+        stats = ingestor.run(stop, args.duration)
+    except KeyboardInterrupt:
+        stop.set()
+        ingestor.flush()
+        stats = ingestor.stats(0.0)
+    print(f"Тиков: {stats['ticks']}, пачек: {stats['flushes']}, "
+          f"записано пар: {stats['written']}")
+
+
+if __name__ == "__main__":
+    main()
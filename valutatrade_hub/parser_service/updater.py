@@ -1,48 +1,185 @@
-import json
-from datetime import datetime
-from pathlib import Path
+import logging
+import threading
 
+from ..core.alerts import alert_manager
+from ..core.orders import order_book
+from ..core.utils import to_epoch, wall_clock
+from ..core.valuation import valuation_history
+from ..infra.events import TOPIC_RATES, publish
+from ..infra.locks import file_lock
+from ..infra.settings import settings
+from ..infra.shared_rates import SharedRateTable
 from . import config
-from .api_clients import CoinGeckoClient, ExchangeRateApiClient
+from .api_clients import ReplayClient, get_provider, record_response
+from .storage import DataStorage
+
+logger = logging.getLogger(__name__)
+
+# Чтение, слияние и запись rates.json выполняются по одному: внутри
+# процесса - под _apply_lock, между процессами - под flock rates.lock.
+# Под ними же публикуется таблица в разделяемой памяти, у которой должен
+# быть один писатель
+_apply_lock = threading.Lock()
+_shared_table = None
+
+
+def diff_rates(old_pairs: dict, new_pairs: dict) -> dict:
+    """Пары, которых не было или курс которых изменился"""
+    return {
+        pair: info for pair, info in new_pairs.items()
+        if pair not in old_pairs or old_pairs[pair].get("rate") != info["rate"]
+    }
+
+
+def _normalize_timestamps(pairs: dict, default: float) -> dict:
+    """updated_at каждой пары в секундах epoch (строки разбираются один раз)"""
+    normalized = {}
+    for pair, info in pairs.items():
+        try:
+            updated_at = to_epoch(info.get("updated_at"))
+        except ValueError:
+            updated_at = default
+        normalized[pair] = {**info, "updated_at": updated_at}
+    return normalized
 
 
 class RatesUpdater:
-    def __init__(self):
-        self.coingecko_client = CoinGeckoClient()
-        self.exchangerate_client = ExchangeRateApiClient()
+    def __init__(self, providers=None):
+        # Провайдеры создаются из реестра по конфигурации развёртывания
+        self.clients = {
+            name: get_provider(name, **config.PROVIDER_OPTIONS.get(name, {}))
+            for name in (config.PROVIDERS if providers is None else providers)
+        }
+        self.last_changes = {}
+    
+    def _publish_shared(self, pairs: dict):
+        """Публикация снимка курсов в разделяемую память (под _apply_lock)"""
+        global _shared_table
+        try:
+            if _shared_table is None:
+                _shared_table = SharedRateTable.create(settings.SHARED_RATES_SEGMENT)
+            _shared_table.publish(pairs)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Не удалось опубликовать курсы в shared memory: {e}")
+    
+    def apply_rates(self, fetched: dict, report=print) -> dict:
+        """Применить полученные курсы к текущему снимку.
+
+        В rates.json попадают только изменившиеся пары, версия снимка
+        растёт только при реальном изменении, в историю пишутся только
+        изменения; без изменений rates.json не переписывается.
+        Подтверждённые без изменений курсы отмечаются в
+        rate_confirmations.json ({пара: время}), чтобы они не устаревали
+        по RATES_TTL. Возвращает изменившиеся пары ({пара: данные}),
+        по которым подписчики сбрасывают свои кеши выборочно.
+        Сообщения для пользователя передаются в report. Одновременные
+        вызовы (лента, планировщик, другой процесс) не теряют пары друг
+        друга: снимок читается и пишется под общей блокировкой.
+        """
+        refreshed_at = wall_clock()
+        fetched = _normalize_timestamps(fetched, refreshed_at)
+        
+        storage = DataStorage()
+        with _apply_lock, file_lock(storage.data_dir / "rates.lock"):
+            snapshot = storage.load_rates()
+            old_pairs = snapshot.get("pairs", {})
+            
+            changes = diff_rates(old_pairs, fetched)
+            self.last_changes = changes
+            
+            # Снимки старого формата со строковыми датами переводятся заодно
+            pairs = {**_normalize_timestamps(old_pairs, 0.0), **changes}
+            # confirmed_at в rates.json - от прежнего формата
+            confirmed_at = {
+                **snapshot.get("confirmed_at", {}),
+                **storage.load_confirmations(),
+                **{pair: info["updated_at"] for pair, info in fetched.items()},
+            }
+            version = snapshot.get("version", 0) + (1 if changes else 0)
+            storage.save_confirmations(confirmed_at)
+            if changes:
+                storage.save_rates({
+                    "pairs": pairs,
+                    "version": version,
+                    "last_refresh": refreshed_at,
+                })
+            self._publish_shared({
+                pair: {**info, "updated_at": max(info["updated_at"],
+                                                 confirmed_at.get(pair, 0.0))}
+                for pair, info in pairs.items()
+            })
+            if changes:
+                storage.append_historical([
+                    {"pair": pair, "version": version, "recorded_at": refreshed_at,
+                     **info}
+                    for pair, info in sorted(changes.items())
+                ])
+        
+        # Отложенные заявки исполняются по только что сохранённым курсам;
+        # проверяются все пары, т.к. новая заявка может сработать и без
+        # изменения курса
+        for order in order_book.on_rates(pairs):
+            status = "исполнена" if order["executed"] else "отклонена"
+            report(f"Заявка #{order['order_id']} {status}: {order['message']}")
+        
+        if not changes:
+            return changes
+        
+        try:
+            valuation_history.apply_rate_changes(old_pairs, changes)
+        except OSError as e:
+            logger.warning(f"Не удалось обновить ряды стоимости: {e}")
+        
+        fired_alerts = alert_manager.on_rates(old_pairs, changes)
+        if fired_alerts:
+            report(f"Сработало оповещений: {len(fired_alerts)}")
+        
+        publish(TOPIC_RATES, {
+            "changed": sorted(changes),
+            "version": version,
+            "last_refresh": refreshed_at,
+        })
+        return changes
     
-    def run_update(self, source: str = None):
+    def run_update(self, source: str = None, cancel=None, report=print):
+        """Получить курсы у провайдеров и применить их.
+
+        cancel - threading.Event: отмена проверяется перед каждым
+        провайдером и перед сохранением, начатый запрос дорабатывает до
+        конца (или до таймаута). Ход обновления передаётся в report
+        (фоновое обновление передаёт logger.info).
+        """
         all_rates = {}
         
-        # Обновление от CoinGecko
-        if not source or source == "coingecko":
-            rates = self.coingecko_client.fetch_rates()
-            if rates:
-                all_rates.update(rates)
-                print(f"CoinGecko: получено {len(rates)} курсов")
+        if source and source not in self.clients:
+            # Зарегистрированный, но не настроенный провайдер
+            self.clients[source] = get_provider(
+                source, **config.PROVIDER_OPTIONS.get(source, {}))
         
-        # Обновление от ExchangeRate-API
-        if not source or source == "exchangerate":
-            rates = self.exchangerate_client.fetch_rates()
+        for name, client in self.clients.items():
+            if source and name != source:
+                continue
+            if cancel is not None and cancel.is_set():
+                report("Обновление курсов отменено")
+                return False
+            report(f"{client.name}: запрос курсов")
+            rates = client.fetch_rates()
             if rates:
+                # Воспроизведённые ответы повторно не записываются
+                if config.RECORD_FILE and not isinstance(client, ReplayClient):
+                    record_response(config.RECORD_FILE, name, rates)
                 all_rates.update(rates)
-                print(f"ExchangeRate-API: получено {len(rates)} курсов")
+                report(f"{client.name}: получено {len(rates)} курсов")
+        
+        if cancel is not None and cancel.is_set():
+            # Полученные курсы не применяются: отмена до сохранения
+            report("Обновление курсов отменено")
+            return False
         
-        # Сохранение в rates.json
         if all_rates:
-            result = {
-                "pairs": all_rates,
-                "last_refresh": datetime.now().isoformat()
-            }
-            
-            filepath = Path(config.RATES_FILE)
-            filepath.parent.mkdir(exist_ok=True)
-            
-            with open(filepath, 'w', encoding='utf-8') as f:
-                json.dump(result, f, indent=2, default=str)
-            
-            print(f"Обновлено {len(all_rates)} курсов")
+            changes = self.apply_rates(all_rates, report)
+            report(f"Изменилось {len(changes)} из {len(all_rates)} курсов")
             return True
         
-        print("Не удалось получить курсы")
+        report("Не удалось получить курсы")
         return False
\ No newline at end of file
@@ -0,0 +1,172 @@
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+from .infra.settings import settings
+
+# Виды спанов и коды статуса в нумерации OTLP
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_CLIENT = 3
+STATUS_UNSET = 0
+STATUS_ERROR = 2
+
+_SERVICE_NAME = "valutatrade_hub"
+
+_current_span = contextvars.ContextVar("valutatrade_current_span", default=None)
+
+
+def _attribute(key: str, value: Any) -> Dict:
+    """Атрибут в формате OTLP JSON"""
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+class Span:
+    """Один спан трассы"""
+
+    def __init__(self, name: str, parent: Optional["Span"], kind: int,
+                 attributes: Dict):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent = parent
+        self.kind = kind
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.status = {"code": STATUS_UNSET}
+        # Завершённые потомки копятся в корне и выгружаются вместе с ним
+        self.finished = [] if parent is None else parent.finished
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def record_error(self, error: BaseException):
+        self.status = {"code": STATUS_ERROR, "message": str(error)}
+        self.attributes["exception.type"] = type(error).__name__
+
+    def to_otlp(self) -> Dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [
+                _attribute(key, value) for key, value in self.attributes.items()
+            ],
+            "status": self.status,
+        }
+        if self.parent is not None:
+            span["parentSpanId"] = self.parent.span_id
+        return span
+
+
+class Tracer:
+    """Лёгкая трассировка со спанами, вложенными через contextvars.
+
+    Каждая завершённая трасса (корневой спан со всеми потомками)
+    дописывается в файл одной строкой в формате OTLP JSON
+    (ExportTraceServiceRequest), который читают локальные инструменты.
+    В выключенном состоянии span() ничего не создаёт.
+    """
+
+    def __init__(self, path=None):
+        # Путь по умолчанию - при первой записи: settings.data_dir() при
+        # импорте запустил бы горячий уровень
+        self._path = Path(path) if path else None
+        self.enabled = os.getenv("VALUTATRADE_TRACE", "") not in ("", "0")
+        self._lock = threading.Lock()
+
+    @property
+    def path(self) -> Path:
+        if self._path is None:
+            self._path = settings.data_dir() / "traces.jsonl"
+        return self._path
+
+    def enable(self, path=None):
+        if path:
+            self._path = Path(path)
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    @contextmanager
+    def span(self, name: str, kind: int = SPAN_KIND_INTERNAL, **attributes):
+        if not self.enabled:
+            yield None
+            return
+
+        current = Span(name, _current_span.get(), kind, attributes)
+        token = _current_span.set(current)
+        try:
+            yield current
+        except BaseException as e:
+            current.record_error(e)
+            raise
+        finally:
+            current.end_ns = time.time_ns()
+            _current_span.reset(token)
+            current.finished.append(current)
+            if current.parent is None:
+                self._export(current.finished)
+
+    def _export(self, spans):
+        request = {
+            "resourceSpans": [{
+                "resource": {
+                    "attributes": [_attribute("service.name", _SERVICE_NAME)],
+                },
+                "scopeSpans": [{
+                    "scope": {"name": _SERVICE_NAME},
+                    "spans": [span.to_otlp() for span in spans],
+                }],
+            }],
+        }
+        line = json.dumps(request, ensure_ascii=False) + "\n"
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+
+# Глобальный экземпляр
+tracer = Tracer()
+
+
+def span(name: str, kind: int = SPAN_KIND_INTERNAL, **attributes):
+    """Контекстный менеджер спана глобального трассировщика"""
+    return tracer.span(name, kind, **attributes)
+
+
+def traced(name: str = None, kind: int = SPAN_KIND_INTERNAL):
+    """Декоратор: выполнить функцию внутри спана"""
+
+    def decorator(func: Callable) -> Callable:
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            with tracer.span(span_name, kind):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator